@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import platform
+import resource
+import subprocess
+from glob import glob
+from datetime import datetime, timezone
+from configparser import ConfigParser
+from argparse import ArgumentParser, SUPPRESS
+
+import numpy
+
+
+# metrics compared against the baseline, larger is worse
+compared_metrics = (
+    'fit_time',
+    'tune_epoch_time',
+    'tune_batch_time',
+    'predict_crisp_time',
+    'predict_fuzzy_time',
+    'peak_rss',
+)
+
+
+def make_synthetic(n_rows, n_features, seed=0):
+    '''
+    Piecewise target of the first features with noise, the remaining
+    features are irrelevant
+    :returns: tuple of features and target
+    '''
+    random = numpy.random.default_rng(seed)
+    features = random.normal(size=(n_rows, n_features))
+    target = (
+        numpy.sign(features[:, 0]) * 2 +
+        numpy.abs(features[:, 1 % n_features]) +
+        features[:, 2 % n_features] * (features[:, 3 % n_features] > 0) +
+        random.normal(scale=0.1, size=n_rows)
+    )
+    return features, target
+
+
+def load_case_data(case):
+    '''
+    :returns: tuple of x_train, y_train, x_test
+    '''
+    if case['kind'] == 'synthetic':
+        n_train = case['rows']
+        (features, target) = make_synthetic(
+            n_train + case['test_rows'], case['features'])
+        return features[:n_train], target[:n_train], features[n_train:]
+
+    from fingers_crossed import load_dataset
+
+    config = ConfigParser()
+    with open(case['config']) as config_file:
+        config.read_file(config_file)
+    arrays = load_dataset(case['csv'], config)
+    return arrays['x_train'], arrays['y_train'], arrays['x_test']
+
+
+def run_case(case):
+    '''
+    Times fit, tune and predict of one case, meant to run in a fresh
+    process so that the peak resident set size belongs to the case alone
+    :returns: dict of metrics
+    '''
+    from datools.gradients.optimizers import Adam
+    from datools.regression.fuzzy_decision_trees import (
+        Fuzzy_Decision_Tree_Regressor,
+    )
+
+    (x_train, y_train, x_test) = load_case_data(case)
+    model = Fuzzy_Decision_Tree_Regressor(
+        min_count=case['min_count'],
+        min_impurity_drop=case['min_impurity_drop'],
+        max_bins=case['max_bins'],
+        membership=case['membership'])
+
+    start = time.perf_counter()
+    model.fit(x_train, y_train)
+    fit_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    model.predict(x_test)
+    predict_crisp_time = time.perf_counter() - start
+
+    losses = model.tune(
+        x_train, y_train, batch_size=case['batch_size'],
+        epochs=case['epochs'], ybar_optimizer=Adam(), gain_optimizer=Adam(),
+        threshold_optimizer=Adam())
+    tune_time = model.tune_report.wall_time
+    n_epochs = max(losses.shape[0], 1)
+    n_batches = max(losses.size, 1)
+
+    start = time.perf_counter()
+    model.predict(x_test)
+    predict_fuzzy_time = time.perf_counter() - start
+
+    # kilobytes on Linux, bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        peak_rss *= 1024
+
+    return {
+        'train_rows': x_train.shape[0],
+        'test_rows': x_test.shape[0],
+        'features': x_train.shape[1],
+        'n_nodes': int(model._compiled.n_nodes),
+        'depth': int(model._compiled.depth),
+        'fit_time': fit_time,
+        'tune_time': tune_time,
+        'tune_epoch_time': tune_time / n_epochs,
+        'tune_batch_time': tune_time / n_batches,
+        'predict_crisp_time': predict_crisp_time,
+        'predict_fuzzy_time': predict_fuzzy_time,
+        'peak_rss': peak_rss,
+    }
+
+
+def make_cases(args):
+    cases = list()
+    settings = {
+        'epochs': args.epochs,
+        'batch_size': args.batch_size,
+        'max_bins': args.max_bins,
+        'membership': args.membership,
+    }
+
+    csv_paths = sorted(glob(os.path.join(args.data, '*', '*.csv')))
+    if args.datasets is not None:
+        csv_paths = [
+            path for path in csv_paths
+            if os.path.relpath(path, args.data)[:-len('.csv')]
+            in args.datasets
+        ]
+
+    for csv_path in csv_paths:
+        config_path = csv_path[:-len('.csv')] + '.ini'
+        config = ConfigParser()
+        with open(config_path) as config_file:
+            config.read_file(config_file)
+
+        name = os.path.relpath(csv_path, args.data)[:-len('.csv')]
+        cases.append(dict(
+            settings,
+            name=name,
+            kind='dataset',
+            csv=csv_path,
+            config=config_path,
+            min_count=int(config['architecture']['min_count']),
+            min_impurity_drop=int(
+                config['architecture']['min_impurity_drop']),
+        ))
+
+    for n_rows in args.rows:
+        for n_features in args.features:
+            cases.append(dict(
+                settings,
+                name=f'synthetic-{n_rows}x{n_features}',
+                kind='synthetic',
+                rows=n_rows,
+                test_rows=max(n_rows // 10, 1),
+                features=n_features,
+                # leaves of roughly a thousandth of the rows
+                min_count=max(n_rows // 1000, 10),
+                min_impurity_drop=0,
+            ))
+
+    return cases
+
+
+def run_in_subprocess(case, timeout):
+    '''
+    :returns: dict of metrics, with status 'ok', 'timeout' or 'failed'
+    '''
+    try:
+        process = subprocess.run(
+            [sys.executable, __file__, '--run-case', json.dumps(case)],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            timeout=timeout, text=True)
+    except subprocess.TimeoutExpired:
+        return {'status': 'timeout'}
+
+    if process.returncode != 0:
+        return {'status': 'failed', 'error': process.stderr[-2000:]}
+
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    result['status'] = 'ok'
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def find_regressions(run, baseline, threshold, min_time):
+    '''
+    Metrics of cases in both runs that grew by more than the threshold,
+    times shorter than min_time in both runs are too noisy to compare
+    :returns: list of (case, metric, baseline value, value)
+    '''
+    regressions = list()
+    for name, result in run['results'].items():
+        base = baseline['results'].get(name)
+        if base is None or base['status'] != 'ok' or result['status'] != 'ok':
+            continue
+
+        for metric in compared_metrics:
+            if metric not in base or metric not in result:
+                continue
+            if metric.endswith('_time') and \
+                    max(base[metric], result[metric]) < min_time:
+                continue
+            if result[metric] > base[metric] * (1 + threshold):
+                regressions.append(
+                    (name, metric, base[metric], result[metric]))
+
+    return regressions
+
+
+def read_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path) as json_file:
+        return json.load(json_file)
+
+
+def write_json(path, value):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w') as json_file:
+        json.dump(value, json_file, indent=1)
+    os.replace(temp_path, path)
+
+
+def format_metric(metric, value):
+    if metric == 'peak_rss':
+        return f'{value / 2 ** 20:.1f} MiB'
+    return f'{value:.4f} s'
+
+
+if __name__ == '__main__':
+    aparser = ArgumentParser(
+        description='Time fit, tune and predict, every case in a fresh '
+                    'process'
+    )
+
+    aparser.add_argument('--data', type=str, default='data')
+    aparser.add_argument('--datasets', type=str, nargs='*', default=None,
+                         help='datasets such as S1/S1, all if not given')
+    aparser.add_argument('--rows', type=int, nargs='*',
+                         default=[10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6])
+    aparser.add_argument('--features', type=int, nargs='*',
+                         default=[5, 20, 200])
+    aparser.add_argument('--epochs', type=int, default=2)
+    aparser.add_argument('--batch-size', type=int, default=256)
+    aparser.add_argument('--max-bins', type=int, default=None)
+    aparser.add_argument('--membership', type=str, default='sigmoid',
+                         help='membership function of the splits')
+    aparser.add_argument('--timeout', type=float, default=3600,
+                         help='seconds after which a case is abandoned')
+    aparser.add_argument('--history', type=str,
+                         default='benchmarks/history.json')
+    aparser.add_argument('--baseline', type=str,
+                         default='benchmarks/baseline.json')
+    aparser.add_argument('--save-baseline', action='store_true',
+                         help='store this run as the baseline')
+    aparser.add_argument('--threshold', type=float, default=0.2,
+                         help='relative growth of a metric flagged as a '
+                              'regression')
+    aparser.add_argument('--min-time', type=float, default=0.01,
+                         help='seconds below which times are not compared')
+    # internal, runs one case given as JSON and prints its metrics
+    aparser.add_argument('--run-case', type=str, help=SUPPRESS)
+    args = aparser.parse_args()
+
+    if args.run_case is not None:
+        print(json.dumps(run_case(json.loads(args.run_case))))
+        sys.exit(0)
+
+    run = {
+        'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'machine': platform.node(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': numpy.__version__,
+        'results': dict(),
+    }
+
+    for case in make_cases(args):
+        result = run_in_subprocess(case, args.timeout)
+        run['results'][case['name']] = result
+
+        if result['status'] == 'ok':
+            print(
+                f'{case["name"]:>24}: {result["n_nodes"]:>6} nodes, '
+                f'fit {result["fit_time"]:.3f} s, '
+                f'tune {result["tune_epoch_time"]:.3f} s/epoch, '
+                f'predict {result["predict_fuzzy_time"]:.3f} s, '
+                f'{format_metric("peak_rss", result["peak_rss"])}')
+        else:
+            print(f'{case["name"]:>24}: {result["status"]}')
+
+    history = read_json(args.history, list())
+    history.append(run)
+    write_json(args.history, history)
+
+    if args.save_baseline:
+        write_json(args.baseline, run)
+        sys.exit(0)
+
+    baseline = read_json(args.baseline, None)
+    if baseline is None:
+        print('no baseline, store one with --save-baseline')
+        sys.exit(0)
+
+    regressions = find_regressions(
+        run, baseline, args.threshold, args.min_time)
+    for name, metric, base, value in regressions:
+        print(
+            f'regression {name} {metric}: {format_metric(metric, base)} -> '
+            f'{format_metric(metric, value)}')
+
+    sys.exit(1 if regressions else 0)
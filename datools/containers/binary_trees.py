@@ -78,12 +78,18 @@ class Binary_Tree:
         '_root',
         '_leaves',
         '_nodes',
+        '_node_set',
+        '_levels',
+        '_ordering',
     )
 
     def __init__(self):
         self._root = None
-        self._leaves = list()
+        # dict keeps insertion order and removes in constant time
+        self._leaves = dict()
         self._nodes = list()
+        self._node_set = set()
+        self._invalidate()
 
     @property
     def nodes(self):
@@ -98,7 +104,7 @@ class Binary_Tree:
         yield from self._leaves
 
     def __contains__(self, node):
-        return node in self._nodes
+        return node in self._node_set
 
     def add_node(self, node, parent=None, left_side=True):
         '''
@@ -107,7 +113,7 @@ class Binary_Tree:
         :param left_side bool: True if node is on left side of parent
         :param parent Node: parent of node, None for root node
         '''
-        assert node not in self._nodes, 'node already in tree'
+        assert node not in self._node_set, 'node already in tree'
 
         if self._root is None:
             assert parent is None, 'root node shall not have parent'
@@ -115,10 +121,9 @@ class Binary_Tree:
 
         else:
             assert parent is not None, 'missing parent'
-            assert parent in self._nodes, 'unrecognized parent'
+            assert parent in self._node_set, 'unrecognized parent'
 
-            if parent in self._leaves:
-                self._leaves.remove(parent)
+            self._leaves.pop(parent, None)
 
             if left_side:
                 assert parent._l_child is None, 'existing l_child'
@@ -130,14 +135,54 @@ class Binary_Tree:
                 node._is_on_left = False
 
         self._nodes.append(node)
-        self._leaves.append(node)
+        self._node_set.add(node)
+        self._leaves[node] = None
         node._l_child = None
         node._r_child = None
         node._parent = parent
+        self._invalidate()
 
+    def _invalidate(self):
+        '''
+        Drops the cached traversal orders, called on every mutation
+        '''
+        self._levels = None
+        self._ordering = None
+
+    def levels(self):
+        '''
+        Returns nodes grouped by depth, each group in level order
+        '''
+        if self._levels is None:
+            self._levels = list()
+            level = [] if self._root is None else [self._root]
+
+            while level:
+                self._levels.append(tuple(level))
+                level = [
+                    child
+                    for node in level
+                    for child in (node._l_child, node._r_child)
+                    if child is not None
+                ]
+
+        return self._levels
+
+    def _get_ordering(self):
+        if self._ordering is None:
+            self._ordering = tuple(
+                node for level in self.levels() for node in level)
+
+        return self._ordering
 
     def topological_ordering(self):
-        if self._root is not None:
-            yield self._root
-            yield from self._root.descendants
+        '''
+        Returns nodes in level-order traversal root, left, right, ...
+        '''
+        return iter(self._get_ordering())
 
+    def reverse_topological_ordering(self):
+        '''
+        Returns nodes in reverse level order, children before parents
+        '''
+        return reversed(self._get_ordering())
@@ -0,0 +1,147 @@
+'''
+Content-addressed cache of arrays and files on disk
+'''
+
+import os
+import shutil
+import hashlib
+import tempfile
+import numpy
+from types import SimpleNamespace
+
+
+class Disk_Cache:
+    '''
+    Stores entries in folders named by a key, usually a hash of everything
+    the entry was computed from. An entry holds arrays as .npy files and
+    any other files written by the caller. Entries are never modified once
+    written. When the cache grows above its size limit, the least recently
+    used entries are deleted.
+
+    Processes may share a cache folder, entries are written to a temporary
+    folder which is renamed into place.
+    '''
+
+    __slots__ = (
+        '_directory',
+        '_max_bytes',
+    )
+
+    def __init__(self, directory, max_bytes=1 << 30):
+        '''
+        :param directory str: folder of the cache, created if missing
+        :param max_bytes int: size limit of all entries together
+        '''
+        assert max_bytes > 0
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._max_bytes = max_bytes
+
+    @staticmethod
+    def make_key(*parts):
+        '''
+        Hash of a sequence of bytes or strings, every part is length prefixed
+        so that different splits of the same bytes make different keys
+        :returns: hexadecimal string
+        '''
+        digest = hashlib.sha256()
+        for part in parts:
+            if isinstance(part, str):
+                part = part.encode()
+            digest.update(len(part).to_bytes(8, 'little'))
+            digest.update(part)
+        return digest.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self._directory, key)
+
+    def get(self, key, mmap=False):
+        '''
+        Looks up an entry and marks it as recently used
+        :param key str: key of the entry
+        :param mmap bool: if True, arrays are read-only memory maps
+        :returns: namespace with the dict of arrays and the path of the
+            entry folder, None if there is no such entry
+        '''
+        path = self._entry_path(key)
+        try:
+            os.utime(path)
+            names = os.listdir(path)
+        except FileNotFoundError:
+            return None
+
+        arrays = {
+            name[:-len('.npy')]: numpy.load(
+                os.path.join(path, name), mmap_mode='r' if mmap else None)
+            for name in names if name.endswith('.npy')
+        }
+        return SimpleNamespace(arrays=arrays, path=path)
+
+    def put(self, key, arrays, write_func=None):
+        '''
+        Adds an entry unless one with the same key exists, then evicts the
+        least recently used entries above the size limit
+        :param key str: key of the entry
+        :param arrays dict: arrays stored by name
+        :param write_func: called with the entry folder to write other files
+        '''
+        path = self._entry_path(key)
+        if os.path.exists(path):
+            return
+
+        temp_path = tempfile.mkdtemp(prefix='.', dir=self._directory)
+        try:
+            for name, array in arrays.items():
+                numpy.save(os.path.join(temp_path, f'{name}.npy'), array)
+            if write_func is not None:
+                write_func(temp_path)
+            os.rename(temp_path, path)
+
+        except OSError:
+            # another process added the entry first
+            if not os.path.isdir(path):
+                raise
+
+        finally:
+            shutil.rmtree(temp_path, ignore_errors=True)
+
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        '''
+        Deletes the least recently used entries until the cache fits in its
+        size limit
+        :param keep str: key of an entry that is never deleted
+        '''
+        entries = list()
+        for entry in os.scandir(self._directory):
+            if entry.name.startswith('.') or not entry.is_dir():
+                continue
+            try:
+                entries.append((entry.stat().st_mtime, entry.name,
+                                _folder_size(entry.path)))
+            except FileNotFoundError:
+                continue
+
+        total = sum(size for _, _, size in entries)
+        for _, key, size in sorted(entries):
+            if total <= self._max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self._entry_path(key), ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        '''
+        Deletes all entries
+        '''
+        for entry in os.scandir(self._directory):
+            if entry.is_dir():
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def _folder_size(path):
+    return sum(
+        entry.stat().st_size for entry in os.scandir(path) if entry.is_file()
+    )
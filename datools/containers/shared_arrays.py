@@ -0,0 +1,52 @@
+'''
+Arrays in shared memory for worker processes
+'''
+
+import numpy
+from contextlib import contextmanager
+from multiprocessing.shared_memory import SharedMemory
+
+
+@contextmanager
+def shared_arrays(*arrays):
+    '''
+    Copies arrays into shared memory blocks that worker processes attach to
+    by name, the blocks are released on exit
+    :returns: list of (name, shape, dtype) of every array, to be passed to
+        attach_arrays in the workers
+    '''
+    blocks = list()
+    try:
+        for array in arrays:
+            block = SharedMemory(create=True, size=max(array.nbytes, 1))
+            blocks.append(block)
+            view = numpy.ndarray(array.shape, array.dtype, block.buf)
+            view[...] = array
+            del view
+
+        yield [
+            (block.name, array.shape, array.dtype.str)
+            for block, array in zip(blocks, arrays)
+        ]
+
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+def attach_arrays(shared):
+    '''
+    Read-only views of arrays shared by shared_arrays. The blocks must be
+    kept while the views are used and closed once they are released.
+    :param shared list: result of shared_arrays
+    :returns: tuple of the list of arrays and the list of blocks
+    '''
+    blocks = [SharedMemory(name=name) for name, _, _ in shared]
+    arrays = list()
+    for block, (_, shape, dtype) in zip(blocks, shared):
+        array = numpy.ndarray(shape, numpy.dtype(dtype), block.buf)
+        array.flags.writeable = False
+        arrays.append(array)
+
+    return arrays, blocks
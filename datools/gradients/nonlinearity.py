@@ -1,31 +1,176 @@
 '''
 Nonlinear functions
+
+The memberships Sigmoid, Softsign and Hard_Sigmoid rise from 0 to 1 with a
+slope of 1/4 at 0, so they are interchangeable as the fuzzy membership of a
+split. Every method takes an optional out array to write to. The out array
+of primitive may be the argument itself.
 '''
 
 __all__ = [
     'Sigmoid',
+    'Softsign',
+    'Hard_Sigmoid',
+    'Lorentzian',
+    'memberships',
 ]
 
 
 import numpy
 
 
-class Sigmoid:
-    def primitive(self, arr):
-        arr = numpy.asarray(arr)
-        arr = numpy.clip(arr, -500, 500)
-        return 1 / (1 + numpy.exp(-arr))
+class _Activation:
+    __slots__ = ('_dtype',)
+
+    def __init__(self, dtype=None):
+        '''
+        :param dtype: floating point type of the computation, the type of
+            the argument if None
+        '''
+        self._dtype = dtype
+
+    def _as_float(self, arr, out):
+        '''
+        :returns: tuple of the argument as a floating point array and the
+            array to write the result to
+        '''
+        arr = numpy.asarray(arr, dtype=self._dtype)
+        if not numpy.issubdtype(arr.dtype, numpy.floating):
+            arr = arr.astype(float)
+        if out is None:
+            out = numpy.empty_like(arr)
+        return arr, out
+
+    def primitive_and_derivative(self, arr, out=None):
+        '''
+        Primitive and derivative sharing their intermediate results
+        :param out tuple: arrays for the primitive and the derivative
+        :returns: tuple of the primitive and the derivative
+        '''
+        (primitive_out, derivative_out) = (None, None) if out is None else out
+        primitive = self.primitive(arr, out=primitive_out)
+        derivative = self.derivative_from_primitive(
+            primitive, out=derivative_out)
+        return primitive, derivative
+
+    def derivative(self, arr, out=None):
+        return self.primitive_and_derivative(arr, out=(None, out))[1]
+
+
+class Sigmoid(_Activation):
+    __slots__ = ()
+
+    def primitive(self, arr, out=None):
+        (arr, out) = self._as_float(arr, out)
+        # bound where exp(-arr) still fits the floating point type
+        bound = 80 if arr.dtype == numpy.float32 else 500
+        out = numpy.clip(arr, -bound, bound, out=out)
+        numpy.negative(out, out=out)
+        numpy.exp(out, out=out)
+        out += 1
+        return numpy.reciprocal(out, out=out)
+
+    def derivative_from_primitive(self, primitive, out=None):
+        '''
+        Derivative at the argument the primitive was computed from
+        '''
+        (primitive, out) = self._as_float(primitive, out)
+        numpy.subtract(1, primitive, out=out)
+        return numpy.multiply(primitive, out, out=out)
+
+
+class Softsign(_Activation):
+    '''
+    Rational membership 1/2 + x / (2 (2 + |x|)), without exp
+    '''
+
+    __slots__ = ()
+
+    def primitive(self, arr, out=None):
+        (arr, out) = self._as_float(arr, out)
+        denominator = numpy.abs(arr)
+        denominator += 2
+        out = numpy.divide(arr, denominator, out=out)
+        out *= 0.5
+        out += 0.5
+        return out
+
+    def primitive_and_derivative(self, arr, out=None):
+        # the derivative 1 / (2 + |x|)^2 reuses the denominator
+        (primitive_out, derivative_out) = (None, None) if out is None else out
+        (arr, derivative_out) = self._as_float(arr, derivative_out)
+        (_, primitive_out) = self._as_float(arr, primitive_out)
+
+        denominator = numpy.abs(arr, out=derivative_out)
+        denominator += 2
+        primitive = numpy.divide(arr, denominator, out=primitive_out)
+        primitive *= 0.5
+        primitive += 0.5
+
+        derivative = numpy.reciprocal(denominator, out=denominator)
+        numpy.square(derivative, out=derivative)
+        return primitive, derivative
+
+    def derivative_from_primitive(self, primitive, out=None):
+        # 1 / (2 + |x|)^2 = (1 - |2 primitive - 1|)^2 / 4
+        (primitive, out) = self._as_float(primitive, out)
+        numpy.multiply(primitive, 2, out=out)
+        out -= 1
+        numpy.abs(out, out=out)
+        numpy.subtract(1, out, out=out)
+        numpy.square(out, out=out)
+        out *= 0.25
+        return out
+
+
+class Hard_Sigmoid(_Activation):
+    '''
+    Piecewise linear membership clip(1/2 + x / 4, 0, 1)
+    '''
+
+    __slots__ = ()
+
+    def primitive(self, arr, out=None):
+        (arr, out) = self._as_float(arr, out)
+        out = numpy.multiply(arr, 0.25, out=out)
+        out += 0.5
+        return numpy.clip(out, 0, 1, out=out)
+
+    def derivative_from_primitive(self, primitive, out=None):
+        (primitive, out) = self._as_float(primitive, out)
+        inside = (primitive > 0) & (primitive < 1)
+        return numpy.multiply(inside, 0.25, out=out)
+
+
+class Lorentzian(_Activation):
+    '''
+    Bell-shaped 1 / (1 + x^2), not a membership of a split
+    '''
+
+    __slots__ = ()
+
+    def primitive(self, arr, out=None):
+        (arr, out) = self._as_float(arr, out)
+        out = numpy.square(arr, out=out)
+        out += 1
+        return numpy.reciprocal(out, out=out)
 
-    def derivative(self, arr):
-        primitive = self.primitive(arr)
-        return primitive * (1 - primitive)
+    def primitive_and_derivative(self, arr, out=None):
+        # the argument is needed as the primitive loses its sign
+        (primitive_out, derivative_out) = (None, None) if out is None else out
+        (arr, derivative_out) = self._as_float(arr, derivative_out)
 
+        # -2 x / (1 + x^2)^2
+        derivative = numpy.multiply(arr, -2, out=derivative_out)
+        primitive = self.primitive(arr, out=primitive_out)
+        derivative *= primitive
+        derivative *= primitive
+        return primitive, derivative
 
-class Lorentzian:
-    def primitive(self, arr):
-        arr = numpy.asarray(arr)
-        return 1 / (1 + numpy.square(arr))
 
-    def derivative(self, arr):
-        arr = numpy.asarray(arr)
-        return -2 * numpy.sqrt(1 + numpy.square(arr)) * arr
+# membership functions by name
+memberships = {
+    'sigmoid': Sigmoid,
+    'softsign': Softsign,
+    'hard_sigmoid': Hard_Sigmoid,
+}
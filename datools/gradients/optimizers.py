@@ -1,9 +1,27 @@
 '''
 Classes to produce corrective gradients
+
+The step optimizers work on a whole parameter vector at once. Gradients keep
+their shape and the optimizer state is kept per element, so one call per
+step updates every parameter of a group.
 '''
 
 
 import numpy
+from types import SimpleNamespace
+from collections import deque
+
+
+def _reindex_state(state, indices):
+    '''
+    Per-element state for a new parameter vector, zero for new parameters
+    '''
+    if numpy.ndim(state) == 0:
+        return state
+
+    # a parameter may be a row of several values
+    fresh = (indices < 0).reshape(indices.shape + (1,) * (state.ndim - 1))
+    return numpy.where(fresh, 0, state[indices])
 
 
 class Constant_Learning_Rate:
@@ -12,9 +30,12 @@ class Constant_Learning_Rate:
         self.epsilon = learning_rate
 
     def __call__(self, gradient):
-        g = numpy.asarray(gradient).reshape(-1)
+        g = numpy.asarray(gradient, dtype=float)
         return -self.epsilon * g
 
+    def reindex(self, indices):
+        pass
+
 
 class RMSProp:
     _delta = 1e-6
@@ -29,10 +50,18 @@ class RMSProp:
         self.r = 0
 
     def __call__(self, gradient):
-        g = numpy.asarray(gradient).reshape(-1)
+        g = numpy.asarray(gradient, dtype=float)
         self.r = self.rho * self.r + (1 - self.rho) * numpy.square(g)
         return -self.epsilon / numpy.sqrt(self._delta + self.r) * g
 
+    def reindex(self, indices):
+        '''
+        Carries the state over to a new parameter vector
+        :param indices ndarray: for every new parameter, the index of the
+            parameter it continues, -1 for a new parameter with fresh state
+        '''
+        self.r = _reindex_state(self.r, indices)
+
 
 class Adam:
     _delta = 1e-8
@@ -45,10 +74,12 @@ class Adam:
         self.rho2 = decay2
         self.s = 0
         self.r = 0
+
+        # number of steps, per element once parameters were reindexed
         self.t = 0
 
     def __call__(self, gradient):
-        g = numpy.asarray(gradient).reshape(-1)
+        g = numpy.asarray(gradient, dtype=float)
         self.t += 1
         self.s = self.rho1 * self.s + (1 - self.rho1) * g
         self.r = self.rho2 * self.r + (1 - self.rho2) * numpy.square(g)
@@ -57,4 +88,119 @@ class Adam:
 
         return -self.epsilon * shat / (numpy.sqrt(rhat) + self._delta)
 
-
+    def reindex(self, indices):
+        '''
+        Carries the state over to a new parameter vector
+        :param indices ndarray: for every new parameter, the index of the
+            parameter it continues, -1 for a new parameter with fresh state
+        '''
+        if numpy.ndim(self.s) != 0:
+            # new parameters need the bias correction of a first step
+            self.t = _reindex_state(
+                numpy.broadcast_to(self.t, numpy.shape(self.s)), indices)
+        self.s = _reindex_state(self.s, indices)
+        self.r = _reindex_state(self.r, indices)
+
+
+class LBFGS:
+    '''
+    Limited-memory BFGS for full-batch minimization. Unlike the optimizers
+    above it drives the whole optimization and calls back for the loss.
+    '''
+
+    def __init__(self, memory=10, max_iterations=100, tolerance=1e-9,
+                 max_line_search=20, armijo=1e-4):
+        assert memory >= 1
+        assert max_iterations >= 0
+        self.memory = memory
+        self.max_iterations = max_iterations
+        self.tolerance = tolerance
+        self.max_line_search = max_line_search
+        self.armijo = armijo
+
+    def _direction(self, g, s_list, y_list):
+        '''
+        Two-loop recursion, returns the approximate -H g
+        '''
+        q = g.copy()
+        alphas = list()
+
+        for s, y in zip(reversed(s_list), reversed(y_list)):
+            alpha = (s @ q) / (y @ s)
+            q -= alpha * y
+            alphas.append(alpha)
+
+        if s_list:
+            q *= (s_list[-1] @ y_list[-1]) / (y_list[-1] @ y_list[-1])
+        else:
+            q /= max(1, numpy.sqrt(g @ g))
+
+        for s, y, alpha in zip(s_list, y_list, reversed(alphas)):
+            beta = (y @ q) / (y @ s)
+            q += (alpha - beta) * s
+
+        return -q
+
+    def minimize(self, func, x0, callback=None):
+        '''
+        :param func: function of x returning (loss, gradient)
+        :param x0 ndarray: initial parameter vector
+        :param callback: called as callback(x, loss) after every iteration,
+            a true return value stops the minimization
+        :returns: namespace with x, loss, losses, iterations and
+            function_evaluations
+        '''
+        x = numpy.array(x0, dtype=float)
+        (loss, g) = func(x)
+        result = SimpleNamespace(
+            losses=[loss], iterations=0, function_evaluations=1)
+
+        s_list = deque(maxlen=self.memory)
+        y_list = deque(maxlen=self.memory)
+
+        for _ in range(self.max_iterations):
+            direction = self._direction(g, s_list, y_list)
+            slope = g @ direction
+
+            if slope >= 0:
+                # not a descent direction, restart from steepest descent
+                s_list.clear()
+                y_list.clear()
+                direction = self._direction(g, s_list, y_list)
+                slope = g @ direction
+
+            # backtracking line search with the Armijo condition
+            step = 1.0
+            for _ in range(self.max_line_search):
+                x_new = x + step * direction
+                (loss_new, g_new) = func(x_new)
+                result.function_evaluations += 1
+
+                if loss_new <= loss + self.armijo * step * slope:
+                    break
+                step /= 2
+            else:
+                break
+
+            s = x_new - x
+            y = g_new - g
+            if s @ y > 0:
+                s_list.append(s)
+                y_list.append(y)
+
+            converged = abs(loss - loss_new) <= self.tolerance * max(
+                abs(loss), abs(loss_new), 1)
+
+            (x, loss, g) = (x_new, loss_new, g_new)
+            result.losses.append(loss)
+            result.iterations += 1
+
+            if callback is not None and callback(x, loss):
+                break
+
+            if converged:
+                break
+
+        result.x = x
+        result.loss = loss
+        return result
@@ -0,0 +1,171 @@
+'''
+Named timers and counters for the hot paths of the regressors
+'''
+
+import json
+import time
+import threading
+
+
+class Instruments:
+    '''
+    Accumulates the total time and number of calls of named timers and the
+    totals of named counters. A counter either holds one total or one total
+    per key, such as a feature or a tree level. A callback receives events
+    like the loss of every batch as they happen.
+    '''
+
+    __slots__ = (
+        '_timers',
+        '_counters',
+        '_callback',
+        '_lock',
+    )
+
+    enabled = True
+
+    def __init__(self, callback=None):
+        '''
+        :param callback: called with the name of an event and a dict of
+            its values, for live metrics
+        '''
+        self._timers = dict()
+        self._counters = dict()
+        self._callback = callback
+        self._lock = threading.Lock()
+
+    def timer(self, name):
+        '''
+        Context manager adding the time spent in its block to a timer
+        :param name str: name of the timer
+        '''
+        return _Timer(self, name)
+
+    def _add_time(self, name, seconds):
+        with self._lock:
+            (total, calls) = self._timers.get(name, (0.0, 0))
+            self._timers[name] = (total + seconds, calls + 1)
+
+    def count(self, name, n=1, key=None):
+        '''
+        Adds to a counter
+        :param name str: name of the counter
+        :param n int: amount added
+        :param key: if given, adds to the total of this key of the counter
+        '''
+        with self._lock:
+            if key is None:
+                self._counters[name] = self._counters.get(name, 0) + n
+            else:
+                counter = self._counters.setdefault(name, dict())
+                counter[key] = counter.get(key, 0) + n
+
+    def emit(self, event, **values):
+        '''
+        Passes an event to the callback
+        :param event str: name of the event
+        '''
+        if self._callback is not None:
+            self._callback(event, values)
+
+    def reset(self):
+        with self._lock:
+            self._timers.clear()
+            self._counters.clear()
+
+    def summary(self):
+        '''
+        :returns: dict of the timers, each with its total seconds, number
+            of calls and mean seconds per call, and of the counters
+        '''
+        with self._lock:
+            timers = {
+                name: {
+                    'total': total,
+                    'calls': calls,
+                    'mean': total / calls,
+                }
+                for name, (total, calls) in sorted(self._timers.items())
+            }
+            counters = {
+                name: (
+                    dict(sorted(counter.items()))
+                    if isinstance(counter, dict) else counter
+                )
+                for name, counter in sorted(self._counters.items())
+            }
+
+        return {'timers': timers, 'counters': counters}
+
+    def write(self, path):
+        '''
+        Writes the summary as JSON
+        :param path str: file to write
+        '''
+        summary = self.summary()
+        for name, counter in summary['counters'].items():
+            if isinstance(counter, dict):
+                summary['counters'][name] = {
+                    str(key): total for key, total in counter.items()
+                }
+
+        with open(path, 'w') as summary_file:
+            json.dump(summary, summary_file, indent=1)
+
+
+class Null_Instruments:
+    '''
+    Stand-in for Instruments when instrumentation is off, every method does
+    nothing
+    '''
+
+    __slots__ = ()
+
+    enabled = False
+
+    def timer(self, name):
+        return _null_timer
+
+    def count(self, name, n=1, key=None):
+        pass
+
+    def emit(self, event, **values):
+        pass
+
+    def reset(self):
+        pass
+
+    def summary(self):
+        return {'timers': dict(), 'counters': dict()}
+
+
+class _Timer:
+    __slots__ = ('_instruments', '_name', '_start')
+
+    def __init__(self, instruments, name):
+        self._instruments = instruments
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._instruments._add_time(
+            self._name, time.perf_counter() - self._start)
+
+
+class _Null_Timer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_null_timer = _Null_Timer()
+
+# shared by all models without instrumentation
+null_instruments = Null_Instruments()
@@ -0,0 +1,672 @@
+'''
+Array-backed representation of fitted regression trees
+'''
+
+
+import json
+import struct
+import numpy
+from types import SimpleNamespace
+from ..gradients.nonlinearity import Sigmoid
+
+
+class Compiled_Tree:
+    '''
+    A fitted tree flattened into contiguous arrays, one entry per node.
+
+    Nodes are stored in level order, so the nodes of every depth occupy a
+    contiguous range and the children of a node are always stored after it.
+    Leaves have feature_col, left and right set to -1. The value of a node
+    is a scalar, or a vector of shape (n_outputs,) for several outputs.
+
+    Several trees joined by concatenate form a forest with one root per
+    tree in the first level, its prediction is the sum over the trees.
+    '''
+
+    __slots__ = (
+        'feature_col',
+        'threshold',
+        'gain',
+        'left',
+        'right',
+        'value',
+        'impurity',
+        'count',
+        'level_offsets',
+    )
+
+    def __init__(self, feature_col, threshold, gain, left, right, value,
+                 impurity, count, level_offsets):
+        self.feature_col = feature_col
+        self.threshold = threshold
+        self.gain = gain
+        self.left = left
+        self.right = right
+        self.value = value
+        self.impurity = impurity
+        self.count = count
+        self.level_offsets = level_offsets
+
+    @classmethod
+    def from_binary_tree(cls, tree):
+        '''
+        Flattens a tree of Binary_Tree_Node with split parameters
+        :param tree Binary_Tree: fitted tree
+        :returns: Compiled_Tree
+        '''
+        levels = tree.levels()
+        nodes = list(tree.topological_ordering())
+        index = {id(node): i for i, node in enumerate(nodes)}
+        n_nodes = len(nodes)
+
+        feature_col = numpy.full(n_nodes, -1, dtype=numpy.intp)
+        threshold = numpy.zeros(n_nodes)
+        gain = numpy.zeros(n_nodes)
+        left = numpy.full(n_nodes, -1, dtype=numpy.intp)
+        right = numpy.full(n_nodes, -1, dtype=numpy.intp)
+        value = numpy.empty((n_nodes,) + numpy.shape(nodes[0].ybar))
+        impurity = numpy.empty(n_nodes)
+        count = numpy.empty(n_nodes, dtype=numpy.intp)
+
+        for i, node in enumerate(nodes):
+            value[i] = node.ybar
+            impurity[i] = node.impurity
+            count[i] = node.count
+
+            if not node.is_leaf:
+                feature_col[i] = node.feature_col
+                threshold[i] = node.threshold
+                gain[i] = getattr(node, 'gain', 0)
+                left[i] = index[id(node.left_child)]
+                right[i] = index[id(node.right_child)]
+
+        level_offsets = numpy.cumsum([0] + [len(level) for level in levels])
+
+        return cls(feature_col, threshold, gain, left, right, value,
+                   impurity, count, level_offsets)
+
+    @classmethod
+    def concatenate(cls, trees, weights=None):
+        '''
+        Joins trees into a forest predicting the weighted sum of their
+        predictions. Level d of the forest holds level d of every tree, so
+        all trees are evaluated together one level at a time.
+        :param trees list: Compiled_Tree of every tree
+        :param weights ndarray: factor of the leaf values of every tree,
+            ones if None
+        :returns: Compiled_Tree
+        '''
+        n_trees = len(trees)
+        assert n_trees >= 1
+        if weights is None:
+            weights = numpy.ones(n_trees)
+        assert len(weights) == n_trees
+
+        # sizes[i, d] is the number of nodes of tree i at depth d
+        depth = max(tree.depth for tree in trees)
+        sizes = numpy.zeros((n_trees, depth + 1), dtype=numpy.intp)
+        for i, tree in enumerate(trees):
+            sizes[i, :tree.depth + 1] = numpy.diff(tree.level_offsets)
+
+        level_offsets = numpy.concatenate(([0], numpy.cumsum(sizes.sum(0))))
+        starts = level_offsets[:-1] + numpy.cumsum(sizes, axis=0) - sizes
+        n_nodes = level_offsets[-1]
+
+        forest = cls(
+            feature_col=numpy.empty(n_nodes, dtype=numpy.intp),
+            threshold=numpy.empty(n_nodes),
+            gain=numpy.empty(n_nodes),
+            left=numpy.empty(n_nodes, dtype=numpy.intp),
+            right=numpy.empty(n_nodes, dtype=numpy.intp),
+            value=numpy.empty((n_nodes,) + trees[0].value.shape[1:]),
+            impurity=numpy.empty(n_nodes),
+            count=numpy.empty(n_nodes, dtype=numpy.intp),
+            level_offsets=level_offsets,
+        )
+
+        for i, (tree, weight) in enumerate(zip(trees, weights)):
+            # position in the forest of every node of the tree
+            index = numpy.concatenate([
+                numpy.arange(begin, begin + size)
+                for begin, size in zip(starts[i], sizes[i])
+            ])
+            is_leaf = tree.is_leaf
+
+            forest.feature_col[index] = tree.feature_col
+            forest.threshold[index] = tree.threshold
+            forest.gain[index] = tree.gain
+            forest.left[index] = numpy.where(is_leaf, -1, index[tree.left])
+            forest.right[index] = numpy.where(is_leaf, -1, index[tree.right])
+            forest.value[index] = weight * tree.value
+            forest.impurity[index] = tree.impurity
+            forest.count[index] = tree.count
+
+        return forest
+
+    @property
+    def n_trees(self):
+        return self.level_offsets[1]
+
+    @property
+    def n_nodes(self):
+        return self.feature_col.shape[0]
+
+    @property
+    def depth(self):
+        '''
+        Number of levels below the root
+        '''
+        return self.level_offsets.shape[0] - 2
+
+    @property
+    def is_leaf(self):
+        return self.left < 0
+
+    @property
+    def n_outputs(self):
+        '''
+        Number of outputs, None for a scalar value
+        '''
+        return self.value.shape[1] if self.value.ndim == 2 else None
+
+    def internal_nodes_by_level(self):
+        '''
+        Indices of the internal nodes of every level, root level first
+        :returns: list of index arrays
+        '''
+        levels = list()
+        for depth in range(self.depth):
+            begin = self.level_offsets[depth]
+            end = self.level_offsets[depth + 1]
+            levels.append(begin + numpy.flatnonzero(self.left[begin:end] >= 0))
+        return levels
+
+    @property
+    def impurity_drop(self):
+        '''
+        Impurity of every node minus the impurity of its children, zero for
+        leaves
+        '''
+        is_leaf = self.is_leaf
+        return numpy.where(
+            is_leaf, 0,
+            self.impurity - self.impurity[self.left] -
+            self.impurity[self.right])
+
+    def prune(self, keep):
+        '''
+        Subtree keeping only some of the splits, a node whose split is cut
+        becomes a leaf holding its own value and its descendants are removed
+        :param keep ndarray: boolean array of shape (n_nodes,), True for the
+            splits that are kept if their parent is reached
+        :returns: Compiled_Tree in level order
+        '''
+        keep = keep & ~self.is_leaf
+        reached = numpy.zeros(self.n_nodes, dtype=bool)
+        reached[:self.n_trees] = True
+
+        # parents come before their children in level order
+        for nodes in self.internal_nodes_by_level():
+            nodes = nodes[reached[nodes] & keep[nodes]]
+            reached[self.left[nodes]] = True
+            reached[self.right[nodes]] = True
+
+        order = numpy.flatnonzero(reached)
+        depth = numpy.searchsorted(self.level_offsets, order, side='right') - 1
+        new_index = numpy.full(self.n_nodes, -1, dtype=numpy.intp)
+        new_index[order] = numpy.arange(order.shape[0])
+        split = keep[order]
+
+        return Compiled_Tree(
+            feature_col=numpy.where(split, self.feature_col[order], -1),
+            threshold=numpy.where(split, self.threshold[order], 0),
+            gain=numpy.where(split, self.gain[order], 0),
+            left=numpy.where(split, new_index[self.left[order]], -1),
+            right=numpy.where(split, new_index[self.right[order]], -1),
+            value=self.value[order],
+            impurity=self.impurity[order],
+            count=self.count[order],
+            level_offsets=numpy.searchsorted(
+                depth, numpy.arange(depth[-1] + 2)),
+        )
+
+    def _subtree_leaves(self, split):
+        '''
+        Sum of the impurities and number of the leaves below every node,
+        counting only the given splits
+        :param split ndarray: boolean array of the splits that are present
+        :returns: tuple of two arrays of shape (n_nodes,)
+        '''
+        leaf_impurity = self.impurity.copy()
+        n_leaves = numpy.ones(self.n_nodes, dtype=numpy.intp)
+
+        for nodes in reversed(self.internal_nodes_by_level()):
+            nodes = nodes[split[nodes]]
+            leaf_impurity[nodes] = (
+                leaf_impurity[self.left[nodes]] +
+                leaf_impurity[self.right[nodes]])
+            n_leaves[nodes] = n_leaves[self.left[nodes]] + \
+                n_leaves[self.right[nodes]]
+
+        return leaf_impurity, n_leaves
+
+    def cost_complexity_alphas(self):
+        '''
+        Minimal cost-complexity pruning by weakest links. The subtree of a
+        node costs the impurity of its leaves plus alpha per leaf, and the
+        splits whose subtree gains the least impurity per extra leaf are cut
+        first.
+        :returns: tuple of the alpha of every node at which its split is
+            cut, infinite for leaves, and a namespace of the pruning path
+            with the increasing alphas and the total leaf impurity of the
+            pruned tree at each of them
+        '''
+        alive = ~self.is_leaf
+        alphas = numpy.full(self.n_nodes, numpy.inf)
+        levels = self.internal_nodes_by_level()
+
+        (leaf_impurity, n_leaves) = self._subtree_leaves(alive)
+        path_alphas = [0.0]
+        path_impurities = [leaf_impurity[:self.n_trees].sum()]
+
+        while alive.any():
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                cost = (self.impurity - leaf_impurity) / (n_leaves - 1)
+            alpha = max(cost[alive].min(), path_alphas[-1])
+
+            # the weakest links and the splits below them are cut together
+            cut = alive & (cost <= alpha)
+            for nodes in levels:
+                nodes = nodes[cut[nodes]]
+                cut[self.left[nodes]] = True
+                cut[self.right[nodes]] = True
+            cut &= alive
+
+            alphas[cut] = alpha
+            alive &= ~cut
+
+            (leaf_impurity, n_leaves) = self._subtree_leaves(alive)
+            path_alphas.append(alpha)
+            path_impurities.append(leaf_impurity[:self.n_trees].sum())
+
+        path = SimpleNamespace(
+            ccp_alphas=numpy.asarray(path_alphas),
+            impurities=numpy.asarray(path_impurities),
+        )
+        return alphas, path
+
+    def split_leaf(self, leaf, feature_col, threshold, gain, left, right):
+        '''
+        Turns a leaf into a split with two new leaves
+        :param leaf int: index of the leaf
+        :param feature_col int: feature of the split
+        :param threshold float: threshold of the split
+        :param gain float: gain of the split
+        :param left tuple: (value, impurity, count) of the left leaf
+        :param right tuple: (value, impurity, count) of the right leaf
+        :returns: tuple of the new Compiled_Tree in level order and, for
+            every node of the new tree, its index in this tree or -1 for the
+            two new leaves
+        '''
+        assert self.left[leaf] < 0, 'not a leaf'
+        n_nodes = self.n_nodes
+        children = (left, right)
+
+        feature_col_ = numpy.append(self.feature_col, [-1, -1])
+        threshold_ = numpy.append(self.threshold, [0, 0])
+        gain_ = numpy.append(self.gain, [0, 0])
+        left_ = numpy.append(self.left, [-1, -1])
+        right_ = numpy.append(self.right, [-1, -1])
+        value_ = numpy.concatenate((
+            self.value,
+            numpy.asarray([child[0] for child in children], dtype=float)))
+        impurity_ = numpy.append(
+            self.impurity, [child[1] for child in children])
+        count_ = numpy.append(
+            self.count, [child[2] for child in children]).astype(numpy.intp)
+
+        feature_col_[leaf] = feature_col
+        threshold_[leaf] = threshold
+        gain_[leaf] = gain
+        left_[leaf] = n_nodes
+        right_[leaf] = n_nodes + 1
+
+        # level order by breadth-first search from the root
+        order = [0]
+        depth = [0]
+        for i in range(n_nodes + 2):
+            node = order[i]
+            if left_[node] >= 0:
+                order.extend((left_[node], right_[node]))
+                depth.extend((depth[i] + 1, depth[i] + 1))
+        order = numpy.asarray(order)
+        depth = numpy.asarray(depth)
+
+        new_index = numpy.empty(n_nodes + 2, dtype=numpy.intp)
+        new_index[order] = numpy.arange(n_nodes + 2)
+        is_leaf = (left_[order] < 0)
+
+        tree = Compiled_Tree(
+            feature_col=feature_col_[order],
+            threshold=threshold_[order],
+            gain=gain_[order],
+            left=numpy.where(is_leaf, -1, new_index[left_[order]]),
+            right=numpy.where(is_leaf, -1, new_index[right_[order]]),
+            value=value_[order],
+            impurity=impurity_[order],
+            count=count_[order],
+            level_offsets=numpy.searchsorted(
+                depth, numpy.arange(depth[-1] + 2)),
+        )
+
+        old_index = numpy.where(order < n_nodes, order, -1)
+        return tree, old_index
+
+    def route(self, features):
+        '''
+        Routes every sample to the single leaf it falls into with crisp splits
+        :param features ndarray: array of shape (n_samples, n_features, )
+        :returns: leaf index of every sample, array of shape (n_samples,)
+        '''
+        assert self.n_trees == 1, 'use route_forest for a forest'
+        return self.route_forest(features)[0]
+
+    def route_forest(self, features):
+        '''
+        Routes every sample through every tree of a forest
+        :param features ndarray: array of shape (n_samples, n_features, )
+        :returns: leaf index of every sample in every tree, array of shape
+            (n_trees, n_samples)
+        '''
+        n_samples = features.shape[0]
+        node = numpy.repeat(numpy.arange(self.n_trees), n_samples)
+        row = numpy.tile(numpy.arange(n_samples), self.n_trees)
+
+        # (tree, sample) pairs that have not reached a leaf yet
+        active = numpy.flatnonzero(self.left[node] >= 0)
+
+        while active.shape[0]:
+            active_node = node[active]
+            go_left = (
+                features[row[active], self.feature_col[active_node]] <=
+                self.threshold[active_node]
+            )
+            active_node = numpy.where(
+                go_left, self.left[active_node], self.right[active_node])
+            node[active] = active_node
+            active = active[self.left[active_node] >= 0]
+
+        return node.reshape(self.n_trees, n_samples)
+
+    def predict_crisp(self, features):
+        '''
+        :param features ndarray: array of shape (n_samples, n_features, )
+        :returns: array of shape (n_samples, )
+        '''
+        return self.value[self.route_forest(features)].sum(axis=0)
+
+    def predict_fuzzy(self, features, activation=None):
+        '''
+        Sums the leaf values weighted by the fuzzy membership of every sample,
+        computing one tree level per vectorized operation. Computes in
+        float32 if the features are float32, in float64 otherwise.
+        :param features ndarray: array of shape (n_samples, n_features, )
+        :param activation: membership function, Sigmoid if None
+        :returns: array of shape (n_samples, )
+        '''
+        dtype = numpy.result_type(features.dtype, numpy.float32)
+        if activation is None:
+            activation = Sigmoid()
+
+        n_samples = features.shape[0]
+        prediction = numpy.zeros(
+            (n_samples,) + self.value.shape[1:], dtype=dtype)
+
+        # parameters in the type of the computation, so that they do not
+        # promote the per-sample arrays
+        gain = self.gain.astype(dtype, copy=False)
+        threshold = self.threshold.astype(dtype, copy=False)
+        value = self.value.astype(dtype, copy=False)
+
+        # node-major layout keeps the samples of one node contiguous
+        columns = numpy.ascontiguousarray(features.T, dtype=dtype)
+
+        # membership of the nodes in the current level
+        r = numpy.ones((self.n_trees, n_samples), dtype=dtype)
+
+        for depth in range(self.depth + 1):
+            begin = self.level_offsets[depth]
+            end = self.level_offsets[depth + 1]
+            level_is_leaf = self.is_leaf[begin:end]
+
+            prediction += leaf_sum(
+                value[begin:end][level_is_leaf], r[level_is_leaf])
+
+            internal = numpy.flatnonzero(~level_is_leaf)
+            if internal.shape[0] == 0:
+                break
+
+            nodes = internal + begin
+            a = -gain[nodes, None] * (
+                columns[self.feature_col[nodes]] - threshold[nodes, None])
+            mu = activation.primitive(a, out=a)
+
+            next_end = self.level_offsets[depth + 2]
+            next_r = numpy.empty((next_end - end, n_samples), dtype=dtype)
+            next_r[self.left[nodes] - end] = mu * r[internal]
+            next_r[self.right[nodes] - end] = (1 - mu) * r[internal]
+            r = next_r
+
+        return prediction
+
+    def predict_sparse(self, features, activation=None, min_membership=1e-2,
+                       max_active_leaves=None):
+        '''
+        Fuzzy prediction that only follows the branches a sample has a
+        significant membership in. Every sample keeps a list of active
+        (node, membership) pairs which is expanded one level at a time.
+        A child is followed if its membership is at least min_membership or
+        if it is the dominant child of its parent, so every sample keeps at
+        least its crisp path. With max_active_leaves, only the strongest
+        pairs of a sample are kept such that it reaches at most that many
+        leaves. The prediction is normalized by the membership mass of the
+        leaves reached.
+
+        A pair costs several times more than a node of predict_fuzzy, so
+        this pays off only if samples reach a small fraction of the leaves,
+        as with the sharp memberships of large gains. With the diffuse
+        memberships of a briefly tuned tree, prefer predict_fuzzy or bound
+        the work with max_active_leaves.
+        :param features ndarray: array of shape (n_samples, n_features, )
+        :param activation: membership function, Sigmoid if None
+        :param min_membership float: membership below which a branch is cut,
+            0 follows every branch and matches predict_fuzzy
+        :param max_active_leaves int: maximal number of leaves per sample
+        :returns: tuple of the prediction and the number of leaves reached
+            by every sample, both arrays of shape (n_samples, )
+        '''
+        if activation is None:
+            activation = Sigmoid()
+
+        assert max_active_leaves is None or max_active_leaves >= 1
+        assert self.n_trees == 1, 'not defined for a forest'
+
+        n_samples = features.shape[0]
+        weighted_sum = numpy.zeros((n_samples,) + self.value.shape[1:])
+        mass = numpy.zeros(n_samples)
+        n_leaves = numpy.zeros(n_samples, dtype=numpy.intp)
+
+        rows = numpy.arange(n_samples)
+        nodes = numpy.zeros(n_samples, dtype=numpy.intp)
+        r = numpy.ones(n_samples)
+
+        while rows.shape[0]:
+            leaf = self.left[nodes] < 0
+            if leaf.any():
+                if self.value.ndim == 1:
+                    weighted_sum += numpy.bincount(
+                        rows[leaf], weights=r[leaf] * self.value[nodes[leaf]],
+                        minlength=n_samples)
+                else:
+                    numpy.add.at(
+                        weighted_sum, rows[leaf],
+                        r[leaf, None] * self.value[nodes[leaf]])
+                mass += numpy.bincount(
+                    rows[leaf], weights=r[leaf], minlength=n_samples)
+                n_leaves += numpy.bincount(rows[leaf], minlength=n_samples)
+
+                internal = ~leaf
+                rows = rows[internal]
+                nodes = nodes[internal]
+                r = r[internal]
+
+            if rows.shape[0] == 0:
+                break
+
+            a = -self.gain[nodes] * (
+                features[rows, self.feature_col[nodes]] -
+                self.threshold[nodes]
+            )
+            mu = activation.primitive(a, out=a)
+            go_left = (mu >= 0.5)
+
+            r_left = r * mu
+            r_right = r - r_left
+            keep_left = go_left | (r_left >= min_membership)
+            keep_right = ~go_left | (r_right >= min_membership)
+
+            rows = numpy.concatenate((rows[keep_left], rows[keep_right]))
+            nodes = numpy.concatenate((
+                self.left[nodes[keep_left]], self.right[nodes[keep_right]]))
+            r = numpy.concatenate((r_left[keep_left], r_right[keep_right]))
+
+            if max_active_leaves is not None:
+                budget = numpy.maximum(max_active_leaves - n_leaves, 1)
+                n_pairs = numpy.bincount(rows, minlength=n_samples)
+                if (n_pairs > budget).any():
+                    # rank of every pair among the pairs of its sample by
+                    # decreasing membership, as r lies in [0, 1] one key
+                    # orders by sample first
+                    order = numpy.argsort(rows + (1 - r) / 2)
+                    (rows, nodes, r) = (rows[order], nodes[order], r[order])
+                    first = numpy.cumsum(n_pairs) - n_pairs
+                    rank = numpy.arange(rows.shape[0]) - first[rows]
+
+                    keep = (rank < budget[rows])
+                    (rows, nodes, r) = (rows[keep], nodes[keep], r[keep])
+
+        if self.value.ndim == 2:
+            mass = mass[:, None]
+        return weighted_sum / mass, n_leaves
+
+    _array_names = (
+        'feature_col',
+        'threshold',
+        'gain',
+        'left',
+        'right',
+        'value',
+        'impurity',
+        'count',
+        'level_offsets',
+    )
+
+    def save(self, path, metadata=None):
+        '''
+        Writes the tree as a small header followed by flat typed arrays.
+        Every array starts at a multiple of _alignment bytes so that it can
+        be mapped into memory without copying.
+        :param path str: file to write
+        :param metadata dict: JSON serializable data stored in the header
+        '''
+        arrays = {
+            name: numpy.ascontiguousarray(
+                getattr(self, name),
+                dtype=getattr(self, name).dtype.newbyteorder('<'))
+            for name in self._array_names
+        }
+
+        # header size depends on the offsets, so offsets are relative to
+        # the end of the aligned header
+        offset = 0
+        descriptions = dict()
+        for name, array in arrays.items():
+            descriptions[name] = {
+                'dtype': array.dtype.str,
+                'shape': array.shape,
+                'offset': offset,
+            }
+            offset = _align(offset + array.nbytes)
+
+        header = json.dumps({
+            'version': _file_version,
+            'arrays': descriptions,
+            'metadata': metadata or dict(),
+        }).encode()
+        data_begin = _align(len(_file_magic) + 8 + len(header))
+
+        with open(path, 'wb') as file:
+            file.write(_file_magic)
+            file.write(struct.pack('<Q', len(header)))
+            file.write(header)
+
+            for name, array in arrays.items():
+                file.seek(data_begin + descriptions[name]['offset'])
+                file.write(array.tobytes())
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        '''
+        Reads a tree written by save
+        :param path str: file to read
+        :param mmap bool: if True, the arrays are read-only views of a
+            memory map of the file, so processes loading the same file share
+            its pages. Otherwise they are read into private memory.
+        :returns: tuple of (Compiled_Tree, metadata)
+        '''
+        with open(path, 'rb') as file:
+            assert file.read(len(_file_magic)) == _file_magic, \
+                'not a compiled tree file'
+            (header_size,) = struct.unpack('<Q', file.read(8))
+            header = json.loads(file.read(header_size))
+
+        assert header['version'] == _file_version, 'unsupported version'
+        data_begin = _align(len(_file_magic) + 8 + header_size)
+
+        if mmap:
+            buffer = numpy.memmap(path, dtype=numpy.uint8, mode='r')
+        else:
+            buffer = numpy.fromfile(path, dtype=numpy.uint8)
+
+        arrays = dict()
+        for name in cls._array_names:
+            description = header['arrays'][name]
+            dtype = numpy.dtype(description['dtype'])
+            shape = tuple(description['shape'])
+            begin = data_begin + description['offset']
+            end = begin + dtype.itemsize * int(numpy.prod(shape))
+            arrays[name] = buffer[begin:end].view(dtype).reshape(shape)
+
+        return cls(**arrays), header['metadata']
+
+
+_file_magic = b'DATREE\x00\x01'
+_file_version = 1
+_alignment = 64
+
+
+def leaf_sum(value, r):
+    '''
+    Values of leaves weighted by the memberships of every sample
+    :param value ndarray: array of shape (n_leaves,) or, for several
+        outputs, (n_leaves, n_outputs)
+    :param r ndarray: memberships of shape (n_leaves, n_samples)
+    :returns: array of shape (n_samples,) or (n_samples, n_outputs)
+    '''
+    if value.ndim == 1:
+        return value @ r
+    return r.T @ value
+
+
+def _align(offset):
+    return -(-offset // _alignment) * _alignment
@@ -4,10 +4,14 @@ Decision tree for regression
 
 
 import numpy
+import os
 from types import SimpleNamespace
-from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
 from ..containers.binary_trees import Binary_Tree, Binary_Tree_Node
+from .compiled_trees import Compiled_Tree
 from ..metrics.regression import sum_of_squared_error
+from ..profiling.instruments import null_instruments
 
 
 class Decision_Tree_Regressor:
@@ -17,140 +21,663 @@ class Decision_Tree_Regressor:
         '_impurity_func',
         '_tree',
         '_min_impurity_drop',
+        '_max_bins',
+        '_bin_edges',
+        '_compiled',
+        '_n_jobs',
+        '_max_depth',
+        'instruments',
+        '_dtype',
+        '_pruning',
     )
 
-    def __init__(self, min_count, min_impurity_drop):
+    # relative tolerance under which two impurities are considered equal
+    _split_tolerance = 1e-10
+
+    def __init__(self, min_count, min_impurity_drop, max_bins=None,
+                 n_jobs=1, max_depth=None, dtype=numpy.float64):
+        '''
+        :param min_count int: minimal number of samples in a leaf
+        :param min_impurity_drop float: minimal impurity drop of a split
+        :param max_bins int: if given, features are quantized into at most
+            this many bins before growing the tree and splits are searched
+            on per-bin sums
+        :param n_jobs int: number of threads searching splits in parallel,
+            -1 for one per processor, the fitted tree does not depend on it
+        :param max_depth int: if given, nodes at this depth are not split
+        :param dtype: floating point type of the features in fit, tune and
+            predict, float32 halves the memory traffic. Split thresholds
+            and impurities are computed in float64 either way.
+        '''
+        assert max_bins is None or 2 <= max_bins <= 65536
+        assert n_jobs == -1 or n_jobs >= 1
+        assert max_depth is None or max_depth >= 0
+        assert numpy.dtype(dtype) in (numpy.float32, numpy.float64)
+
         self._min_count = min_count
         self._impurity_func = sum_of_squared_error
         self._min_impurity_drop = min_impurity_drop
+        self._max_bins = max_bins
+        self._bin_edges = None
+        self._compiled = None
+        self._tree = None
+        self._n_jobs = n_jobs
+        self._max_depth = max_depth
+        self._dtype = numpy.dtype(dtype)
 
-    def _get_candidate_splits(self, feature_vals):
-        (sorted_vals, counts) = numpy.unique(feature_vals,
-                                             return_counts=True)
+        # compiled tree and its cost-complexity pruning alphas and path
+        self._pruning = None
 
-        # calculates the midpoint between two values
-        candidate_split_points = (sorted_vals[1:] + sorted_vals[:-1]) / 2
+        # set to an Instruments to collect timers and counters
+        self.instruments = null_instruments
+
+    def _get_candidate_splits(self, sorted_vals):
+        '''
+        Candidate thresholds of a sorted feature column
+        :param sorted_vals ndarray: feature values in ascending order
+        :returns: tuple of (thresholds, counts_left) where counts_left is the
+            number of samples that go to the left child for each threshold
+        '''
+        # positions where the sorted values change are the boundaries
+        # between two consecutive unique values
+        boundaries = numpy.flatnonzero(sorted_vals[1:] != sorted_vals[:-1])
+
+        # calculates the midpoint between two values, in float64 so that it
+        # lies strictly between two float32 values
+        candidate_split_points = (
+            sorted_vals[boundaries + 1].astype(numpy.float64) +
+            sorted_vals[boundaries]) / 2
 
         # makes sure the split results in at least the minimal sample size
         # on both sides
-        counts_left = numpy.cumsum(counts[:-1])
-        counts_right = counts.sum() - counts_left
+        counts_left = boundaries + 1
+        counts_right = sorted_vals.shape[0] - counts_left
         mask = (
             (counts_left >= self._min_count) &
             (counts_right >= self._min_count)
         )
-        candidate_split_points = candidate_split_points[mask]
 
-        return candidate_split_points
+        return candidate_split_points[mask], counts_left[mask]
+
+    def _score_feature(self, feature_vals, target, scale, feature_col=None):
+        '''
+        Scores every candidate threshold of one feature from prefix sums
+        :param feature_vals ndarray: array of shape (n_samples,)
+        :param target ndarray: target centered at the node mean
+        :param scale float: impurity of the node, used for tie breaking
+        :param feature_col int: column of the feature, for instrumentation
+        :returns: tuple of (impurity, threshold) of the best split, impurity
+            is infinite if the feature has no candidate split
+        '''
+        order = numpy.argsort(feature_vals, kind='stable')
+        sorted_vals = feature_vals[order]
+        thresholds, counts_left = self._get_candidate_splits(sorted_vals)
+        self.instruments.count(
+            'thresholds_scored', thresholds.shape[0], key=feature_col)
+
+        if thresholds.shape[0] == 0:
+            return numpy.inf, None
+
+        sorted_target = target[order]
+        cum_sum = numpy.cumsum(sorted_target, axis=0)
+        cum_sq_sum = numpy.cumsum(numpy.square(sorted_target), axis=0)
+
+        impurity = self._prefix_sum_impurity(
+            cum_sum[counts_left - 1], cum_sq_sum[counts_left - 1],
+            counts_left, cum_sum[-1], cum_sq_sum[-1], sorted_target.shape[0])
+
+        best = self._first_minimum(impurity, scale)
+        return impurity[best], thresholds[best]
+
+    def _score_binned_features(self, bins, target, scale):
+        '''
+        Scores every bin boundary of every quantized feature from per-bin
+        sums
+        :param bins ndarray: bin indices of shape (n_samples, n_features, )
+        :param target ndarray: target centered at the node mean
+        :param scale float: impurity of the node, used for tie breaking
+        :returns: list of (impurity, bin) of the best split of every feature,
+            samples with bin index up to and including bin go to the left
+        '''
+        histograms = self._build_histograms(bins, target)
+        return self._score_histograms(*histograms, scale)
+
+    def _build_histograms(self, bins, target):
+        '''
+        Per-bin count, sum and sum of squares of the target
+        :param bins ndarray: bin indices of shape (n_samples, n_features, )
+        :param target ndarray: array of shape (n_samples,) or
+            (n_samples, n_outputs)
+        :returns: tuple of the counts of shape (n_features, n_bins) and the
+            sums and sums of squares, which have a last axis of outputs for
+            several outputs
+        '''
+        n_features = bins.shape[1]
+        n_bins = max(edges.shape[0] for edges in self._bin_edges) + 1
+
+        # one feature at a time, so the temporaries are of the size of one
+        # column rather than of the whole bin matrix, from a column-major
+        # copy of the bins, which are single bytes for up to 256 bins
+        bins = numpy.asfortranarray(bins)
+        counts = numpy.empty((n_features, n_bins), dtype=numpy.intp)
+        sums = numpy.empty((n_features, n_bins) + target.shape[1:])
+        sq_sums = numpy.empty_like(sums)
+
+        # one weight vector per output
+        outputs = target.reshape(target.shape[0], -1).T
+        sq_outputs = numpy.square(outputs)
+
+        for feature_col in range(n_features):
+            feature_bins = bins[:, feature_col]
+            counts[feature_col] = numpy.bincount(
+                feature_bins, minlength=n_bins)
+
+            feature_sums = sums[feature_col].reshape(n_bins, -1)
+            feature_sq_sums = sq_sums[feature_col].reshape(n_bins, -1)
+            for output, (weights, sq_weights) in enumerate(
+                    zip(outputs, sq_outputs)):
+                feature_sums[:, output] = numpy.bincount(
+                    feature_bins, weights=weights, minlength=n_bins)
+                feature_sq_sums[:, output] = numpy.bincount(
+                    feature_bins, weights=sq_weights, minlength=n_bins)
+
+        return counts, sums, sq_sums
+
+    def _score_histograms(self, counts, sums, sq_sums, scale):
+        '''
+        Scores every bin boundary from the histograms of a node
+        :param counts ndarray: per-bin counts of shape (n_features, n_bins)
+        :param sums ndarray: per-bin sums of the centered target
+        :param sq_sums ndarray: per-bin sums of the squared centered target
+        :param scale float: impurity of the node, used for tie breaking
+        :returns: list of (impurity, bin) of the best split of every feature
+        '''
+        n_features = counts.shape[0]
+        n_samples = counts[0].sum()
+
+        counts_left = numpy.cumsum(counts[:, :-1], axis=1)
+        counts_right = n_samples - counts_left
+        mask = (
+            (counts_left >= max(self._min_count, 1)) &
+            (counts_right >= max(self._min_count, 1))
+        )
+
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            impurity = self._prefix_sum_impurity(
+                numpy.cumsum(sums[:, :-1], axis=1),
+                numpy.cumsum(sq_sums[:, :-1], axis=1),
+                counts_left, sums[0].sum(axis=0), sq_sums[0].sum(axis=0),
+                n_samples)
+
+        scores = []
+        for feature_col in range(n_features):
+            candidate_bins = numpy.flatnonzero(mask[feature_col])
+            self.instruments.count(
+                'thresholds_scored', candidate_bins.shape[0],
+                key=feature_col)
+
+            if candidate_bins.shape[0] == 0:
+                scores.append((numpy.inf, None))
+                continue
+
+            candidates = impurity[feature_col, candidate_bins]
+            best = self._first_minimum(candidates, scale)
+            scores.append((candidates[best], candidate_bins[best]))
+
+        return scores
+
+    @staticmethod
+    def _prefix_sum_impurity(sum_left, sq_sum_left, counts_left,
+                             total_sum, total_sq_sum, n_samples):
+        '''
+        Sum of squared error of both children, computed from the sums of the
+        target and of its square on the left side. With several outputs the
+        sums have a last axis of outputs and the error is summed over it.
+        '''
+        several_outputs = (numpy.ndim(sum_left) > numpy.ndim(counts_left))
+        if several_outputs:
+            counts_left = counts_left[..., None]
+
+        counts_right = n_samples - counts_left
+        sum_right = total_sum - sum_left
+        sq_sum_right = total_sq_sum - sq_sum_left
+
+        # sum of squared error about the mean is sum(y^2) - sum(y)^2 / n
+        impurity = (
+            sq_sum_left - numpy.square(sum_left) / counts_left +
+            sq_sum_right - numpy.square(sum_right) / counts_right
+        )
 
-    def _find_best_split(self, features, target):
+        if several_outputs:
+            return impurity.sum(axis=-1)
+        return impurity
+
+    def _first_minimum(self, impurity, scale):
+        '''
+        Index of the first impurity that is minimal up to rounding error
+        '''
+        # prefix sums accumulate rounding error in a different order than
+        # the direct sums, ties are broken towards the first candidate
+        tolerance = self._split_tolerance * scale
+        return numpy.argmax(impurity <= impurity.min() + tolerance)
+
+    def _find_best_split(self, features, target, samples, executor=None):
+        '''
+        Finds the best split of the samples of one node
+        :param features ndarray: shared column-major array of shape
+            (n_samples, n_features, ), holding bin indices if binned
+        :param target ndarray: shared array of shape (n_samples,) or
+            (n_samples, n_outputs)
+        :param samples ndarray: indices of the samples in the node
+        :param executor Executor: if given, features are scored in parallel
+        :returns: namespace with the split and a mask of the samples going
+            to the left child, impurity is infinite if no split exists
+        '''
         best_split = SimpleNamespace()
         best_split.impurity = numpy.inf
-        best_split.left = Binary_Tree_Node()
-        best_split.right = Binary_Tree_Node()
+        self.instruments.count('splits_evaluated')
+
+        node_target = target[samples]
+
+        # centering improves the precision of the prefix sums
+        centered_target = node_target - node_target.mean(axis=0)
+        scale = numpy.square(centered_target).sum()
 
         feature_cols = range(features.shape[1])
 
-        for feature_col in feature_cols:
-            feature_vals = features[:, feature_col]
-            candidate_splits = self._get_candidate_splits(feature_vals)
+        if self._bin_edges is None:
+            def score(feature_col):
+                return self._score_feature(
+                    features[:, feature_col][samples], centered_target, scale,
+                    feature_col)
+
+            if executor is None:
+                scores = list(map(score, feature_cols))
+            else:
+                scores = list(executor.map(score, feature_cols))
+        else:
+            scores = self._score_binned_features(
+                features[samples], centered_target, scale)
 
-            for threshold in candidate_splits:
-                left_mask = (feature_vals <= threshold)
-                right_mask = ~left_mask
+        impurities = numpy.asarray([impurity for impurity, _ in scores])
+        if not numpy.isfinite(impurities).any():
+            return best_split
 
-                left_target = target[left_mask]
-                right_target = target[right_mask]
+        feature_col = self._first_minimum(impurities, scale)
+        split_value = scores[feature_col][1]
 
-                left_ybar = left_target.mean()
-                right_ybar = right_target.mean()
-                left_impurity = self._impurity_func(left_ybar, left_target)
-                right_impurity = self._impurity_func(right_ybar, right_target)
-                impurity_after_split = left_impurity + right_impurity
+        left_mask = (features[:, feature_col][samples] <= split_value)
 
-                if impurity_after_split < best_split.impurity:
-                    best_split.impurity = impurity_after_split
-                    best_split.feature_col = feature_col
-                    best_split.threshold = threshold
+        best_split.feature_col = feature_col
+        best_split.left_mask = left_mask
 
-                    best_split.left.features = features[left_mask]
-                    best_split.right.features = features[right_mask]
-                    best_split.left.target = target[left_mask]
-                    best_split.right.target = target[right_mask]
+        if self._bin_edges is None:
+            best_split.threshold = split_value
+        else:
+            best_split.threshold = self._bin_edges[feature_col][split_value]
 
-                    best_split.left.ybar = left_ybar
-                    best_split.right.ybar = right_ybar
-                    best_split.left.impurity = left_impurity
-                    best_split.right.impurity = right_impurity
+        best_split.left = self._make_node(node_target[left_mask])
+        best_split.right = self._make_node(node_target[~left_mask])
+        best_split.impurity = (
+            best_split.left.impurity + best_split.right.impurity)
 
         return best_split
 
+    def _make_node(self, node_target):
+        '''
+        New node holding the statistics of its samples, but not the samples
+        '''
+        node = Binary_Tree_Node()
+        node.count = node_target.shape[0]
+        node.ybar = node_target.mean(axis=0)
+
+        # the impurity of several outputs is summed over the outputs
+        ybar = node.ybar
+        if node_target.ndim == 2:
+            ybar = numpy.broadcast_to(ybar, node_target.shape)
+        node.impurity = self._impurity_func(ybar, node_target)
+        return node
+
+    def _get_bin_edges(self, feature_vals):
+        '''
+        Bin edges of a feature column such that every bin holds about the
+        same number of samples
+        :param feature_vals ndarray: array of shape (n_samples,)
+        :returns: ascending edges, at most max_bins - 1 of them, each edge is
+            the midpoint between two consecutive unique values
+        '''
+        (sorted_vals, counts) = numpy.unique(feature_vals, return_counts=True)
+        sorted_vals = sorted_vals.astype(numpy.float64)
+        midpoints = (sorted_vals[1:] + sorted_vals[:-1]) / 2
+
+        if sorted_vals.shape[0] <= self._max_bins:
+            return midpoints
+
+        # index of the unique value closing each equal-frequency bin
+        quantiles = (
+            numpy.arange(1, self._max_bins) *
+            counts.sum() / self._max_bins
+        )
+        closing = numpy.searchsorted(numpy.cumsum(counts), quantiles)
+        closing = numpy.unique(closing[closing < midpoints.shape[0]])
+
+        return midpoints[closing]
+
+    def _quantize(self, features):
+        '''
+        Maps every feature to the index of its bin
+        :param features ndarray: array of shape (n_samples, n_features, )
+        :returns: integer array of shape (n_samples, n_features, )
+        '''
+        dtype = numpy.uint8 if self._max_bins <= 256 else numpy.uint16
+        bins = numpy.empty(features.shape, dtype=dtype)
+
+        for feature_col, edges in enumerate(self._bin_edges):
+            # values equal to an edge go left, as in (x <= threshold)
+            bins[:, feature_col] = numpy.searchsorted(
+                edges, features[:, feature_col], side='left')
+
+        return bins
+
     def _build_tree(self, features, target):
+        '''
+        Grows the tree on one shared feature matrix. The samples of every
+        node are a contiguous range of a permutation of the sample indices,
+        which is partitioned in place when the node is split.
+        '''
         self._tree = Binary_Tree()
 
-        root_node = Binary_Tree_Node()
-
-        root_node.features = features
-        root_node.target = target
-        root_node.ybar = target.mean()
-        root_node.impurity = self._impurity_func(root_node.ybar, target)
+        # one column-major copy makes every per-node column gather contiguous
+        features = numpy.asfortranarray(features)
+        permutation = numpy.arange(target.shape[0])
 
+        root_node = self._make_node(target)
         self._tree.add_node(root_node, parent=None)
 
-        list_of_nodes_to_split = deque()
-        list_of_nodes_to_split.append(root_node)
+        # nodes of the same depth, each with the range of its samples
+        frontier = [(root_node, 0, target.shape[0])]
+        depth = 0
+
+        with self._get_executor() as executor:
+            while frontier:
+                if self._max_depth is not None and depth >= self._max_depth:
+                    break
+                self.instruments.count(
+                    'nodes_per_level', len(frontier), key=depth)
+
+                with self.instruments.timer('fit.split_search'):
+                    best_splits = self._find_best_splits(
+                        features, target, permutation, frontier, executor)
+                next_frontier = list()
 
-        while list_of_nodes_to_split:
-            node = list_of_nodes_to_split.popleft()
+                for (node, begin, end), best_split in zip(
+                        frontier, best_splits):
 
-            best_split = self._find_best_split(node.features, node.target)
+                    drop = node.impurity - best_split.impurity
+                    if not drop > self._min_impurity_drop:
+                        continue
 
-            if (node.impurity - best_split.impurity) > self._min_impurity_drop:
-                node.feature_col = best_split.feature_col
-                node.threshold = best_split.threshold
+                    node.feature_col = best_split.feature_col
+                    node.threshold = best_split.threshold
 
-                left_child = best_split.left
-                right_child = best_split.right
+                    left_child = best_split.left
+                    right_child = best_split.right
+
+                    samples = permutation[begin:end]
+                    left_mask = best_split.left_mask
+                    permutation[begin:end] = numpy.concatenate(
+                        (samples[left_mask], samples[~left_mask]))
+                    middle = begin + left_child.count
+
+                    self._tree.add_node(
+                        left_child, parent=node, left_side=True)
+                    self._tree.add_node(
+                        right_child, parent=node, left_side=False)
+
+                    next_frontier.append((left_child, begin, middle))
+                    next_frontier.append((right_child, middle, end))
+
+                frontier = next_frontier
+                depth += 1
+
+    def _get_executor(self):
+        '''
+        Thread pool for split search, threads share the training arrays
+        without copying them. Returns a serial stand-in if n_jobs is 1.
+        '''
+        if self._n_jobs == 1:
+            return nullcontext()
 
-                self._tree.add_node(left_child, parent=node, left_side=True)
-                self._tree.add_node(right_child, parent=node, left_side=False)
+        n_jobs = self._n_jobs
+        if n_jobs == -1:
+            n_jobs = os.cpu_count()
 
-                list_of_nodes_to_split.append(left_child)
-                list_of_nodes_to_split.append(right_child)
+        return ThreadPoolExecutor(max_workers=n_jobs)
 
+    def _find_best_splits(self, features, target, permutation, frontier,
+                          executor):
+        '''
+        Finds the best split of every node of the frontier. Nodes are
+        searched in parallel, a single node has its features searched in
+        parallel instead. Results are in the order of the frontier.
+        '''
+        if executor is None or len(frontier) == 1:
+            return [
+                self._find_best_split(
+                    features, target, permutation[begin:end], executor)
+                for (_, begin, end) in frontier
+            ]
 
-    def _forward_prop(self, features):
-        self._tree.root.r = True
+        def find_best_split(item):
+            (_, begin, end) = item
+            return self._find_best_split(
+                features, target, permutation[begin:end])
 
-        for node in self._tree.topological_ordering():
-            if not node.is_leaf:
-                feature_vals = features[:, node.feature_col]
-                mu = (feature_vals <= node.threshold)
-                node.left_child.r = mu & node.r
-                node.right_child.r = (~mu) & node.r
+        return list(executor.map(find_best_split, frontier))
 
     def fit(self, features, target):
         '''
         Fit features and output, resulting in a crisp tree
         :param features ndarray: array of shape (n_samples, n_features, )
-        :param output ndarray: array of shape (n_samples,)
+        :param output ndarray: array of shape (n_samples,), or of shape
+            (n_samples, n_outputs) for a tree predicting several outputs
+            from the same splits, with the impurity summed over outputs
         '''
-        features = numpy.atleast_2d(features)
-        target = numpy.asarray(target).reshape(-1)
+        features = numpy.atleast_2d(numpy.asarray(features, dtype=self._dtype))
+        target = self._as_target(target, numpy.float64)
         assert features.shape[0] == target.shape[0]
-        self._build_tree(features, target)
 
-    def predict(self, features):
+        with self.instruments.timer('fit'):
+            if self._max_bins is None:
+                self._bin_edges = None
+            else:
+                with self.instruments.timer('fit.binning'):
+                    self._bin_edges = [
+                        self._get_bin_edges(features[:, feature_col])
+                        for feature_col in range(features.shape[1])
+                    ]
+                    features = self._quantize(features)
+
+            self._build_tree(features, target)
+            self.compile()
+
+    @staticmethod
+    def _as_target(target, dtype):
+        '''
+        Target as an array of shape (n_samples,), or (n_samples, n_outputs)
+        if it is two-dimensional
+        '''
+        target = numpy.asarray(target, dtype=dtype)
+        if target.ndim != 2:
+            target = target.reshape(-1)
+        return target
+
+    def compile(self):
+        '''
+        Flattens the fitted tree into arrays used for prediction
+        '''
+        self._compiled = Compiled_Tree.from_binary_tree(self._tree)
+
+    def _predict_compiled(self, features):
+        return self._compiled.predict_crisp(features)
+
+    def _get_metadata(self):
+        '''
+        Settings stored along with the compiled tree by save
+        '''
+        return {
+            'class': type(self).__name__,
+            'min_count': self._min_count,
+            'min_impurity_drop': self._min_impurity_drop,
+            'max_bins': self._max_bins,
+            'n_jobs': self._n_jobs,
+            'max_depth': self._max_depth,
+            'dtype': self._dtype.name,
+        }
+
+    def _set_metadata(self, metadata):
+        pass
+
+    def save(self, path):
+        '''
+        Writes the fitted model to a compact binary file. Only the compiled
+        arrays are stored, not the node objects.
+        :param path str: file to write
         '''
-        Predict output based on features
+        self._compiled.save(path, self._get_metadata())
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        '''
+        Reads a model written by save, ready for prediction
+        :param path str: file to read
+        :param mmap bool: if True, the parameters are read-only views of a
+            memory map of the file, shared between processes. Pass False
+            for a private copy that can be tuned further.
+        :returns: model instance
+        '''
+        (compiled, metadata) = Compiled_Tree.load(path, mmap=mmap)
+        assert metadata['class'] == cls.__name__, \
+            f'file holds a {metadata["class"]}'
+
+        return cls._from_metadata(metadata, compiled)
+
+    @classmethod
+    def _from_metadata(cls, metadata, compiled):
+        '''
+        Model with the settings of _get_metadata and a compiled tree
+        '''
+        model = cls(
+            min_count=metadata['min_count'],
+            min_impurity_drop=metadata['min_impurity_drop'],
+            max_bins=metadata['max_bins'],
+            n_jobs=metadata['n_jobs'],
+            max_depth=metadata.get('max_depth'),
+            dtype=metadata.get('dtype', 'float64'),
+        )
+        model._compiled = compiled
+        model._set_metadata(metadata)
+        return model
+
+    def prune(self, min_impurity_drop=None, max_depth=None, ccp_alpha=None):
+        '''
+        Smaller tree cut from the fitted one without refitting. The splits
+        of a tree fit with a larger min_impurity_drop or a smaller
+        max_depth are exactly the splits kept here, so a sweep over these
+        settings costs one fit with the smallest of them. A different
+        min_count changes which splits are candidates and cannot be pruned.
+        :param min_impurity_drop float: splits dropping the impurity by at
+            most this much are cut along with their subtrees, at least the
+            min_impurity_drop of the fit
+        :param max_depth int: nodes at this depth become leaves
+        :param ccp_alpha float: splits cut by minimal cost-complexity
+            pruning at this alpha, see cost_complexity_pruning_path
+        :returns: model of the same class holding the pruned tree, ready for
+            prediction and tuning
+        '''
+        tree = self._compiled
+        keep = ~tree.is_leaf
+        metadata = self._get_metadata()
+
+        if min_impurity_drop is not None:
+            assert min_impurity_drop >= self._min_impurity_drop, \
+                'the fitted tree lacks the splits of a smaller drop'
+            keep &= tree.impurity_drop > min_impurity_drop
+            metadata['min_impurity_drop'] = min_impurity_drop
+
+        if max_depth is not None:
+            assert max_depth >= 0
+            depth = numpy.repeat(
+                numpy.arange(tree.depth + 1), numpy.diff(tree.level_offsets))
+            keep &= depth < max_depth
+            if self._max_depth is not None:
+                max_depth = min(max_depth, self._max_depth)
+            metadata['max_depth'] = max_depth
+
+        if ccp_alpha is not None:
+            (alphas, _) = self._cost_complexity_alphas()
+            keep &= alphas > ccp_alpha
+
+        return self._from_metadata(metadata, tree.prune(keep))
+
+    def cost_complexity_pruning_path(self):
+        '''
+        Alphas of minimal cost-complexity pruning at which the pruned tree
+        changes, pass any of them to prune as ccp_alpha
+        :returns: namespace of the increasing ccp_alphas and the total leaf
+            impurity of the tree pruned at each of them
+        '''
+        (_, path) = self._cost_complexity_alphas()
+        return path
+
+    def _cost_complexity_alphas(self):
+        '''
+        Compiled_Tree.cost_complexity_alphas, computed once per tree
+        '''
+        if self._pruning is None or self._pruning[0] is not self._compiled:
+            self._pruning = (
+                self._compiled, *self._compiled.cost_complexity_alphas())
+        return self._pruning[1:]
+
+    def predict(self, features, chunk_size=16384, out=None):
+        '''
+        Predict output based on features, in blocks of rows so that the
+        working memory does not grow with the number of samples
         :param features ndarray: array of shape (n_samples, n_features, )
-        :returns: array of shape (n_samples, )
+        :param chunk_size int: number of rows per block, None for one block
+        :param out ndarray: preallocated array of shape (n_samples, )
+        :returns: array of shape (n_samples, ), or (n_samples, n_outputs) for
+            a tree fit on several outputs
         '''
-        features = numpy.atleast_2d(features)
+        with self.instruments.timer('predict'):
+            return self._predict_blocks(
+                self._predict_compiled, features, chunk_size, out)
+
+    def _predict_blocks(self, predict_func, features, chunk_size, out):
+        features = numpy.atleast_2d(numpy.asarray(features, dtype=self._dtype))
+        n_samples = features.shape[0]
 
-        self._forward_prop(features)
-        predictions_per_leaf = numpy.asarray([
-            leaf.r * leaf.ybar
-            for leaf in self._tree.leaves
-        ])
-        return predictions_per_leaf.sum(axis=0).reshape(-1)
+        shape = (n_samples,) + self._compiled.value.shape[1:]
+        if out is None:
+            out = numpy.empty(shape, dtype=self._dtype)
+        assert out.shape == shape
+
+        if chunk_size is None:
+            chunk_size = max(n_samples, 1)
+
+        for begin in range(0, n_samples, chunk_size):
+            end = min(begin + chunk_size, n_samples)
+            out[begin:end] = predict_func(features[begin:end])
+
+        return out
+
+    def predict_iter(self, chunks):
+        '''
+        Predict a stream of feature blocks, yielding the predictions of every
+        block as soon as it is processed
+        :param chunks: iterable of arrays of shape (n_rows, n_features, )
+        :returns: generator of arrays of shape (n_rows, )
+        '''
+        for chunk in chunks:
+            yield self._predict_compiled(numpy.atleast_2d(
+                numpy.asarray(chunk, dtype=self._dtype)))
@@ -0,0 +1,353 @@
+'''
+Ensembles of fuzzy decision trees for regression
+'''
+
+
+import os
+import time
+import numpy
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+from .compiled_trees import Compiled_Tree
+from ..containers.shared_arrays import attach_arrays, shared_arrays
+from .fuzzy_decision_trees import Fuzzy_Decision_Tree_Regressor
+from ..gradients.optimizers import Adam
+
+
+class Fuzzy_Ensemble_Regressor:
+    '''
+    Common part of the ensembles. The members are joined into one compiled
+    forest, so the ensemble is predicted like a single tree, one level of
+    all members per vectorized operation.
+    '''
+
+    __slots__ = (
+        '_tree_params',
+        '_tune_params',
+        '_members',
+        '_weights',
+        '_compiled',
+        '_fuzzy',
+        'fit_report',
+    )
+
+    def __init__(self, min_count, min_impurity_drop, max_bins=None,
+                 max_depth=None, epochs=20, batch_size=16, step_size=1e-3):
+        '''
+        :param min_count int: minimal number of samples in a leaf
+        :param min_impurity_drop float: minimal impurity drop of a split
+        :param max_bins int: number of bins of the features, see
+            Decision_Tree_Regressor
+        :param max_depth int: maximal depth of every member
+        :param epochs int: epochs of tuning of every member, members stay
+            crisp if 0
+        :param batch_size int: batch size of tuning
+        :param step_size float: step size of the Adam optimizers of tuning
+        '''
+        assert epochs >= 0
+
+        self._tree_params = dict(
+            min_count=min_count,
+            min_impurity_drop=min_impurity_drop,
+            max_bins=max_bins,
+            max_depth=max_depth,
+        )
+        self._tune_params = dict(
+            epochs=epochs,
+            batch_size=batch_size,
+            step_size=step_size,
+        )
+        self._members = None
+        self._weights = None
+        self._compiled = None
+        self._fuzzy = (epochs > 0)
+
+    @property
+    def members(self):
+        '''
+        Compiled_Tree of every member
+        '''
+        return list(self._members)
+
+    def compile(self):
+        '''
+        Joins the members into the forest used for prediction
+        '''
+        self._compiled = Compiled_Tree.concatenate(
+            self._members, self._weights)
+
+    def _predict_compiled(self, features):
+        if self._fuzzy:
+            return self._compiled.predict_fuzzy(features)
+        return self._compiled.predict_crisp(features)
+
+    def predict(self, features, chunk_size=16384, out=None):
+        '''
+        Predict output based on features, in blocks of rows
+        :param features ndarray: array of shape (n_samples, n_features, )
+        :param chunk_size int: number of rows per block, None for one block
+        :param out ndarray: preallocated array of shape (n_samples, )
+        :returns: array of shape (n_samples, ), or (n_samples, n_outputs)
+            for members fit on several outputs
+        '''
+        features = numpy.atleast_2d(features)
+        n_samples = features.shape[0]
+
+        shape = (n_samples,) + self._compiled.value.shape[1:]
+        if out is None:
+            out = numpy.empty(shape)
+        assert out.shape == shape
+
+        if chunk_size is None:
+            chunk_size = max(n_samples, 1)
+
+        for begin in range(0, n_samples, chunk_size):
+            end = min(begin + chunk_size, n_samples)
+            out[begin:end] = self._predict_compiled(features[begin:end])
+
+        return out
+
+    def save(self, path):
+        '''
+        Writes the compiled forest to a compact binary file, see
+        Compiled_Tree.save. The members are not stored separately.
+        :param path str: file to write
+        '''
+        self._compiled.save(path, {
+            'class': type(self).__name__,
+            'fuzzy': self._fuzzy,
+        })
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        '''
+        Reads an ensemble written by save, ready for prediction only
+        :param path str: file to read
+        :param mmap bool: see Compiled_Tree.load
+        :returns: ensemble instance
+        '''
+        (compiled, metadata) = Compiled_Tree.load(path, mmap=mmap)
+        assert metadata['class'] == cls.__name__, \
+            f'file holds a {metadata["class"]}'
+
+        model = cls.__new__(cls)
+        model._members = None
+        model._weights = None
+        model._compiled = compiled
+        model._fuzzy = metadata['fuzzy']
+        return model
+
+
+class Fuzzy_Forest_Regressor(Fuzzy_Ensemble_Regressor):
+    '''
+    Bagged fuzzy decision trees, every member is fit and tuned on its own
+    bootstrap sample and the prediction is the mean of the members
+    '''
+
+    __slots__ = (
+        '_n_estimators',
+        '_sample_fraction',
+        '_n_jobs',
+        '_seed',
+    )
+
+    def __init__(self, n_estimators, min_count, min_impurity_drop,
+                 sample_fraction=1.0, n_jobs=1, seed=None, **kwargs):
+        '''
+        :param n_estimators int: number of members
+        :param sample_fraction float: size of the bootstrap samples relative
+            to the training set
+        :param n_jobs int: number of processes training members, -1 for one
+            per processor. Processes read the training set from shared
+            memory instead of receiving a copy.
+        :param seed int: seed of the bootstrap samples
+        other parameters are those of Fuzzy_Ensemble_Regressor
+        '''
+        super().__init__(min_count, min_impurity_drop, **kwargs)
+        assert n_estimators >= 1
+        assert sample_fraction > 0
+        assert n_jobs == -1 or n_jobs >= 1
+
+        self._n_estimators = n_estimators
+        self._sample_fraction = sample_fraction
+        self._n_jobs = n_jobs
+        self._seed = seed
+
+    def fit(self, features, target):
+        '''
+        Fits and tunes all members
+        :param features ndarray: array of shape (n_samples, n_features, )
+        :param target ndarray: array of shape (n_samples,) or
+            (n_samples, n_outputs)
+        '''
+        features = numpy.atleast_2d(numpy.asarray(features, dtype=float))
+        target = Fuzzy_Decision_Tree_Regressor._as_target(target, float)
+        assert features.shape[0] == target.shape[0]
+
+        n_samples = int(round(features.shape[0] * self._sample_fraction))
+        seeds = numpy.random.SeedSequence(self._seed).spawn(
+            self._n_estimators)
+        jobs = [
+            (seed, n_samples, self._tree_params, self._tune_params)
+            for seed in seeds
+        ]
+
+        start_time = time.perf_counter()
+        if self._n_jobs == 1:
+            results = [_fit_member(features, target, *job) for job in jobs]
+        else:
+            n_jobs = self._n_jobs
+            if n_jobs == -1:
+                n_jobs = os.cpu_count()
+
+            with shared_arrays(features, target) as shared, \
+                    ProcessPoolExecutor(max_workers=n_jobs) as executor:
+                futures = [
+                    executor.submit(_fit_shared_member, shared, *job)
+                    for job in jobs
+                ]
+                results = [future.result() for future in futures]
+
+        self._members = [member for member, _ in results]
+        self._weights = numpy.full(
+            self._n_estimators, 1 / self._n_estimators)
+        self.compile()
+
+        self.fit_report = SimpleNamespace(
+            wall_time=time.perf_counter() - start_time,
+            cpu_time=sum(cpu_time for _, cpu_time in results),
+        )
+
+
+class Fuzzy_Boosting_Regressor(Fuzzy_Ensemble_Regressor):
+    '''
+    Gradient boosting of shallow fuzzy decision trees for the squared error.
+    Every member is fit and tuned on the residual of the members before it,
+    the prediction is the mean of the training target plus the shrunk sum
+    of the members.
+    '''
+
+    __slots__ = (
+        '_n_estimators',
+        '_learning_rate',
+        '_n_jobs',
+    )
+
+    def __init__(self, n_estimators, min_count, min_impurity_drop,
+                 learning_rate=0.1, max_depth=3, n_jobs=1, **kwargs):
+        '''
+        :param n_estimators int: number of members
+        :param learning_rate float: factor of the prediction of every member
+        :param max_depth int: maximal depth of every member
+        :param n_jobs int: number of threads searching splits of a member,
+            members depend on each other and are fit one after the other
+        other parameters are those of Fuzzy_Ensemble_Regressor
+        '''
+        super().__init__(
+            min_count, min_impurity_drop, max_depth=max_depth, **kwargs)
+        assert n_estimators >= 1
+        assert 0 < learning_rate <= 1
+
+        self._n_estimators = n_estimators
+        self._learning_rate = learning_rate
+        self._n_jobs = n_jobs
+
+    def fit(self, features, target):
+        '''
+        Fits and tunes the members one after the other
+        :param features ndarray: array of shape (n_samples, n_features, )
+        :param target ndarray: array of shape (n_samples,) or
+            (n_samples, n_outputs)
+        '''
+        features = numpy.atleast_2d(numpy.asarray(features, dtype=float))
+        target = Fuzzy_Decision_Tree_Regressor._as_target(target, float)
+        assert features.shape[0] == target.shape[0]
+
+        start_time = time.perf_counter()
+        cpu_time = time.process_time()
+
+        # the mean of the target is a forest member without splits
+        mean = target.mean(axis=0)
+        intercept = Compiled_Tree(
+            feature_col=numpy.full(1, -1, dtype=numpy.intp),
+            threshold=numpy.zeros(1),
+            gain=numpy.zeros(1),
+            left=numpy.full(1, -1, dtype=numpy.intp),
+            right=numpy.full(1, -1, dtype=numpy.intp),
+            value=mean[None],
+            impurity=numpy.full(1, numpy.square(target - mean).sum()),
+            count=numpy.full(1, target.shape[0], dtype=numpy.intp),
+            level_offsets=numpy.asarray([0, 1]),
+        )
+        self._members = [intercept]
+        residual = target - mean
+
+        for _ in range(self._n_estimators):
+            model = _make_member(
+                features, residual,
+                dict(self._tree_params, n_jobs=self._n_jobs),
+                self._tune_params)
+            residual -= self._learning_rate * model.predict(features)
+            self._members.append(model._compiled)
+
+        self._weights = numpy.full(len(self._members), self._learning_rate)
+        self._weights[0] = 1
+        self.compile()
+
+        self.fit_report = SimpleNamespace(
+            wall_time=time.perf_counter() - start_time,
+            cpu_time=time.process_time() - cpu_time,
+        )
+
+
+def _make_member(features, target, tree_params, tune_params):
+    '''
+    Fits a fuzzy tree and tunes it unless epochs is 0
+    '''
+    model = Fuzzy_Decision_Tree_Regressor(**tree_params)
+    model.fit(features, target)
+
+    if tune_params['epochs'] > 0:
+        step_size = tune_params['step_size']
+        model.tune(
+            features, target,
+            ybar_optimizer=Adam(step_size),
+            gain_optimizer=Adam(step_size),
+            threshold_optimizer=Adam(step_size),
+            batch_size=tune_params['batch_size'],
+            epochs=tune_params['epochs'])
+
+    return model
+
+
+def _fit_member(features, target, seed, n_samples, tree_params, tune_params):
+    '''
+    Fits a member of a bagged forest on a bootstrap sample
+    :returns: tuple of the Compiled_Tree and the processor time spent
+    '''
+    cpu_time = time.process_time()
+    random = numpy.random.default_rng(seed)
+    sample = random.integers(features.shape[0], size=n_samples)
+
+    model = _make_member(
+        features[sample], target[sample], tree_params, tune_params)
+
+    return model._compiled, time.process_time() - cpu_time
+
+
+def _fit_shared_member(shared, *args):
+    '''
+    _fit_member in a worker process, reading the training set from shared
+    memory
+    '''
+    (arrays, blocks) = attach_arrays(shared)
+    try:
+        result = _fit_member(*arrays, *args)
+
+        # views must be released before the blocks can be closed
+        del arrays
+        return result
+
+    finally:
+        for block in blocks:
+            block.close()
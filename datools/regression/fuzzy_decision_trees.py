@@ -3,138 +3,989 @@ Fuzzy decision tree for regression
 '''
 
 
+import os
+import time
 import numpy
+from types import SimpleNamespace
+from contextlib import ExitStack, nullcontext
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
+from .compiled_trees import Compiled_Tree, leaf_sum
 from .decision_trees import Decision_Tree_Regressor
-from ..gradients.nonlinearity import Sigmoid
+from ..containers.shared_arrays import attach_arrays, shared_arrays
+from ..gradients.nonlinearity import memberships
+from ..gradients.optimizers import Adam, LBFGS
 from ..metrics.regression import mean_squared_error
 
 
 class Fuzzy_Decision_Tree_Regressor(Decision_Tree_Regressor):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, membership='sigmoid', **kwargs):
+        '''
+        :param membership str: membership function of the splits, one of
+            the names in datools.gradients.nonlinearity.memberships. The
+            rational softsign and the piecewise linear hard_sigmoid avoid
+            the exp of the sigmoid.
+        other parameters are those of Decision_Tree_Regressor
+        '''
         super().__init__(*args, **kwargs)
-        self._forward_prop_func = super()._forward_prop
-
-    def _forward_prop_fuzzy(self, features):
-        sigmoid = Sigmoid()
-        self._tree.root.r = 1
-        for node in self._tree.topological_ordering():
-            if not node.is_leaf:
-                feature_vals = features[:, node.feature_col]
-                node.x = feature_vals
-                node.a = -node.gain * (node.x - node.threshold)
-                node.mu = sigmoid.primitive(node.a)
-                node.left_child.r = node.mu * node.r
-                node.right_child.r = (1 - node.mu) * node.r
-
-    def _forward_prop(self, features):
-        self._forward_prop_func(features)
-
-    def _backward_prop(self, dl_dyhat):
-        sigmoid = Sigmoid()
-        for node in reversed(list(self._tree.topological_ordering())):
-            if node.is_leaf:
-                dyhat_dybar = node.r
-                dyhat_dr = node.ybar
-
-                node.dl_dr = dl_dyhat * dyhat_dr
-                node.dl_dybar = dl_dyhat * dyhat_dybar
+        self._set_membership(membership)
 
-            else:
-                dl_dri_left = node.left_child.dl_dr
-                dl_dri_right = node.right_child.dl_dr
-
-                dri_dmup_left = node.r
-                dri_dmup_right = -node.r
-                dl_dmup = (
-                    dl_dri_left * dri_dmup_left +
-                    dl_dri_right * dri_dmup_right
-                )
-                dl_dmu = dl_dmup
-                dmu_da = sigmoid.derivative(node.a)
-                dl_da = dl_dmu * dmu_da
+        # predicts with the fuzzy memberships once tuned, crisp before
+        self._tuned = False
+        self._optimizers = None
+        self._leaf_stats = dict()
 
-                da_dg = node.threshold - node.x
-                da_dt = node.gain
+        # minimum and maximum of every feature in fit, for initial gains
+        self._feature_range = None
 
-                node.dl_dg = dl_da * da_dg
-                node.dl_dt = dl_da * da_dt
+    def _set_membership(self, membership):
+        assert membership in memberships, f'unknown membership {membership}'
+        self._membership_name = membership
+        self._membership = memberships[membership]()
 
-                dri_drp_left = node.mu
-                dri_drp_right = 1 - node.mu
-                dl_drp = (
-                    dl_dri_left * dri_drp_left +
-                    dl_dri_right * dri_drp_right
-                )
-                node.dl_dr = dl_drp
+    def fit(self, features, target):
+        '''
+        Fits a new crisp tree, see Decision_Tree_Regressor.fit. A tuned
+        model predicts crisp again until it is tuned anew, and the state
+        of partial_fit, which belongs to the old structure, is dropped.
+        '''
+        features = numpy.atleast_2d(numpy.asarray(features, dtype=self._dtype))
+        super().fit(features, target)
+        self._tuned = False
+        self._feature_range = (features.min(axis=0), features.max(axis=0))
+        self._optimizers = None
+        self._leaf_stats = dict()
+
+    def _forward_prop_fuzzy(self, features, levels):
+        '''
+        Memberships of every sample in every node, one level at a time
+        :param features ndarray: array of shape (n_samples, n_features, )
+        :param levels list: internal nodes of every level
+        :returns: namespace of (n_nodes, n_samples) arrays x, mu, its
+            derivative dmu_da and r, and the prediction of shape
+            (n_samples,) or (n_samples, n_outputs)
+        '''
+        # node-major layout keeps the samples of one node contiguous
+        columns = numpy.ascontiguousarray(features.T, dtype=self._dtype)
+        return self._forward_prop_columns(
+            columns, self._compiled.feature_col, levels)
 
-    def tune(self, features, target, ybar_optimizer, gain_optimizer,
-            threshold_optimizer, batch_size=16, epochs=20):
+    def _forward_prop_columns(self, columns, feature_row, levels):
+        '''
+        Forward pass on features stored one row per feature
+        :param columns ndarray: array of shape (n_columns, n_samples)
+        :param feature_row ndarray: row of columns read by every node
+        :param levels list: internal nodes of every level
+        :returns: see _forward_prop_fuzzy
         '''
-        Fit features and output, resulting in a crisp tree
+        dtype = self._dtype
+        membership = self._membership
+        tree = self._compiled
+        n_samples = columns.shape[1]
+        (gain, threshold, value) = self._typed_parameters()
+
+        state = SimpleNamespace()
+        state.x = numpy.zeros((tree.n_nodes, n_samples), dtype=dtype)
+        state.mu = numpy.zeros((tree.n_nodes, n_samples), dtype=dtype)
+        state.dmu_da = numpy.zeros((tree.n_nodes, n_samples), dtype=dtype)
+        state.r = numpy.empty((tree.n_nodes, n_samples), dtype=dtype)
+        state.r[0] = 1
+
+        for nodes in levels:
+            state.x[nodes] = columns[feature_row[nodes]]
+            a = -gain[nodes, None] * (state.x[nodes] - threshold[nodes, None])
+
+            # the derivative is kept for the backward pass
+            (mu, dmu_da) = membership.primitive_and_derivative(
+                a, out=(a, None))
+            state.mu[nodes] = mu
+            state.dmu_da[nodes] = dmu_da
+            state.r[tree.left[nodes]] = state.mu[nodes] * state.r[nodes]
+            state.r[tree.right[nodes]] = (
+                (1 - state.mu[nodes]) * state.r[nodes])
+
+        leaves = tree.is_leaf
+        state.prediction = leaf_sum(value[leaves], state.r[leaves])
+
+        return state
+
+    def _split_columns(self, features):
+        '''
+        Node-major copy of only the features the tree splits on
+        :param features ndarray: array of shape (n_samples, n_features, )
+        :returns: tuple of the array of shape (n_used_features, n_samples)
+            and the row of that array read by every node
+        '''
+        tree = self._compiled
+        used = numpy.unique(tree.feature_col[~tree.is_leaf])
+        feature_row = numpy.zeros(features.shape[1], dtype=numpy.intp)
+        feature_row[used] = numpy.arange(used.shape[0])
+
+        columns = numpy.ascontiguousarray(
+            features[:, used].T, dtype=self._dtype)
+        return columns, feature_row[numpy.maximum(tree.feature_col, 0)]
+
+    def _typed_parameters(self):
+        '''
+        Gains, thresholds and leaf values in the floating point type of the
+        computation, so that they do not promote the per-sample arrays
+        '''
+        tree = self._compiled
+        return (
+            tree.gain.astype(self._dtype, copy=False),
+            tree.threshold.astype(self._dtype, copy=False),
+            tree.value.astype(self._dtype, copy=False),
+        )
+
+    def _predict_compiled(self, features):
+        if self._tuned:
+            return self._compiled.predict_fuzzy(features, self._membership)
+        return self._compiled.predict_crisp(features)
+
+    def _get_metadata(self):
+        metadata = super()._get_metadata()
+        metadata['tuned'] = self._tuned
+        metadata['membership'] = self._membership_name
+        if self._feature_range is not None:
+            metadata['feature_range'] = [
+                bounds.tolist() for bounds in self._feature_range]
+        return metadata
+
+    def _set_metadata(self, metadata):
+        self._set_membership(metadata.get('membership', 'sigmoid'))
+        if 'feature_range' in metadata:
+            self._feature_range = tuple(
+                numpy.asarray(bounds) for bounds in metadata['feature_range'])
+        self._tuned = metadata['tuned']
+
+    def predict_sparse(self, features, min_membership=1e-2,
+                       max_active_leaves=None, chunk_size=16384, out=None):
+        '''
+        Approximate fuzzy prediction that skips the branches a sample has
+        a negligible membership in. Faster than predict only if samples
+        reach a small fraction of the leaves, which
+        sparse_approximation_error reports along with the error. A model
+        that is not tuned predicts crisp, exactly as predict does.
         :param features ndarray: array of shape (n_samples, n_features, )
-        :param output ndarray: array of shape (n_samples,)
+        :param min_membership float: membership below which a branch is cut
+        :param max_active_leaves int: maximal number of leaves per sample
+        :param chunk_size int: number of rows per block, None for one block
+        :param out ndarray: preallocated array of shape (n_samples, )
+        :returns: array of shape (n_samples, )
+        '''
+        def predict_func(features):
+            (prediction, _) = self._predict_sparse(
+                features, min_membership, max_active_leaves)
+            return prediction
+
+        return self._predict_blocks(predict_func, features, chunk_size, out)
+
+    def _predict_sparse(self, features, min_membership, max_active_leaves):
+        '''
+        :returns: tuple of the prediction and the number of leaves evaluated
+            for every sample, the one leaf it routes to if not tuned
+        '''
+        if not self._tuned:
+            n_leaves = numpy.ones(features.shape[0], dtype=numpy.intp)
+            return self._compiled.predict_crisp(features), n_leaves
+
+        return self._compiled.predict_sparse(
+            features, self._membership, min_membership=min_membership,
+            max_active_leaves=max_active_leaves)
+
+    def sparse_approximation_error(self, features, min_membership=1e-2,
+                                   max_active_leaves=None):
+        '''
+        Compares sparse against dense prediction, which agree for a model
+        that is not tuned
+        :returns: namespace with the maximal absolute and the root mean
+            squared difference, and the mean number of leaves evaluated per
+            sample by the sparse prediction and in the tree
         '''
         features = numpy.atleast_2d(features)
-        target = numpy.asarray(target).reshape(-1)
-
-        # calculates initial gain
-        for node in self._tree.topological_ordering():
-            if not node.is_leaf:
-                feature_vals = features[:, node.feature_col]
-                a = feature_vals - node.threshold
-                f = numpy.sqrt(
-                    node.impurity /
-                    (node.left_child.impurity + node.right_child.impurity)
-                ) - 1
-                node.gain = f / (2 * min(a.max(), (-a).max()))
-
-        self._forward_prop_func = self._forward_prop_fuzzy
+        (sparse, n_leaves) = self._predict_sparse(
+            features, min_membership, max_active_leaves)
+        dense = self.predict(features)
+
+        return SimpleNamespace(
+            max_abs_error=numpy.abs(sparse - dense).max(),
+            rmse=numpy.sqrt(numpy.square(sparse - dense).mean()),
+            mean_active_leaves=n_leaves.mean(),
+            n_leaves=numpy.count_nonzero(self._compiled.is_leaf),
+        )
+
+    def _backward_prop(self, state, dl_dyhat, levels):
+        '''
+        Gradients of the loss in one reverse sweep over the levels
+        :param state SimpleNamespace: result of the forward pass
+        :param dl_dyhat ndarray: array of shape (n_samples,) or
+            (n_samples, n_outputs)
+        :param levels list: internal nodes of every level
+        :returns: namespace of arrays of shape (n_nodes,) holding the
+            gradients dl_dg, dl_dt and dl_dybar averaged over samples,
+            dl_dybar has the shape of the values of the tree
+        '''
+        tree = self._compiled
+        leaves = tree.is_leaf
+        (gain, threshold, value) = self._typed_parameters()
+        dl_dyhat = numpy.asarray(dl_dyhat, dtype=self._dtype)
+
+        gradients = SimpleNamespace()
+        gradients.dl_dg = numpy.zeros(tree.n_nodes)
+        gradients.dl_dt = numpy.zeros(tree.n_nodes)
+        gradients.dl_dybar = numpy.zeros(tree.value.shape)
+
+        dl_dr = numpy.empty_like(state.r)
+
+        dyhat_dybar = state.r[leaves]
+        if value.ndim == 1:
+            dyhat_dr = value[leaves, None]
+            dl_dr[leaves] = dl_dyhat * dyhat_dr
+            gradients.dl_dybar[leaves] = (
+                dl_dyhat * dyhat_dybar).mean(axis=1)
+        else:
+            # every output of a leaf adds to the gradient of its membership
+            dl_dr[leaves] = value[leaves] @ dl_dyhat.T
+            gradients.dl_dybar[leaves] = (
+                dyhat_dybar @ dl_dyhat / dl_dyhat.shape[0])
+
+        for nodes in reversed(levels):
+            dl_dri_left = dl_dr[tree.left[nodes]]
+            dl_dri_right = dl_dr[tree.right[nodes]]
+            r = state.r[nodes]
+            mu = state.mu[nodes]
+
+            dri_dmup_left = r
+            dri_dmup_right = -r
+            dl_dmup = (
+                dl_dri_left * dri_dmup_left +
+                dl_dri_right * dri_dmup_right
+            )
+            dl_dmu = dl_dmup
+            dmu_da = state.dmu_da[nodes]
+            dl_da = dl_dmu * dmu_da
+
+            da_dg = threshold[nodes, None] - state.x[nodes]
+            da_dt = gain[nodes, None]
+
+            gradients.dl_dg[nodes] = (dl_da * da_dg).mean(axis=1)
+            gradients.dl_dt[nodes] = (dl_da * da_dt).mean(axis=1)
+
+            dri_drp_left = mu
+            dri_drp_right = 1 - mu
+            dl_dr[nodes] = (
+                dl_dri_left * dri_drp_left +
+                dl_dri_right * dri_drp_right
+            )
+
+        return gradients
+
+    def _init_gain(self, features=None):
+        '''
+        Calculates the initial gain of every split from the impurity drop
+        and the range of the feature around the threshold
+        :param features ndarray: samples the range is taken from, the range
+            of the features in fit if None
+        '''
+        if features is None:
+            (x_min, x_max) = self._feature_range
+        else:
+            (x_min, x_max) = (features.min(axis=0), features.max(axis=0))
+
+        tree = self._compiled
+        internal = ~tree.is_leaf
+        feature_col = tree.feature_col[internal]
+        threshold = tree.threshold[internal]
+
+        a_max = x_max[feature_col] - threshold
+        a_min = x_min[feature_col] - threshold
+        f = numpy.sqrt(
+            tree.impurity[internal] / (
+                tree.impurity[tree.left[internal]] +
+                tree.impurity[tree.right[internal]]
+            )
+        ) - 1
+        tree.gain[internal] = f / (2 * numpy.minimum(a_max, -a_min))
+
+    def _snapshot(self):
+        tree = self._compiled
+        return (tree.gain.copy(), tree.threshold.copy(), tree.value.copy())
+
+    def _restore(self, snapshot):
+        tree = self._compiled
+        (tree.gain[:], tree.threshold[:], tree.value[:]) = snapshot
+
+    def _get_parameters(self):
+        '''
+        All tunable parameters as one vector of gains, thresholds and leaf
+        values
+        '''
+        tree = self._compiled
+        internal = ~tree.is_leaf
+        return numpy.concatenate((
+            tree.gain[internal],
+            tree.threshold[internal],
+            tree.value[~internal].reshape(-1),
+        ))
+
+    def _set_parameters(self, parameters):
+        tree = self._compiled
+        internal = ~tree.is_leaf
+        n_internal = numpy.count_nonzero(internal)
+        tree.gain[internal] = parameters[:n_internal]
+        tree.threshold[internal] = parameters[n_internal:2 * n_internal]
+        tree.value[~internal] = parameters[2 * n_internal:].reshape(
+            (-1,) + tree.value.shape[1:])
+
+    def _loss_and_gradients(self, features, target, levels,
+                            chunk_size=4096):
+        '''
+        Full-batch mean squared error, over samples and outputs, and its
+        gradients, accumulated over chunks of samples to bound the size of
+        the per-node arrays
+        :returns: tuple of (loss, gradients) where gradients is a namespace
+            of arrays of shape (n_nodes,)
+        '''
+        n_samples = features.shape[0]
+        loss = 0
+        gradients = None
+
+        for begin in range(0, n_samples, chunk_size):
+            chunk = slice(begin, begin + chunk_size)
+            state = self._forward_prop_fuzzy(features[chunk], levels)
+            error = target[chunk] - state.prediction
+            weight = error.shape[0] / n_samples
+
+            loss += float(numpy.square(error).mean()) * weight
+            chunk_gradients = self._backward_prop(
+                state, _squared_error_gradient(error), levels)
+
+            if gradients is None:
+                gradients = SimpleNamespace(
+                    dl_dg=numpy.zeros_like(chunk_gradients.dl_dg),
+                    dl_dt=numpy.zeros_like(chunk_gradients.dl_dt),
+                    dl_dybar=numpy.zeros_like(chunk_gradients.dl_dybar))
+
+            gradients.dl_dg += chunk_gradients.dl_dg * weight
+            gradients.dl_dt += chunk_gradients.dl_dt * weight
+            gradients.dl_dybar += chunk_gradients.dl_dybar * weight
+
+        return loss, gradients
+
+    def _monitor(self, monitor, epoch, validation_data, patience):
+        '''
+        Records the validation loss after an epoch and snapshots the best
+        parameters
+        :returns: True if tuning should stop
+        '''
+        if validation_data is None:
+            return False
+
+        validation_loss = mean_squared_error(
+            self.predict(validation_data[0]), validation_data[1])
+        self.tune_report.validation_losses.append(validation_loss)
+
+        if validation_loss < monitor.best_loss:
+            monitor.best_loss = validation_loss
+            monitor.best_snapshot = self._snapshot()
+            self.tune_report.best_epoch = epoch
+            return False
+
+        return (
+            patience is not None and
+            epoch - self.tune_report.best_epoch >= patience
+        )
+
+    def tune(self, features, target, ybar_optimizer=None,
+            gain_optimizer=None, threshold_optimizer=None, batch_size=16,
+            epochs=20, validation_data=None, validation_fraction=None,
+            patience=None, method='minibatch', lbfgs=None, n_workers=1):
+        '''
+        Tunes the gains, thresholds and leaf values of the fitted tree, by
+        minibatch gradient descent or by full-batch L-BFGS
+        :param features ndarray: array of shape (n_samples, n_features, )
+        :param target ndarray: array of shape (n_samples,), or
+            (n_samples, n_outputs) for a tree fit on several outputs, whose
+            leaf values are tuned jointly on the mean squared error over
+            samples and outputs
+        :param ybar_optimizer: optimizer of the vector of leaf values
+        :param gain_optimizer: optimizer of the vector of split gains
+        :param threshold_optimizer: optimizer of the vector of thresholds
+        :param validation_data tuple: (features, target) to monitor after
+            every epoch, the parameters of the best epoch are kept
+        :param validation_fraction float: holds out this fraction of the
+            last samples as validation data instead
+        :param patience int: stops after this many epochs without
+            improvement of the validation loss, None to run all epochs
+        :param method str: 'minibatch' to step the three optimizers on
+            shuffled minibatches, 'lbfgs' for full-batch L-BFGS over all
+            parameters where an epoch is one L-BFGS iteration
+        :param lbfgs LBFGS: settings of the L-BFGS method, the default
+            runs at most epochs iterations
+        :param n_workers int: number of processes computing the gradients
+            of shards of every minibatch, or of the full batch for L-BFGS,
+            -1 for one per processor. Workers read the training set from
+            shared memory. Pays off for large batches only.
+        :returns: array of shape (epochs run, n_batches) of batch losses,
+            the full-batch loss of every iteration for L-BFGS
+        '''
+        features = numpy.atleast_2d(numpy.asarray(features, dtype=self._dtype))
+        target = self._as_target(target, self._dtype)
+
+        assert method in ('minibatch', 'lbfgs')
+        assert validation_data is None or validation_fraction is None
+
+        # the held out tail may hold thresholds, so the gains see all samples
+        self._init_gain(features)
+        self._tuned = True
+
+        if validation_fraction is not None:
+            assert 0 < validation_fraction < 1
+            split_at = int(round(features.shape[0] * (1 - validation_fraction)))
+            validation_data = (features[split_at:], target[split_at:])
+            features = features[:split_at]
+            target = target[:split_at]
+
+        assert patience is None or validation_data is not None
+        assert n_workers == -1 or n_workers >= 1
+
+        self.tune_report = SimpleNamespace()
+        self.tune_report.method = method
+        self.tune_report.validation_losses = list()
+        self.tune_report.best_epoch = None
+        self.tune_report.epochs = 0
+        monitor = SimpleNamespace(best_loss=numpy.inf, best_snapshot=None)
+        start_time = time.perf_counter()
+
+        if n_workers == 1:
+            pool = nullcontext()
+        else:
+            pool = _Gradient_Pool(self, features, target, n_workers)
+
+        with self.instruments.timer('tune'), pool:
+            if method == 'lbfgs':
+                if lbfgs is None:
+                    lbfgs = LBFGS(max_iterations=epochs)
+                losses = self._tune_lbfgs(
+                    features, target, lbfgs, monitor, validation_data,
+                    patience, pool)
+            else:
+                losses = self._tune_minibatch(
+                    features, target, ybar_optimizer, gain_optimizer,
+                    threshold_optimizer, batch_size, epochs, monitor,
+                    validation_data, patience, pool)
+
+        if monitor.best_snapshot is not None:
+            self._restore(monitor.best_snapshot)
+
+        self.tune_report.wall_time = time.perf_counter() - start_time
+
+        return losses
+
+    def _tune_lbfgs(self, features, target, lbfgs, monitor,
+                    validation_data, patience, pool):
+        levels = self._compiled.internal_nodes_by_level()
+        internal = ~self._compiled.is_leaf
+
+        def func(parameters):
+            self._set_parameters(parameters)
+            with self.instruments.timer('tune.loss_and_gradients'):
+                if isinstance(pool, _Gradient_Pool):
+                    (loss, gradients) = pool.loss_and_gradients(
+                        slice(0, features.shape[0]))
+                else:
+                    (loss, gradients) = self._loss_and_gradients(
+                        features, target, levels)
+            gradient = numpy.concatenate((
+                gradients.dl_dg[internal],
+                gradients.dl_dt[internal],
+                gradients.dl_dybar[~internal].reshape(-1),
+            ))
+            return loss, gradient
+
+        progress = tqdm(total=lbfgs.max_iterations, desc='Iteration',
+                        leave=False)
+
+        def callback(parameters, loss):
+            self._set_parameters(parameters)
+            epoch = self.tune_report.epochs
+            self.tune_report.epochs += 1
+            with self.instruments.timer('tune.progress'):
+                progress.update()
+                progress.set_postfix(loss=f'{loss:20.6f}')
+
+            self.instruments.count('epochs')
+            self.instruments.emit('epoch', epoch=epoch, loss=loss)
+
+            with self.instruments.timer('tune.validation'):
+                return self._monitor(
+                    monitor, epoch, validation_data, patience)
+
+        result = lbfgs.minimize(func, self._get_parameters(), callback)
+        progress.close()
+
+        if monitor.best_snapshot is None:
+            self._set_parameters(result.x)
+
+        self.tune_report.iterations = result.iterations
+        self.tune_report.function_evaluations = result.function_evaluations
+        self.tune_report.losses = result.losses
+
+        return numpy.asarray(result.losses[1:]).reshape(-1, 1)
+
+    def _tune_minibatch(self, features, target, ybar_optimizer,
+                        gain_optimizer, threshold_optimizer, batch_size,
+                        epochs, monitor, validation_data, patience, pool):
+        assert None not in (ybar_optimizer, gain_optimizer,
+                            threshold_optimizer)
+
+        tree = self._compiled
+        levels = tree.internal_nodes_by_level()
+        leaves = tree.is_leaf
+        internal = ~leaves
         n_samples = features.shape[0]
 
         batch_ranges = range(batch_size, n_samples, batch_size)
         n_batches = len(batch_ranges)
         losses = numpy.empty((epochs, n_batches))
         random = numpy.random.default_rng()
+        instruments = self.instruments
+        parallel = isinstance(pool, _Gradient_Pool)
+
+        # workers gather their shards from shared memory, otherwise batches
+        # are gathered from one copy of the features the tree splits on
+        # into buffers reused by every batch
+        if not parallel:
+            (columns, feature_row) = self._split_columns(features)
+            batch_columns = numpy.empty(
+                (columns.shape[0], batch_size), dtype=columns.dtype)
+            batch_target = numpy.empty(
+                (batch_size,) + target.shape[1:], dtype=target.dtype)
 
         epoch_progress = tqdm(range(epochs), desc='Epoch', leave=False)
         for epoch in epoch_progress:
-            shuffle = random.permutation(range(n_samples))
-
-            features_split = numpy.array_split(
-                features[shuffle, :], batch_ranges)
-
-            target_split = numpy.array_split(target[shuffle], batch_ranges)
+            with instruments.timer('tune.shuffle'):
+                shuffle = random.permutation(n_samples)
 
             batch_progress = tqdm(range(n_batches), desc='Batch', leave=False)
 
             for batch in batch_progress:
-                target_split_hat = self.predict(features_split[batch])
-
-                loss = mean_squared_error(
-                    target_split_hat, target_split[batch])
+                samples = shuffle[batch * batch_size:(batch + 1) * batch_size]
+
+                if parallel:
+                    with instruments.timer('tune.gradients'):
+                        (loss, gradients) = pool.loss_and_gradients(samples)
+                else:
+                    with instruments.timer('tune.shuffle'):
+                        numpy.take(columns, samples, axis=1, out=batch_columns)
+                        numpy.take(
+                            target, samples, axis=0, out=batch_target)
+
+                    with instruments.timer('tune.forward'):
+                        state = self._forward_prop_columns(
+                            batch_columns, feature_row, levels)
+                        target_hat = state.prediction
+
+                        loss = mean_squared_error(
+                            target_hat, batch_target)
+
+                    with instruments.timer('tune.backward'):
+                        dl_dyhat = _squared_error_gradient(
+                            batch_target - target_hat)
+                        gradients = self._backward_prop(
+                            state, dl_dyhat, levels)
 
                 losses[epoch, batch] = loss
 
-                batch_progress.set_postfix(loss=f'{loss:20.6f}')
+                with instruments.timer('tune.progress'):
+                    batch_progress.set_postfix(loss=f'{loss:20.6f}')
+
+                with instruments.timer('tune.optimizer'):
+                    tree.value[leaves] += ybar_optimizer(
+                        gradients.dl_dybar[leaves])
+                    tree.gain[internal] += gain_optimizer(
+                        gradients.dl_dg[internal])
+                    tree.threshold[internal] += threshold_optimizer(
+                        gradients.dl_dt[internal])
+
+                instruments.count('batches')
+                instruments.emit('batch', epoch=epoch, batch=batch, loss=loss)
+
+            self.tune_report.epochs = epoch + 1
+            with instruments.timer('tune.progress'):
+                epoch_progress.set_postfix(
+                    min=f'{losses[epoch, :].min():>20.6f}',
+                    max=f'{losses[epoch, :].max():>20.6f}',
+                    avg=f'{losses[epoch, :].mean():>20.6f}'
+                )
+
+            instruments.count('epochs')
+            instruments.emit(
+                'epoch', epoch=epoch, loss=losses[epoch, :].mean())
+
+            with instruments.timer('tune.validation'):
+                stop = self._monitor(
+                    monitor, epoch, validation_data, patience)
+            if stop:
+                break
 
-                dl_dyhat = -2 * (target_split[batch] - target_split_hat)
-                self._backward_prop(dl_dyhat)
+        self._optimizers = SimpleNamespace(
+            ybar=ybar_optimizer, gain=gain_optimizer,
+            threshold=threshold_optimizer)
 
-                for node in self._tree.nodes:
-                    if node.is_leaf:
-                        node.ybar += ybar_optimizer(node.dl_dybar.mean())
+        return losses[:self.tune_report.epochs]
 
-                    else:
-                        node.gain += gain_optimizer(node.dl_dg.mean())
-                        node.threshold += threshold_optimizer(node.dl_dt.mean())
+    def partial_fit(self, features, target, ybar_optimizer=None,
+                    gain_optimizer=None, threshold_optimizer=None,
+                    grow=False):
+        '''
+        Updates a fitted tree with new samples in time proportional to the
+        number of new samples. The structure is kept, gains, thresholds
+        and leaf values take one gradient step on the new samples. The
+        optimizers, and their state, persist between calls and continue
+        those of the last minibatch tune. An untuned model starts from the
+        gains of tune, computed from the range of the features in fit.
+        :param features ndarray: array of shape (n_samples, n_features, )
+        :param target ndarray: array of shape (n_samples,), or
+            (n_samples, n_outputs) for a tree fit on several outputs
+        :param ybar_optimizer: replaces the optimizer of the leaf values
+        :param gain_optimizer: replaces the optimizer of the split gains
+        :param threshold_optimizer: replaces the optimizer of thresholds
+        :param grow bool: also accumulates per-leaf histograms of the new
+            samples and splits leaves whose histograms show an impurity
+            drop above min_impurity_drop, requires a model fit with max_bins
+        :returns: mean squared error of the new samples before the update
+        '''
+        features = numpy.atleast_2d(numpy.asarray(features, dtype=self._dtype))
+        target = self._as_target(target, self._dtype)
+        assert features.shape[0] == target.shape[0]
+
+        # thresholds lie inside the range of the features in fit, unlike
+        # the range of a small batch which may lie on one side of them
+        if not self._tuned:
+            assert self._feature_range is not None, \
+                'tune the model or fit it before partial_fit'
+            self._init_gain()
+            self._tuned = True
+
+        if self._optimizers is None:
+            self._optimizers = SimpleNamespace(
+                ybar=Adam(), gain=Adam(), threshold=Adam())
+        if ybar_optimizer is not None:
+            self._optimizers.ybar = ybar_optimizer
+        if gain_optimizer is not None:
+            self._optimizers.gain = gain_optimizer
+        if threshold_optimizer is not None:
+            self._optimizers.threshold = threshold_optimizer
+
+        tree = self._compiled
+        leaves = tree.is_leaf
+        internal = ~leaves
+
+        with self.instruments.timer('partial_fit.loss_and_gradients'):
+            (loss, gradients) = self._loss_and_gradients(
+                features, target, tree.internal_nodes_by_level())
+
+        with self.instruments.timer('partial_fit.optimizer'):
+            tree.value[leaves] += self._optimizers.ybar(
+                gradients.dl_dybar[leaves])
+            tree.gain[internal] += self._optimizers.gain(
+                gradients.dl_dg[internal])
+            tree.threshold[internal] += self._optimizers.threshold(
+                gradients.dl_dt[internal])
+
+        if grow:
+            with self.instruments.timer('partial_fit.grow'):
+                self._grow(features, target)
+
+        self.instruments.count('partial_fit_samples', features.shape[0])
+
+        return loss
+
+    def _grow(self, features, target):
+        '''
+        Accumulates running per-leaf statistics of new samples and splits
+        the leaves with enough evidence for a split
+        '''
+        assert self._bin_edges is not None, 'growing requires max_bins'
+
+        leaf_of_sample = self._compiled.route(features)
+        bins = self._quantize(features)
+
+        for leaf in numpy.unique(leaf_of_sample):
+            mask = (leaf_of_sample == leaf)
+            histograms = self._build_histograms(bins[mask], target[mask])
+
+            if leaf not in self._leaf_stats:
+                self._leaf_stats[leaf] = SimpleNamespace(
+                    counts=numpy.zeros(histograms[0].shape),
+                    sums=numpy.zeros(histograms[1].shape),
+                    sq_sums=numpy.zeros(histograms[2].shape),
+                    x_min=numpy.full(features.shape[1], numpy.inf),
+                    x_max=numpy.full(features.shape[1], -numpy.inf),
+                    unchecked=0,
+                )
 
-            epoch_progress.set_postfix(
-                min=f'{losses[epoch, :].min():>20.6f}',
-                max=f'{losses[epoch, :].max():>20.6f}',
-                avg=f'{losses[epoch, :].mean():>20.6f}'
+            stats = self._leaf_stats[leaf]
+            stats.counts += histograms[0]
+            stats.sums += histograms[1]
+            stats.sq_sums += histograms[2]
+            stats.x_min = numpy.minimum(stats.x_min, features[mask].min(0))
+            stats.x_max = numpy.maximum(stats.x_max, features[mask].max(0))
+            stats.unchecked += numpy.count_nonzero(mask)
+
+        ready = [
+            leaf for leaf, stats in self._leaf_stats.items()
+            if stats.unchecked >= max(self._min_count, 1)
+        ]
+        while ready:
+            leaf = ready.pop()
+            stats = self._leaf_stats.pop(leaf)
+            stats.unchecked = 0
+
+            split = self._split_from_stats(stats)
+            if split is None:
+                self._leaf_stats[leaf] = stats
+                continue
+
+            # splitting renumbers the nodes
+            new_index = self._split_leaf(leaf, split)
+            ready = [new_index[leaf] for leaf in ready]
+
+    def _split_from_stats(self, stats):
+        '''
+        Best split of a leaf according to its running histograms
+        :returns: namespace of the split or None if no split is justified
+        '''
+        n_samples = stats.counts[0].sum()
+        mean = stats.sums[0].sum(axis=0) / n_samples
+
+        # counts broadcast over the last axis of outputs of the sums
+        counts = stats.counts
+        if stats.sums.ndim == 3:
+            counts = counts[..., None]
+
+        # centering improves the precision of the prefix sums
+        sums = stats.sums - counts * mean
+        sq_sums = (
+            stats.sq_sums - 2 * mean * stats.sums +
+            counts * numpy.square(mean)
+        )
+        scale = sq_sums[0].sum()
+
+        scores = self._score_histograms(stats.counts, sums, sq_sums, scale)
+        impurities = numpy.asarray([impurity for impurity, _ in scores])
+        if not numpy.isfinite(impurities).any():
+            return None
+
+        feature_col = self._first_minimum(impurities, scale)
+        if not (scale - impurities[feature_col]) > self._min_impurity_drop:
+            return None
+
+        split = SimpleNamespace()
+        split.feature_col = feature_col
+        split.threshold = self._bin_edges[feature_col][scores[feature_col][1]]
+
+        left_bins = slice(0, scores[feature_col][1] + 1)
+        right_bins = slice(scores[feature_col][1] + 1, None)
+        children = list()
+        for bins in (left_bins, right_bins):
+            count = stats.counts[feature_col, bins].sum()
+            offset = sums[feature_col, bins].sum(axis=0) / count
+            impurity = (
+                sq_sums[feature_col, bins].sum() -
+                numpy.square(sums[feature_col, bins].sum(axis=0)).sum() /
+                count
             )
+            children.append((offset, impurity, count))
+        (split.left, split.right) = children
 
-        return losses
+        f = numpy.sqrt(scale / (split.left[1] + split.right[1])) - 1
+        split.gain = f / (2 * min(
+            stats.x_max[feature_col] - split.threshold,
+            split.threshold - stats.x_min[feature_col]))
 
+        return split
 
+    def _split_leaf(self, leaf, split):
+        '''
+        Splits a leaf of the compiled tree and carries the optimizer state
+        and the running statistics over to the new node order
+        :returns: dict of the new index of every old node
+        '''
+        old_tree = self._compiled
+        value = old_tree.value[leaf]
+
+        # children continue the tuned value of the leaf, shifted by the
+        # difference of their mean to the mean of the leaf
+        (tree, old_index) = old_tree.split_leaf(
+            leaf, split.feature_col, split.threshold, split.gain,
+            (value + split.left[0],) + split.left[1:],
+            (value + split.right[0],) + split.right[1:])
+
+        for group_mask, old_group_mask, optimizers in (
+                (tree.is_leaf, old_tree.is_leaf, (self._optimizers.ybar,)),
+                (~tree.is_leaf, ~old_tree.is_leaf,
+                 (self._optimizers.gain, self._optimizers.threshold))):
+            position = numpy.full(old_tree.n_nodes + 1, -1)
+            position[:-1][old_group_mask] = numpy.arange(
+                numpy.count_nonzero(old_group_mask))
+            indices = position[old_index[group_mask]]
+            for optimizer in optimizers:
+                optimizer.reindex(indices)
+
+        new_index = {old: new for new, old in enumerate(old_index) if old >= 0}
+        self._leaf_stats = {
+            new_index[leaf]: stats
+            for leaf, stats in self._leaf_stats.items()
+        }
+        self._compiled = tree
+
+        return new_index
+
+
+class _Gradient_Pool:
+    '''
+    Worker processes computing the loss and gradients of a fuzzy tree on
+    shards of the training set, which the workers read from shared memory.
+    Every worker returns sums over its shard which are reduced to the means
+    over all samples, so the result matches _loss_and_gradients up to
+    rounding. The workers and the shared memory exist inside the with
+    block only.
+    '''
+
+    def __init__(self, model, features, target, n_workers):
+        if n_workers == -1:
+            n_workers = os.cpu_count()
+
+        self._model = model
+        self._n_workers = n_workers
+        self._arrays = (features, target)
+        self._executor = None
+        self._stack = None
+
+    def __enter__(self):
+        # the shared memory is released if starting the workers fails
+        with ExitStack() as stack:
+            shared = stack.enter_context(shared_arrays(*self._arrays))
+
+            model = self._model
+            tree = model._compiled
+            structure = {
+                name: getattr(tree, name)
+                for name in Compiled_Tree._array_names
+            }
+            self._executor = stack.enter_context(ProcessPoolExecutor(
+                max_workers=self._n_workers,
+                initializer=_init_gradient_worker,
+                initargs=(shared, structure, model._dtype,
+                          model._membership_name)))
+
+            self._stack = stack.pop_all()
+
+        return self
+
+    def __exit__(self, *exc_info):
+        # shuts the workers down before the shared memory is released
+        return self._stack.__exit__(*exc_info)
+
+    def loss_and_gradients(self, samples):
+        '''
+        :param samples: index array or slice of the samples of the batch
+        :returns: tuple of (loss, gradients) as from _loss_and_gradients
+        '''
+        if isinstance(samples, slice):
+            bounds = numpy.linspace(
+                samples.start, samples.stop, self._n_workers + 1).astype(int)
+            shards = [
+                slice(begin, end)
+                for begin, end in zip(bounds[:-1], bounds[1:]) if end > begin
+            ]
+            n_samples = samples.stop - samples.start
+        else:
+            shards = [
+                shard for shard in numpy.array_split(samples, self._n_workers)
+                if shard.shape[0]
+            ]
+            n_samples = samples.shape[0]
+
+        tree = self._model._compiled
+        parameters = (tree.gain, tree.threshold, tree.value)
+        futures = [
+            self._executor.submit(_partial_gradients, parameters, shard)
+            for shard in shards
+        ]
+
+        loss = 0
+        gradients = SimpleNamespace(
+            dl_dg=numpy.zeros(tree.n_nodes),
+            dl_dt=numpy.zeros(tree.n_nodes),
+            dl_dybar=numpy.zeros(tree.value.shape))
+        for future in futures:
+            (shard_loss, dl_dg, dl_dt, dl_dybar) = future.result()
+            loss += shard_loss
+            gradients.dl_dg += dl_dg
+            gradients.dl_dt += dl_dt
+            gradients.dl_dybar += dl_dybar
+
+        loss /= n_samples
+        gradients.dl_dg /= n_samples
+        gradients.dl_dt /= n_samples
+        gradients.dl_dybar /= n_samples
+
+        return loss, gradients
+
+
+def _squared_error_gradient(error):
+    '''
+    Gradient of the squared error of every sample, averaged over the outputs,
+    with respect to the prediction
+    :param error ndarray: target minus prediction, of shape (n_samples,) or
+        (n_samples, n_outputs)
+    '''
+    if error.ndim == 1:
+        return -2 * error
+    return -2 / error.shape[1] * error
+
+
+# state of a gradient worker process, set by _init_gradient_worker
+_worker = None
+
+
+def _init_gradient_worker(shared, structure, dtype, membership):
+    global _worker
+
+    ((features, target), blocks) = attach_arrays(shared)
+    model = Fuzzy_Decision_Tree_Regressor(
+        min_count=1, min_impurity_drop=0, dtype=dtype, membership=membership)
+    model._compiled = Compiled_Tree(**{
+        name: numpy.array(array) for name, array in structure.items()
+    })
+
+    _worker = SimpleNamespace(
+        model=model,
+        features=features,
+        target=target,
+        blocks=blocks,
+        levels=model._compiled.internal_nodes_by_level(),
+    )
+
+
+def _partial_gradients(parameters, samples):
+    '''
+    Sums of the squared error and of the gradients over a shard of samples
+    '''
+    tree = _worker.model._compiled
+    (tree.gain[:], tree.threshold[:], tree.value[:]) = parameters
+
+    features = _worker.features[samples]
+    (loss, gradients) = _worker.model._loss_and_gradients(
+        features, _worker.target[samples], _worker.levels)
+
+    n_samples = features.shape[0]
+    return (
+        loss * n_samples,
+        gradients.dl_dg * n_samples,
+        gradients.dl_dt * n_samples,
+        gradients.dl_dybar * n_samples,
+    )
@@ -114,6 +114,33 @@ class Test_Tree(unittest.TestCase):
 
         self.assertEqual(list(tree.topological_ordering()), test_key)
 
+    def test_levels(self):
+        tree = Binary_Tree()
+
+        root = Binary_Tree_Node()
+        l_child = Binary_Tree_Node()
+        r_child = Binary_Tree_Node()
+        l_grandchild = Binary_Tree_Node()
+
+        tree.add_node(root)
+        tree.add_node(l_child, parent=root, left_side=True)
+        tree.add_node(r_child, parent=root, left_side=False)
+
+        self.assertEqual(tree.levels(), [(root,), (l_child, r_child)])
+        self.assertEqual(list(tree.reverse_topological_ordering()),
+                         [r_child, l_child, root])
+
+        # cached orders are invalidated when the tree changes
+        tree.add_node(l_grandchild, parent=l_child, left_side=True)
+
+        self.assertEqual(tree.levels(),
+                         [(root,), (l_child, r_child), (l_grandchild,)])
+        self.assertEqual(list(tree.topological_ordering()),
+                         [root, l_child, r_child, l_grandchild])
+        self.assertEqual(list(tree.reverse_topological_ordering()),
+                         [l_grandchild, r_child, l_child, root])
+        self.assertEqual(list(tree.leaves), [r_child, l_grandchild])
+
     def test_death_existing_node(self):
         tree = Binary_Tree()
 
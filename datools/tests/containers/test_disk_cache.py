@@ -0,0 +1,73 @@
+'''
+Unit tests for the disk cache
+'''
+
+
+import os
+import tempfile
+import time
+import unittest
+
+import numpy
+
+from datools.containers.disk_cache import Disk_Cache
+
+
+class Test_Disk_Cache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_make_key(self):
+        self.assertEqual(
+            Disk_Cache.make_key('ab', b'c'), Disk_Cache.make_key(b'ab', 'c'))
+        self.assertNotEqual(
+            Disk_Cache.make_key('ab', 'c'), Disk_Cache.make_key('a', 'bc'))
+
+    def test_put_get(self):
+        cache = Disk_Cache(self.directory.name)
+        array = numpy.arange(12.0).reshape(3, 4)
+
+        def write_func(path):
+            with open(os.path.join(path, 'note'), 'w') as file:
+                file.write('hello')
+
+        self.assertIsNone(cache.get('key'))
+        cache.put('key', {'array': array}, write_func)
+
+        for mmap in (False, True):
+            entry = cache.get('key', mmap=mmap)
+            numpy.testing.assert_array_equal(entry.arrays['array'], array)
+            with open(os.path.join(entry.path, 'note')) as file:
+                self.assertEqual(file.read(), 'hello')
+
+        # entries are never overwritten
+        cache.put('key', {'array': array + 1})
+        numpy.testing.assert_array_equal(
+            cache.get('key').arrays['array'], array)
+
+    def test_evict_least_recently_used(self):
+        array = numpy.zeros(1000)
+        cache = Disk_Cache(self.directory.name, max_bytes=2.5 * array.nbytes)
+
+        for key in ('a', 'b'):
+            cache.put(key, {'array': array})
+            time.sleep(0.01)
+
+        # a hit makes 'a' the most recently used entry
+        cache.get('a')
+        time.sleep(0.01)
+        cache.put('c', {'array': array})
+
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('c'))
+
+    def test_keep_entry_above_limit(self):
+        cache = Disk_Cache(self.directory.name, max_bytes=1)
+        cache.put('a', {'array': numpy.zeros(10)})
+        cache.put('b', {'array': numpy.zeros(10)})
+
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('b'))
@@ -5,7 +5,14 @@ Unit tests for nonlinear functions
 
 import unittest
 
-from datools.gradients.nonlinearity import Sigmoid
+import numpy
+
+from datools.gradients.nonlinearity import (
+    Hard_Sigmoid,
+    Lorentzian,
+    Sigmoid,
+    Softsign,
+)
 
 
 class Test_Sigmoid(unittest.TestCase):
@@ -30,3 +37,57 @@ class Test_Sigmoid(unittest.TestCase):
 
         for test_key, test_output in zip(test_keys, test_outputs):
             self.assertAlmostEqual(test_key, test_output)
+
+    def test_dtype(self):
+        test_inputs = numpy.asarray([-1000, -1, 0, 1, 1000])
+
+        with numpy.errstate(over='raise'):
+            float32 = Sigmoid(numpy.float32).primitive(test_inputs)
+        float64 = Sigmoid().primitive(test_inputs)
+
+        self.assertEqual(float32.dtype, numpy.float32)
+        self.assertEqual(float64.dtype, numpy.float64)
+        numpy.testing.assert_allclose(float32, float64, atol=1e-7)
+        self.assertEqual(
+            Sigmoid().primitive(test_inputs.astype(numpy.float32)).dtype,
+            numpy.float32)
+
+
+class Test_Activations(unittest.TestCase):
+    def setUp(self):
+        # away from the kinks of the hard sigmoid
+        self.inputs = numpy.linspace(-5.01, 5.01, 101)
+
+    def test_derivatives(self):
+        step = 1e-6
+        for activation in (Sigmoid(), Softsign(), Hard_Sigmoid(),
+                           Lorentzian()):
+            numerical = (
+                activation.primitive(self.inputs + step) -
+                activation.primitive(self.inputs - step)
+            ) / (2 * step)
+            numpy.testing.assert_allclose(
+                activation.derivative(self.inputs), numerical, atol=1e-6)
+
+    def test_memberships(self):
+        for activation in (Sigmoid(), Softsign(), Hard_Sigmoid()):
+            self.assertAlmostEqual(activation.primitive(0.0), 0.5)
+            self.assertAlmostEqual(activation.derivative(0.0), 0.25)
+            self.assertTrue(
+                numpy.all(numpy.diff(activation.primitive(self.inputs)) >= 0))
+
+    def test_out(self):
+        for activation in (Sigmoid(), Softsign(), Hard_Sigmoid(),
+                           Lorentzian()):
+            (primitive, derivative) = activation.primitive_and_derivative(
+                self.inputs)
+
+            buffer = self.inputs.copy()
+            derivative_out = numpy.empty_like(self.inputs)
+            result = activation.primitive_and_derivative(
+                buffer, out=(buffer, derivative_out))
+
+            self.assertIs(result[0], buffer)
+            self.assertIs(result[1], derivative_out)
+            numpy.testing.assert_allclose(buffer, primitive)
+            numpy.testing.assert_allclose(derivative_out, derivative)
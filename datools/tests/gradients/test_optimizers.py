@@ -0,0 +1,93 @@
+'''
+Unit tests for optimizers
+'''
+
+
+import unittest
+
+import numpy
+
+from datools.gradients.optimizers import (
+    Adam,
+    Constant_Learning_Rate,
+    LBFGS,
+    RMSProp,
+)
+
+
+class Test_Optimizers(unittest.TestCase):
+
+    def test_per_element_state(self):
+        gradients = numpy.asarray([
+            [1.0, -2.0, 0.5],
+            [0.5, -1.0, 4.0],
+            [-3.0, 0.0, 1.0],
+        ])
+
+        for optimizer_class in (Adam, RMSProp, Constant_Learning_Rate):
+            vector_optimizer = optimizer_class()
+            element_optimizers = [optimizer_class() for _ in range(3)]
+
+            for gradient in gradients:
+                vector_step = vector_optimizer(gradient)
+                element_steps = [
+                    optimizer(g).item()
+                    for optimizer, g in zip(element_optimizers, gradient)
+                ]
+
+                self.assertEqual(vector_step.shape, gradient.shape)
+                numpy.testing.assert_allclose(vector_step, element_steps)
+
+    def test_adam_bias_correction(self):
+        # the first steps of Adam are step_size in magnitude, whatever the
+        # scale of the gradient, when the gradient is constant
+        optimizer = Adam(step_size=1e-2)
+
+        for _ in range(5):
+            step = optimizer([100.0, -1e-3])
+            numpy.testing.assert_allclose(step, [-1e-2, 1e-2], rtol=1e-4)
+
+        self.assertEqual(optimizer.t, 5)
+
+    def test_reindex(self):
+        optimizer = Adam()
+        optimizer([1.0, 2.0, 3.0])
+        (s, r) = (optimizer.s.copy(), optimizer.r.copy())
+
+        optimizer.reindex(numpy.asarray([2, -1, 0]))
+
+        numpy.testing.assert_allclose(optimizer.s, [s[2], 0, s[0]])
+        numpy.testing.assert_allclose(optimizer.r, [r[2], 0, r[0]])
+        self.assertEqual(optimizer([1.0, 1.0, 1.0]).shape, (3,))
+
+    def test_reindex_bias_correction(self):
+        # the first step of a new parameter is step_size, as for a fresh
+        # optimizer, however many steps the others took
+        optimizer = Adam(step_size=0.1)
+        for _ in range(10):
+            optimizer([1.0, 1.0])
+
+        optimizer.reindex(numpy.asarray([0, -1, 1]))
+        step = optimizer([1.0, 1.0, 1.0])
+        self.assertAlmostEqual(step[1], -0.1)
+        self.assertAlmostEqual(step[0], step[2])
+
+        optimizer.reindex(numpy.asarray([1, -1]))
+        self.assertEqual(optimizer.t.tolist(), [1, 0])
+
+    def test_lbfgs_rosenbrock(self):
+        def rosenbrock(x):
+            loss = 100 * (x[1] - x[0] ** 2) ** 2 + (1 - x[0]) ** 2
+            gradient = numpy.asarray([
+                -400 * x[0] * (x[1] - x[0] ** 2) - 2 * (1 - x[0]),
+                200 * (x[1] - x[0] ** 2),
+            ])
+            return loss, gradient
+
+        result = LBFGS(max_iterations=200, tolerance=1e-14).minimize(
+            rosenbrock, [-1.2, 1.0])
+
+        numpy.testing.assert_allclose(result.x, [1, 1], atol=1e-4)
+        self.assertEqual(len(result.losses), result.iterations + 1)
+        self.assertGreaterEqual(
+            result.function_evaluations, result.iterations + 1)
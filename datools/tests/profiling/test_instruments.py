@@ -0,0 +1,103 @@
+'''
+Unit tests for instrumentation
+'''
+
+
+import json
+import os
+import tempfile
+import unittest
+
+import numpy
+
+from datools.gradients.optimizers import Adam
+from datools.profiling.instruments import Instruments, null_instruments
+from datools.regression.fuzzy_decision_trees import (
+    Fuzzy_Decision_Tree_Regressor,
+)
+
+
+class Test_Instruments(unittest.TestCase):
+
+    def test_timers_and_counters(self):
+        instruments = Instruments()
+
+        for _ in range(3):
+            with instruments.timer('outer'):
+                with instruments.timer('inner'):
+                    pass
+        instruments.count('calls')
+        instruments.count('calls', 4)
+        instruments.count('per_key', 2, key='a')
+        instruments.count('per_key', 3, key='a')
+        instruments.count('per_key', 1, key='b')
+
+        summary = instruments.summary()
+        self.assertEqual(summary['timers']['outer']['calls'], 3)
+        self.assertGreaterEqual(
+            summary['timers']['outer']['total'],
+            summary['timers']['inner']['total'])
+        self.assertEqual(summary['counters']['calls'], 5)
+        self.assertEqual(summary['counters']['per_key'], {'a': 5, 'b': 1})
+
+        instruments.reset()
+        self.assertEqual(
+            instruments.summary(), {'timers': {}, 'counters': {}})
+
+    def test_callback(self):
+        events = list()
+        instruments = Instruments(
+            callback=lambda event, values: events.append((event, values)))
+        instruments.emit('batch', loss=1.5)
+
+        self.assertEqual(events, [('batch', {'loss': 1.5})])
+
+    def test_null_instruments(self):
+        with null_instruments.timer('name'):
+            null_instruments.count('name', 3, key=1)
+            null_instruments.emit('event', value=1)
+
+        self.assertFalse(null_instruments.enabled)
+        self.assertEqual(
+            null_instruments.summary(), {'timers': {}, 'counters': {}})
+
+    def test_regressor(self):
+        random = numpy.random.default_rng(0)
+        features = random.normal(size=(300, 3))
+        target = numpy.sign(features[:, 0]) + features[:, 1]
+
+        losses = list()
+        instruments = Instruments(
+            callback=lambda event, values:
+                event == 'batch' and losses.append(values['loss']))
+        model = Fuzzy_Decision_Tree_Regressor(
+            min_count=20, min_impurity_drop=0)
+        model.instruments = instruments
+
+        model.fit(features, target)
+        model.tune(
+            features, target, ybar_optimizer=Adam(), gain_optimizer=Adam(),
+            threshold_optimizer=Adam(), batch_size=50, epochs=2)
+        model.predict(features)
+
+        summary = instruments.summary()
+        counters = summary['counters']
+        self.assertEqual(
+            sum(counters['nodes_per_level'].values()),
+            model._compiled.n_nodes)
+        self.assertEqual(
+            counters['splits_evaluated'], model._compiled.n_nodes)
+        self.assertEqual(sorted(counters['thresholds_scored']), [0, 1, 2])
+        self.assertEqual(counters['epochs'], 2)
+        self.assertEqual(counters['batches'], len(losses))
+        for name in ('fit', 'fit.split_search', 'tune', 'tune.shuffle',
+                     'tune.forward', 'tune.backward', 'tune.optimizer',
+                     'tune.progress', 'predict'):
+            self.assertIn(name, summary['timers'])
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'profile.json')
+            instruments.write(path)
+            with open(path) as summary_file:
+                written = json.load(summary_file)
+        self.assertEqual(written['counters']['epochs'], 2)
@@ -0,0 +1,209 @@
+'''
+Unit tests for compiled trees
+'''
+
+
+import os
+import tempfile
+import unittest
+
+import numpy
+
+from datools.gradients.nonlinearity import Sigmoid
+from datools.regression.compiled_trees import Compiled_Tree
+from datools.regression.decision_trees import Decision_Tree_Regressor
+from datools.regression.fuzzy_decision_trees import (
+    Fuzzy_Decision_Tree_Regressor,
+)
+
+
+def walk_crisp(tree, features):
+    predictions = list()
+    for x in features:
+        node = tree.root
+        while not node.is_leaf:
+            if x[node.feature_col] <= node.threshold:
+                node = node.left_child
+            else:
+                node = node.right_child
+        predictions.append(node.ybar)
+    return numpy.asarray(predictions)
+
+
+def walk_fuzzy(tree, gains, features):
+    sigmoid = Sigmoid()
+    predictions = numpy.zeros(features.shape[0])
+    memberships = {id(tree.root): numpy.ones(features.shape[0])}
+
+    for node, gain in zip(tree.topological_ordering(), gains):
+        r = memberships[id(node)]
+        if node.is_leaf:
+            predictions += r * node.ybar
+        else:
+            mu = sigmoid.primitive(
+                -gain * (features[:, node.feature_col] - node.threshold))
+            memberships[id(node.left_child)] = mu * r
+            memberships[id(node.right_child)] = (1 - mu) * r
+
+    return predictions
+
+
+class Test_Compiled_Tree(unittest.TestCase):
+
+    def setUp(self):
+        random = numpy.random.default_rng(0)
+        self.features = random.normal(size=(400, 3))
+        self.target = (
+            numpy.sign(self.features[:, 0]) +
+            self.features[:, 1] +
+            random.normal(scale=0.1, size=400)
+        )
+        self.model = Fuzzy_Decision_Tree_Regressor(
+            min_count=10, min_impurity_drop=0)
+        self.model.fit(self.features, self.target)
+
+    def test_level_order(self):
+        compiled = self.model._compiled
+        internal = ~compiled.is_leaf
+
+        self.assertEqual(compiled.n_nodes, len(self.model._tree.nodes))
+        self.assertTrue((compiled.left[internal] > numpy.flatnonzero(
+            internal)).all())
+        self.assertTrue(
+            (compiled.right[internal] == compiled.left[internal] + 1).all())
+        self.assertEqual(compiled.level_offsets[0], 0)
+        self.assertEqual(compiled.level_offsets[-1], compiled.n_nodes)
+
+    def test_split_leaf(self):
+        compiled = self.model._compiled
+        leaf = numpy.flatnonzero(compiled.is_leaf)[0]
+
+        (tree, old_index) = compiled.split_leaf(
+            leaf, 2, 0.0, 1.0, (-5.0, 0.0, 1), (5.0, 0.0, 1))
+
+        self.assertEqual(tree.n_nodes, compiled.n_nodes + 2)
+        self.assertEqual(numpy.count_nonzero(old_index < 0), 2)
+        numpy.testing.assert_array_equal(
+            numpy.sort(old_index[old_index >= 0]),
+            numpy.arange(compiled.n_nodes))
+        self.assertEqual(tree.level_offsets[-1], tree.n_nodes)
+
+        routed = compiled.route(self.features) == leaf
+        expected = compiled.predict_crisp(self.features)
+        expected[routed] = numpy.where(
+            self.features[routed, 2] <= 0, -5.0, 5.0)
+        numpy.testing.assert_allclose(tree.predict_crisp(self.features),
+                                      expected)
+
+    def test_predict_crisp(self):
+        numpy.testing.assert_allclose(
+            self.model.predict(self.features),
+            walk_crisp(self.model._tree, self.features))
+
+    def test_route(self):
+        leaves = self.model._compiled.route(self.features)
+        self.assertTrue(self.model._compiled.is_leaf[leaves].all())
+
+    def test_predict_fuzzy(self):
+        compiled = self.model._compiled
+        compiled.gain[:] = 0.5 + numpy.arange(compiled.n_nodes) % 3
+
+        numpy.testing.assert_allclose(
+            compiled.predict_fuzzy(self.features),
+            walk_fuzzy(self.model._tree, compiled.gain, self.features))
+
+    def test_predict_chunks(self):
+        compiled = self.model._compiled
+        compiled.gain[:] = 2
+        self.model._tuned = True
+        expected = self.model.predict(self.features, chunk_size=None)
+
+        out = numpy.empty(400)
+        result = self.model.predict(self.features, chunk_size=64, out=out)
+        self.assertIs(result, out)
+        numpy.testing.assert_allclose(out, expected)
+
+        chunks = (self.features[i:i + 150] for i in range(0, 400, 150))
+        streamed = list(self.model.predict_iter(chunks))
+        self.assertEqual([len(chunk) for chunk in streamed], [150, 150, 100])
+        numpy.testing.assert_allclose(numpy.concatenate(streamed), expected)
+
+    def test_predict_sparse(self):
+        compiled = self.model._compiled
+        compiled.gain[:] = 2
+        dense = compiled.predict_fuzzy(self.features)
+
+        (sparse, n_leaves) = compiled.predict_sparse(
+            self.features, min_membership=0)
+        numpy.testing.assert_allclose(sparse, dense)
+        self.assertTrue(
+            (n_leaves == numpy.count_nonzero(compiled.is_leaf)).all())
+
+        (sparse, n_leaves) = compiled.predict_sparse(
+            self.features, min_membership=1e-3)
+        numpy.testing.assert_allclose(sparse, dense, atol=1e-2)
+
+        (_, n_leaves) = compiled.predict_sparse(
+            self.features, min_membership=0, max_active_leaves=3)
+        self.assertTrue((n_leaves <= 3).all())
+
+        # the strongest pairs are kept, which includes the crisp path
+        (sparse, n_leaves) = compiled.predict_sparse(
+            self.features, min_membership=0, max_active_leaves=1)
+        self.assertTrue((n_leaves == 1).all())
+        numpy.testing.assert_allclose(
+            sparse, compiled.predict_crisp(self.features))
+
+    def test_predict_sparse_crisp_path(self):
+        # with a cutoff above any branch membership only the dominant
+        # child is followed, which is the crisp path
+        compiled = self.model._compiled
+        compiled.gain[:] = 1e3
+
+        (sparse, n_leaves) = compiled.predict_sparse(
+            self.features, min_membership=1)
+        self.assertTrue((n_leaves == 1).all())
+        numpy.testing.assert_allclose(
+            sparse, compiled.predict_crisp(self.features))
+
+    def test_save_load(self):
+        self.model._compiled.gain[:] = 2
+        self.model._tuned = True
+        expected = self.model.predict(self.features)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'model.bin')
+            self.model.save(path)
+
+            for mmap in (True, False):
+                model = Fuzzy_Decision_Tree_Regressor.load(path, mmap=mmap)
+                numpy.testing.assert_allclose(
+                    model.predict(self.features), expected)
+                self.assertEqual(
+                    isinstance(model._compiled.value, numpy.memmap), mmap)
+                self.assertEqual(
+                    model._compiled.value.flags.writeable, not mmap)
+
+                for name in Compiled_Tree._array_names:
+                    numpy.testing.assert_array_equal(
+                        getattr(model._compiled, name),
+                        getattr(self.model._compiled, name))
+                del model
+
+    def test_load_wrong_class(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'model.bin')
+            self.model.save(path)
+
+            with self.assertRaises(AssertionError):
+                Decision_Tree_Regressor.load(path)
+
+    def test_single_leaf(self):
+        model = Fuzzy_Decision_Tree_Regressor(
+            min_count=1000, min_impurity_drop=0)
+        model.fit(self.features, self.target)
+
+        numpy.testing.assert_allclose(
+            model.predict(self.features), self.target.mean())
+        numpy.testing.assert_allclose(
+            model._compiled.predict_fuzzy(self.features), self.target.mean())
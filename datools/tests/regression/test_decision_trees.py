@@ -0,0 +1,236 @@
+'''
+Unit tests for decision trees
+'''
+
+
+import unittest
+
+import numpy
+
+from datools.regression.decision_trees import Decision_Tree_Regressor
+from datools.metrics.regression import sum_of_squared_error
+
+
+def brute_force_split(features, target, min_count):
+    best = (numpy.inf, None, None)
+
+    for feature_col in range(features.shape[1]):
+        feature_vals = features[:, feature_col]
+        (sorted_vals, counts) = numpy.unique(feature_vals, return_counts=True)
+        thresholds = (sorted_vals[1:] + sorted_vals[:-1]) / 2
+        counts_left = numpy.cumsum(counts[:-1])
+        counts_right = counts.sum() - counts_left
+        mask = (counts_left >= min_count) & (counts_right >= min_count)
+
+        for threshold in thresholds[mask]:
+            left = target[feature_vals <= threshold]
+            right = target[feature_vals > threshold]
+            impurity = (
+                sum_of_squared_error(left.mean(), left) +
+                sum_of_squared_error(right.mean(), right)
+            )
+            if impurity < best[0]:
+                best = (impurity, feature_col, threshold)
+
+    return best
+
+
+class Test_Decision_Tree_Regressor(unittest.TestCase):
+
+    def setUp(self):
+        random = numpy.random.default_rng(0)
+        self.features = numpy.column_stack([
+            random.integers(1, 13, size=500),
+            random.integers(0, 24, size=500),
+            random.normal(size=500),
+        ]).astype(float)
+        self.target = (
+            10 * (self.features[:, 0] > 6) +
+            numpy.sin(self.features[:, 1]) +
+            random.normal(scale=0.1, size=500)
+        )
+
+    def test_find_best_split(self):
+        model = Decision_Tree_Regressor(min_count=20, min_impurity_drop=0)
+        best_split = model._find_best_split(
+            self.features, self.target, numpy.arange(500))
+        impurity, feature_col, threshold = brute_force_split(
+            self.features, self.target, min_count=20)
+
+        self.assertEqual(best_split.feature_col, feature_col)
+        self.assertEqual(best_split.threshold, threshold)
+        self.assertAlmostEqual(best_split.impurity, impurity)
+
+    def test_min_count(self):
+        model = Decision_Tree_Regressor(min_count=20, min_impurity_drop=0)
+        model.fit(self.features, self.target)
+
+        for leaf in model._tree.leaves:
+            self.assertGreaterEqual(leaf.count, 20)
+
+    def test_partition(self):
+        model = Decision_Tree_Regressor(min_count=20, min_impurity_drop=0)
+        model.fit(self.features, self.target)
+        leaves = model._compiled.route(self.features)
+
+        for node in model._tree.topological_ordering():
+            self.assertFalse(hasattr(node, 'features'))
+            self.assertFalse(hasattr(node, 'target'))
+
+        for leaf in numpy.unique(leaves):
+            leaf_target = self.target[leaves == leaf]
+            self.assertEqual(
+                model._compiled.count[leaf], leaf_target.shape[0])
+            self.assertAlmostEqual(
+                model._compiled.value[leaf], leaf_target.mean())
+
+    def test_n_jobs(self):
+        serial = Decision_Tree_Regressor(min_count=5, min_impurity_drop=0)
+        parallel = Decision_Tree_Regressor(
+            min_count=5, min_impurity_drop=0, n_jobs=4)
+        serial.fit(self.features, self.target)
+        parallel.fit(self.features, self.target)
+
+        for name in ('feature_col', 'threshold', 'left', 'right', 'value'):
+            numpy.testing.assert_array_equal(
+                getattr(parallel._compiled, name),
+                getattr(serial._compiled, name))
+
+    def test_no_candidate_split(self):
+        model = Decision_Tree_Regressor(min_count=1, min_impurity_drop=0)
+        features = numpy.ones((10, 2))
+        model.fit(features, numpy.arange(10))
+
+        self.assertEqual(len(model._tree.nodes), 1)
+        numpy.testing.assert_allclose(model.predict(features), 4.5)
+
+    def test_max_depth(self):
+        model = Decision_Tree_Regressor(
+            min_count=1, min_impurity_drop=0, max_depth=2)
+        model.fit(self.features, self.target)
+
+        self.assertEqual(model._compiled.depth, 2)
+        self.assertEqual(model._compiled.n_nodes, 7)
+
+    def test_prune(self):
+        model = Decision_Tree_Regressor(min_count=5, min_impurity_drop=0)
+        model.fit(self.features, self.target)
+
+        for settings in (dict(min_impurity_drop=0.5),
+                         dict(min_impurity_drop=5),
+                         dict(max_depth=3),
+                         dict(min_impurity_drop=0.5, max_depth=4)):
+            reference = Decision_Tree_Regressor(
+                min_count=5, **dict(dict(min_impurity_drop=0), **settings))
+            reference.fit(self.features, self.target)
+            pruned = model.prune(**settings)
+
+            for name in ('feature_col', 'threshold', 'left', 'right', 'value',
+                         'count', 'level_offsets'):
+                numpy.testing.assert_array_equal(
+                    getattr(pruned._compiled, name),
+                    getattr(reference._compiled, name))
+            numpy.testing.assert_array_equal(
+                pruned.predict(self.features),
+                reference.predict(self.features))
+
+    def test_cost_complexity_pruning_path(self):
+        model = Decision_Tree_Regressor(min_count=5, min_impurity_drop=0)
+        model.fit(self.features, self.target)
+        path = model.cost_complexity_pruning_path()
+
+        self.assertEqual(path.ccp_alphas[0], 0)
+        self.assertTrue(numpy.all(numpy.diff(path.ccp_alphas) >= 0))
+        self.assertTrue(numpy.all(numpy.diff(path.impurities) >= -1e-9))
+
+        for alpha, impurity in zip(path.ccp_alphas, path.impurities):
+            tree = model.prune(ccp_alpha=alpha)._compiled
+            self.assertAlmostEqual(
+                tree.impurity[tree.is_leaf].sum(), impurity)
+
+        # the last alpha leaves the root alone
+        self.assertEqual(
+            model.prune(ccp_alpha=path.ccp_alphas[-1])._compiled.n_nodes, 1)
+
+    def test_several_outputs(self):
+        # the impurity of two proportional outputs is a multiple of the
+        # impurity of one, so the splits are the same
+        target = numpy.column_stack((self.target, 2 * self.target))
+
+        for max_bins in (None, 16):
+            single = Decision_Tree_Regressor(
+                min_count=20, min_impurity_drop=0, max_bins=max_bins)
+            single.fit(self.features, self.target)
+            several = Decision_Tree_Regressor(
+                min_count=20, min_impurity_drop=0, max_bins=max_bins)
+            several.fit(self.features, target)
+
+            for name in ('feature_col', 'threshold', 'left', 'right'):
+                numpy.testing.assert_array_equal(
+                    getattr(several._compiled, name),
+                    getattr(single._compiled, name))
+            numpy.testing.assert_allclose(
+                several._compiled.impurity, 5 * single._compiled.impurity)
+
+            prediction = several.predict(self.features, chunk_size=70)
+            self.assertEqual(prediction.shape, (500, 2))
+            numpy.testing.assert_allclose(
+                prediction[:, 0], single.predict(self.features))
+            numpy.testing.assert_allclose(
+                prediction[:, 1], 2 * single.predict(self.features))
+
+    def test_float32(self):
+        # the float32 tree matches the float64 tree on the same values
+        features = self.features.astype(numpy.float32)
+        for max_bins in (None, 16):
+            float64 = Decision_Tree_Regressor(
+                min_count=5, min_impurity_drop=0, max_bins=max_bins)
+            float64.fit(features.astype(numpy.float64), self.target)
+            float32 = Decision_Tree_Regressor(
+                min_count=5, min_impurity_drop=0, max_bins=max_bins,
+                dtype=numpy.float32)
+            float32.fit(features, self.target)
+
+            for name in ('feature_col', 'threshold', 'value'):
+                numpy.testing.assert_array_equal(
+                    getattr(float32._compiled, name),
+                    getattr(float64._compiled, name))
+
+            prediction = float32.predict(features)
+            self.assertEqual(prediction.dtype, numpy.float32)
+            numpy.testing.assert_allclose(
+                prediction, float64.predict(features), rtol=1e-6)
+
+    def test_predict(self):
+        model = Decision_Tree_Regressor(min_count=1, min_impurity_drop=0)
+        features = numpy.asarray([[1], [2], [3], [4]], dtype=float)
+        target = numpy.asarray([1, 1, 5, 5], dtype=float)
+        model.fit(features, target)
+
+        numpy.testing.assert_allclose(model.predict(features), target)
+        numpy.testing.assert_allclose(model.predict([[0], [10]]), [1, 5])
+
+    def test_max_bins_low_cardinality(self):
+        # every unique value gets its own bin, so the binned tree makes the
+        # same splits as the exact one
+        features = self.features[:, :2]
+        exact = Decision_Tree_Regressor(min_count=20, min_impurity_drop=0)
+        binned = Decision_Tree_Regressor(
+            min_count=20, min_impurity_drop=0, max_bins=32)
+        exact.fit(features, self.target)
+        binned.fit(features, self.target)
+
+        numpy.testing.assert_allclose(
+            binned.predict(features), exact.predict(features))
+
+    def test_max_bins_thresholds(self):
+        model = Decision_Tree_Regressor(
+            min_count=20, min_impurity_drop=0, max_bins=8)
+        model.fit(self.features, self.target)
+
+        self.assertLessEqual(len(model._bin_edges[2]), 7)
+
+        for node in model._tree.topological_ordering():
+            if not node.is_leaf:
+                edges = model._bin_edges[node.feature_col]
+                self.assertIn(node.threshold, edges)
@@ -0,0 +1,117 @@
+'''
+Unit tests for ensembles of fuzzy decision trees
+'''
+
+
+import os
+import tempfile
+import unittest
+
+import numpy
+
+from datools.regression.compiled_trees import Compiled_Tree
+from datools.regression.ensembles import (
+    Fuzzy_Boosting_Regressor,
+    Fuzzy_Forest_Regressor,
+)
+
+
+class Test_Ensembles(unittest.TestCase):
+
+    def setUp(self):
+        random = numpy.random.default_rng(0)
+        self.features = random.normal(size=(300, 3))
+        self.target = (
+            numpy.sign(self.features[:, 0]) +
+            self.features[:, 1] +
+            random.normal(scale=0.1, size=300)
+        )
+
+    def test_concatenate(self):
+        forest = Fuzzy_Forest_Regressor(
+            3, min_count=10, min_impurity_drop=0, epochs=0, seed=0)
+        forest.fit(self.features, self.target)
+        members = forest.members
+        for member in members:
+            member.gain[:] = 1 + numpy.arange(member.n_nodes) % 2
+
+        weights = numpy.asarray([0.5, 1.0, 2.0])
+        compiled = Compiled_Tree.concatenate(members, weights)
+
+        self.assertEqual(compiled.n_trees, 3)
+        self.assertEqual(
+            compiled.n_nodes, sum(member.n_nodes for member in members))
+        for predict in ('predict_crisp', 'predict_fuzzy'):
+            numpy.testing.assert_allclose(
+                getattr(compiled, predict)(self.features),
+                sum(
+                    weight * getattr(member, predict)(self.features)
+                    for weight, member in zip(weights, members)
+                ))
+
+    def test_forest(self):
+        forest = Fuzzy_Forest_Regressor(
+            4, min_count=20, min_impurity_drop=0, epochs=2, seed=0)
+        forest.fit(self.features, self.target)
+
+        numpy.testing.assert_allclose(
+            forest.predict(self.features, chunk_size=70),
+            numpy.mean([
+                member.predict_fuzzy(self.features)
+                for member in forest.members
+            ], axis=0))
+        self.assertGreater(forest.fit_report.cpu_time, 0)
+
+    def test_forest_processes(self):
+        kwargs = dict(min_count=20, min_impurity_drop=0, epochs=0, seed=0)
+        serial = Fuzzy_Forest_Regressor(3, n_jobs=1, **kwargs)
+        serial.fit(self.features, self.target)
+        parallel = Fuzzy_Forest_Regressor(3, n_jobs=2, **kwargs)
+        parallel.fit(self.features, self.target)
+
+        numpy.testing.assert_allclose(
+            serial.predict(self.features), parallel.predict(self.features))
+
+    def test_boosting(self):
+        losses = list()
+        for n_estimators in (1, 5):
+            model = Fuzzy_Boosting_Regressor(
+                n_estimators, min_count=10, min_impurity_drop=0,
+                max_depth=2, learning_rate=0.5, epochs=0)
+            model.fit(self.features, self.target)
+            losses.append(numpy.mean(numpy.square(
+                model.predict(self.features) - self.target)))
+
+            self.assertEqual(len(model.members), n_estimators + 1)
+            self.assertTrue(all(
+                member.depth <= 2 for member in model.members))
+
+        self.assertLess(losses[1], losses[0])
+
+    def test_several_outputs(self):
+        target = numpy.column_stack((self.target, -self.features[:, 2]))
+        for model in (
+                Fuzzy_Forest_Regressor(
+                    2, min_count=20, min_impurity_drop=0, epochs=1, seed=0),
+                Fuzzy_Boosting_Regressor(
+                    3, min_count=10, min_impurity_drop=0, epochs=0)):
+            model.fit(self.features, target)
+            prediction = model.predict(self.features)
+
+            self.assertEqual(prediction.shape, (300, 2))
+            self.assertLess(
+                numpy.mean(numpy.square(prediction - target)),
+                numpy.mean(numpy.square(target - target.mean(axis=0))))
+
+    def test_save_load(self):
+        model = Fuzzy_Boosting_Regressor(
+            3, min_count=10, min_impurity_drop=0, epochs=1)
+        model.fit(self.features, self.target)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'model.bin')
+            model.save(path)
+            loaded = Fuzzy_Boosting_Regressor.load(path, mmap=False)
+
+        numpy.testing.assert_allclose(
+            loaded.predict(self.features), model.predict(self.features))
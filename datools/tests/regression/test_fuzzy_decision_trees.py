@@ -0,0 +1,461 @@
+'''
+Unit tests for fuzzy decision trees
+'''
+
+
+import os
+import pickle
+import tempfile
+import unittest
+from contextlib import contextmanager
+from multiprocessing.shared_memory import SharedMemory
+from unittest import mock
+
+import numpy
+
+from datools.containers.shared_arrays import shared_arrays
+from datools.gradients.optimizers import Adam
+from datools.metrics.regression import mean_squared_error
+from datools.regression import fuzzy_decision_trees
+from datools.regression.fuzzy_decision_trees import (
+    Fuzzy_Decision_Tree_Regressor,
+    _Gradient_Pool,
+)
+
+
+class Test_Fuzzy_Decision_Tree_Regressor(unittest.TestCase):
+
+    def setUp(self):
+        random = numpy.random.default_rng(0)
+        self.features = random.normal(size=(300, 3))
+        self.target = (
+            numpy.sign(self.features[:, 0]) +
+            self.features[:, 1] +
+            random.normal(scale=0.1, size=300)
+        )
+        self.model = Fuzzy_Decision_Tree_Regressor(
+            min_count=20, min_impurity_drop=0)
+        self.model.fit(self.features, self.target)
+        self.model._init_gain(self.features)
+
+    def loss(self):
+        levels = self.model._compiled.internal_nodes_by_level()
+        state = self.model._forward_prop_fuzzy(self.features, levels)
+        return mean_squared_error(state.prediction, self.target)
+
+    def test_gradients(self):
+        self.check_gradients()
+
+    def check_gradients(self):
+        tree = self.model._compiled
+        levels = tree.internal_nodes_by_level()
+        (_, gradients) = self.model._loss_and_gradients(
+            self.features, self.target, levels)
+
+        step = 1e-6
+        checks = (
+            (tree.gain, gradients.dl_dg, ~tree.is_leaf),
+            (tree.threshold, gradients.dl_dt, ~tree.is_leaf),
+            (tree.value, gradients.dl_dybar, tree.is_leaf),
+        )
+        for params, analytic, mask in checks:
+            # leaf values of several outputs are checked one by one
+            for node in numpy.flatnonzero(mask):
+                for output in numpy.ndindex(params.shape[1:]):
+                    index = (node,) + output
+                    params[index] += step
+                    loss_up = self.loss()
+                    params[index] -= 2 * step
+                    loss_down = self.loss()
+                    params[index] += step
+
+                    numerical = (loss_up - loss_down) / (2 * step)
+                    self.assertAlmostEqual(
+                        analytic[index], numerical,
+                        delta=1e-4 * max(1, abs(numerical)))
+
+    def test_membership(self):
+        self.model._set_membership('softsign')
+        self.check_gradients()
+
+        self.model.tune(self.features, self.target, method='lbfgs', epochs=5)
+        levels = self.model._compiled.internal_nodes_by_level()
+        state = self.model._forward_prop_fuzzy(self.features, levels)
+        numpy.testing.assert_allclose(
+            self.model.predict(self.features), state.prediction)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'model.bin')
+            self.model.save(path)
+            loaded = Fuzzy_Decision_Tree_Regressor.load(path, mmap=False)
+
+        numpy.testing.assert_allclose(
+            loaded.predict(self.features), state.prediction)
+
+    def test_several_outputs(self):
+        self.target = numpy.column_stack((self.target, -self.features[:, 2]))
+        self.model = Fuzzy_Decision_Tree_Regressor(
+            min_count=20, min_impurity_drop=0)
+        self.model.fit(self.features, self.target)
+        self.model._init_gain(self.features)
+        self.check_gradients()
+
+        crisp_loss = self.loss()
+        losses = self.model.tune(
+            self.features, self.target, method='lbfgs', epochs=10)
+        prediction = self.model.predict(self.features)
+        self.assertEqual(prediction.shape, (300, 2))
+        self.assertLess(losses[-1, 0], crisp_loss)
+        self.assertAlmostEqual(
+            mean_squared_error(prediction, self.target), losses[-1, 0])
+
+        numpy.testing.assert_allclose(
+            self.model.predict_sparse(self.features, min_membership=0),
+            prediction)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'model.bin')
+            self.model.save(path)
+            loaded = Fuzzy_Decision_Tree_Regressor.load(path, mmap=False)
+        numpy.testing.assert_allclose(loaded.predict(self.features), prediction)
+
+        losses = self.model.tune(
+            self.features, self.target, ybar_optimizer=Adam(1e-2),
+            gain_optimizer=Adam(1e-2), threshold_optimizer=Adam(1e-2),
+            batch_size=32, epochs=2)
+        self.assertEqual(losses.shape, (2, 9))
+
+    def test_several_outputs_partial_fit(self):
+        target = numpy.column_stack((self.target, -self.features[:, 2]))
+        model = Fuzzy_Decision_Tree_Regressor(
+            min_count=20, min_impurity_drop=0, max_bins=16)
+        model.fit(self.features[:100], target[:100])
+        n_nodes = model._compiled.n_nodes
+
+        for _ in range(3):
+            model.partial_fit(self.features, target, grow=True)
+
+        self.assertGreater(model._compiled.n_nodes, n_nodes)
+        self.assertEqual(model.predict(self.features).shape, (300, 2))
+
+    def test_split_columns(self):
+        levels = self.model._compiled.internal_nodes_by_level()
+        features = numpy.column_stack((self.features, self.features[:, :2]))
+        (columns, feature_row) = self.model._split_columns(features)
+
+        self.assertLessEqual(columns.shape[0], 3)
+        self.assertEqual(columns.shape[1], 300)
+
+        state = self.model._forward_prop_columns(columns, feature_row, levels)
+        reference = self.model._forward_prop_fuzzy(self.features, levels)
+        numpy.testing.assert_array_equal(state.x, reference.x)
+        numpy.testing.assert_array_equal(state.prediction, reference.prediction)
+
+    def test_float32(self):
+        model = Fuzzy_Decision_Tree_Regressor(
+            min_count=20, min_impurity_drop=0, dtype=numpy.float32)
+        model.fit(self.features, self.target)
+        model._init_gain(self.features)
+        model._compiled = self.model._compiled
+
+        levels = model._compiled.internal_nodes_by_level()
+        state = model._forward_prop_fuzzy(self.features, levels)
+        reference = self.model._forward_prop_fuzzy(self.features, levels)
+        self.assertEqual(state.r.dtype, numpy.float32)
+        self.assertEqual(state.prediction.dtype, numpy.float32)
+        numpy.testing.assert_allclose(
+            state.prediction, reference.prediction, rtol=1e-4, atol=1e-5)
+
+        (loss, gradients) = model._loss_and_gradients(
+            self.features, self.target.astype(numpy.float32), levels)
+        (reference_loss, reference_gradients) = (
+            self.model._loss_and_gradients(self.features, self.target, levels))
+        self.assertAlmostEqual(loss, reference_loss, places=4)
+        for name in ('dl_dg', 'dl_dt', 'dl_dybar'):
+            numpy.testing.assert_allclose(
+                getattr(gradients, name), getattr(reference_gradients, name),
+                rtol=1e-3, atol=1e-5)
+
+        model.tune(
+            self.features, self.target, ybar_optimizer=Adam(),
+            gain_optimizer=Adam(), threshold_optimizer=Adam(), epochs=1)
+        self.assertEqual(model.predict(self.features).dtype, numpy.float32)
+
+    def test_tune(self):
+        losses = self.model.tune(
+            self.features, self.target, ybar_optimizer=Adam(1e-2),
+            gain_optimizer=Adam(1e-2), threshold_optimizer=Adam(1e-2),
+            batch_size=32, epochs=10)
+
+        self.assertEqual(losses.shape, (10, 9))
+        self.assertLess(losses[-1].mean(), losses[0].mean())
+
+    def test_early_stopping(self):
+        validation_features = self.features[:100]
+        validation_target = self.target[:100]
+
+        losses = self.model.tune(
+            self.features[100:], self.target[100:],
+            ybar_optimizer=Adam(1e-1), gain_optimizer=Adam(1e-1),
+            threshold_optimizer=Adam(1e-1), batch_size=32, epochs=50,
+            validation_data=(validation_features, validation_target),
+            patience=2)
+        report = self.model.tune_report
+
+        self.assertEqual(losses.shape[0], report.epochs)
+        self.assertEqual(len(report.validation_losses), report.epochs)
+        self.assertLessEqual(report.epochs - report.best_epoch - 1, 2)
+
+        # parameters of the best epoch are restored
+        self.assertAlmostEqual(
+            mean_squared_error(
+                self.model.predict(validation_features), validation_target),
+            min(report.validation_losses))
+
+    def test_validation_fraction(self):
+        losses = self.model.tune(
+            self.features, self.target, ybar_optimizer=Adam(1e-2),
+            gain_optimizer=Adam(1e-2), threshold_optimizer=Adam(1e-2),
+            batch_size=30, epochs=3, validation_fraction=0.2)
+
+        # 240 training samples
+        self.assertEqual(losses.shape, (3, 7))
+        self.assertEqual(len(self.model.tune_report.validation_losses), 3)
+
+    def test_validation_fraction_gain(self):
+        # a trending feature whose held out tail holds a split threshold
+        features = numpy.linspace(0, 1, 300)[:, None]
+        target = (features[:, 0] > 0.9).astype(float) + features[:, 0]
+        self.model.fit(features, target)
+        tree = self.model._compiled
+        internal = ~tree.is_leaf
+        self.assertTrue((tree.threshold[internal] > 0.8).any())
+
+        self.model.tune(
+            features, target, ybar_optimizer=Adam(1e-2),
+            gain_optimizer=Adam(1e-2), threshold_optimizer=Adam(1e-2),
+            epochs=0, validation_fraction=0.2)
+        self.assertTrue((tree.gain[internal] > 0).all())
+
+    def test_lbfgs(self):
+        crisp_loss = self.loss()
+        losses = self.model.tune(
+            self.features, self.target, method='lbfgs', epochs=20)
+        report = self.model.tune_report
+
+        self.assertEqual(losses.shape, (report.iterations, 1))
+        self.assertLess(losses[-1, 0], crisp_loss)
+        self.assertAlmostEqual(
+            mean_squared_error(
+                self.model.predict(self.features), self.target),
+            losses[-1, 0])
+
+    def test_refit(self):
+        crisp = self.model.predict(self.features)
+        self.model.tune(self.features, self.target, method='lbfgs', epochs=5)
+        self.model.fit(self.features, self.target)
+
+        numpy.testing.assert_array_equal(
+            self.model.predict(self.features), crisp)
+        self.assertFalse(self.model._get_metadata()['tuned'])
+
+    def test_pickle(self):
+        crisp = self.model.predict(self.features)
+        restored = pickle.loads(pickle.dumps(self.model))
+        numpy.testing.assert_array_equal(restored.predict(self.features), crisp)
+
+        self.model.tune(self.features, self.target, method='lbfgs', epochs=5)
+        restored = pickle.loads(pickle.dumps(self.model))
+        numpy.testing.assert_array_equal(
+            restored.predict(self.features), self.model.predict(self.features))
+
+    def test_parallel_gradients(self):
+        levels = self.model._compiled.internal_nodes_by_level()
+        samples = numpy.random.default_rng(1).permutation(300)[:100]
+        (loss, gradients) = self.model._loss_and_gradients(
+            self.features[samples], self.target[samples], levels)
+
+        with _Gradient_Pool(
+                self.model, self.features, self.target, n_workers=2) as pool:
+            (pool_loss, pool_gradients) = pool.loss_and_gradients(samples)
+            (full_loss, _) = pool.loss_and_gradients(slice(0, 300))
+
+        self.assertAlmostEqual(pool_loss, loss)
+        self.assertAlmostEqual(full_loss, self.loss())
+        for name in ('dl_dg', 'dl_dt', 'dl_dybar'):
+            numpy.testing.assert_allclose(
+                getattr(pool_gradients, name), getattr(gradients, name),
+                atol=1e-12)
+
+    def test_parallel_gradients_cleanup(self):
+        # shared memory is released if the workers cannot be started, and
+        # not only once the exception and its frames are collected
+        names = list()
+
+        @contextmanager
+        def recorded_shared_arrays(*arrays):
+            with shared_arrays(*arrays) as shared:
+                names.extend(name for name, _, _ in shared)
+                yield shared
+
+        with mock.patch.object(
+                fuzzy_decision_trees, 'shared_arrays',
+                recorded_shared_arrays), \
+                mock.patch.object(
+                    fuzzy_decision_trees, 'ProcessPoolExecutor',
+                    side_effect=OSError):
+            # keeps the exception, whose traceback holds the frames of
+            # _Gradient_Pool, unlike assertRaises which clears them
+            try:
+                with _Gradient_Pool(
+                        self.model, self.features, self.target, n_workers=2):
+                    pass
+            except OSError as error:
+                failure = error
+            else:
+                self.fail('OSError not raised')
+
+        self.assertIsNotNone(failure.__traceback__)
+        self.assertEqual(len(names), 2)
+        for name in names:
+            with self.assertRaises(FileNotFoundError):
+                SharedMemory(name=name)
+
+    def test_parallel_tune(self):
+        model = Fuzzy_Decision_Tree_Regressor(
+            min_count=20, min_impurity_drop=0)
+        model.fit(self.features, self.target)
+
+        losses = self.model.tune(
+            self.features, self.target, method='lbfgs', epochs=5)
+        parallel_losses = model.tune(
+            self.features, self.target, method='lbfgs', epochs=5,
+            n_workers=2)
+        numpy.testing.assert_allclose(parallel_losses, losses, rtol=1e-9)
+
+        losses = model.tune(
+            self.features, self.target, ybar_optimizer=Adam(1e-2),
+            gain_optimizer=Adam(1e-2), threshold_optimizer=Adam(1e-2),
+            batch_size=32, epochs=2, n_workers=2)
+        self.assertEqual(losses.shape, (2, 9))
+        self.assertTrue(numpy.isfinite(losses).all())
+
+    def test_sparse_approximation_error(self):
+        self.model.tune(self.features, self.target, method='lbfgs', epochs=5)
+
+        report = self.model.sparse_approximation_error(
+            self.features, min_membership=0)
+        self.assertAlmostEqual(report.max_abs_error, 0)
+        self.assertEqual(report.mean_active_leaves, report.n_leaves)
+
+        report = self.model.sparse_approximation_error(
+            self.features, min_membership=1e-2, max_active_leaves=2)
+        self.assertLessEqual(report.mean_active_leaves, 2)
+        numpy.testing.assert_allclose(
+            self.model.predict_sparse(
+                self.features, min_membership=1e-2, max_active_leaves=2,
+                chunk_size=50),
+            self.model._compiled.predict_sparse(
+                self.features, min_membership=1e-2, max_active_leaves=2)[0])
+
+    def test_sparse_untuned(self):
+        numpy.testing.assert_array_equal(
+            self.model.predict_sparse(self.features),
+            self.model.predict(self.features))
+
+        report = self.model.sparse_approximation_error(self.features)
+        self.assertEqual(report.max_abs_error, 0)
+        self.assertEqual(report.mean_active_leaves, 1)
+
+    def test_partial_fit(self):
+        self.model.tune(
+            self.features, self.target, ybar_optimizer=Adam(),
+            gain_optimizer=Adam(), threshold_optimizer=Adam(), epochs=2)
+        ybar_optimizer = self.model._optimizers.ybar
+        t = ybar_optimizer.t
+
+        losses = [
+            self.model.partial_fit(
+                self.features[begin:begin + 50],
+                self.target[begin:begin + 50])
+            for begin in range(0, 300, 50)
+        ]
+
+        self.assertEqual(len(losses), 6)
+        self.assertTrue(numpy.isfinite(losses).all())
+        self.assertIs(self.model._optimizers.ybar, ybar_optimizer)
+        self.assertEqual(ybar_optimizer.t, t + 6)
+
+    def test_partial_fit_untuned(self):
+        model = Fuzzy_Decision_Tree_Regressor(
+            min_count=20, min_impurity_drop=0)
+        model.fit(self.features, self.target)
+
+        # a single row lies on one side of every threshold
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'model.bin')
+            model.save(path)
+            loaded = Fuzzy_Decision_Tree_Regressor.load(path, mmap=False)
+
+        for model in (model, loaded):
+            model.partial_fit(self.features[:1], self.target[:1])
+            tree = model._compiled
+            self.assertTrue((tree.gain[~tree.is_leaf] > 0).all())
+
+    def test_partial_fit_grow(self):
+        model = Fuzzy_Decision_Tree_Regressor(
+            min_count=20, min_impurity_drop=0, max_bins=16)
+        model.fit(self.features[:40], self.target[:40])
+        n_nodes = model._compiled.n_nodes
+
+        for begin in range(40, 300, 20):
+            model.partial_fit(
+                self.features[begin:begin + 20],
+                self.target[begin:begin + 20], grow=True)
+
+        tree = model._compiled
+        self.assertGreater(tree.n_nodes, n_nodes)
+        self.assertTrue(numpy.isfinite(tree.gain[~tree.is_leaf]).all())
+        self.assertEqual(
+            model._optimizers.ybar.s.shape,
+            (numpy.count_nonzero(tree.is_leaf),))
+        self.assertTrue(numpy.isfinite(model.predict(self.features)).all())
+
+        with self.assertRaises(AssertionError):
+            self.model.partial_fit(self.features, self.target, grow=True)
+
+    def test_partial_fit_refit(self):
+        # the optimizer state and leaf statistics of the old structure
+        model = Fuzzy_Decision_Tree_Regressor(
+            min_count=10, min_impurity_drop=0, max_bins=16)
+        model.fit(self.features, self.target)
+        model.tune(
+            self.features, self.target, ybar_optimizer=Adam(),
+            gain_optimizer=Adam(), threshold_optimizer=Adam(), epochs=1)
+        model.partial_fit(self.features[:5], self.target[:5], grow=True)
+
+        model.fit(self.features[:100], self.target[:100])
+        model.partial_fit(self.features, self.target, grow=True)
+
+        tree = model._compiled
+        self.assertEqual(
+            model._optimizers.ybar.s.shape,
+            (numpy.count_nonzero(tree.is_leaf),))
+        self.assertTrue(numpy.isfinite(model.predict(self.features)).all())
+
+    def test_partial_fit_grow_several_leaves(self):
+        # every leaf receives enough samples to split in the same call
+        model = Fuzzy_Decision_Tree_Regressor(
+            min_count=10, min_impurity_drop=0, max_bins=16)
+        model.fit(self.features[:40], self.target[:40])
+        n_leaves = numpy.count_nonzero(model._compiled.is_leaf)
+
+        model.partial_fit(self.features[40:], self.target[40:], grow=True)
+
+        tree = model._compiled
+        self.assertGreaterEqual(
+            numpy.count_nonzero(tree.is_leaf), n_leaves + 2)
+        self.assertEqual(
+            model._optimizers.ybar.s.shape,
+            (numpy.count_nonzero(tree.is_leaf),))
+        self.assertTrue(numpy.isfinite(model.predict(self.features)).all())
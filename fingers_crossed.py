@@ -1,4 +1,5 @@
 #!/usr/bin/env python3
+import os
 import pandas
 import numpy
 from datools.regression.fuzzy_decision_trees import (
@@ -15,116 +16,226 @@ from datools.gradients.optimizers import (
     Adam,
 )
 
+from datools.containers.disk_cache import Disk_Cache
+from datools.profiling.instruments import Instruments, null_instruments
+
 from matplotlib import pyplot as plt
 
 from configparser import ConfigParser
 from argparse import ArgumentParser
 
-aparser = ArgumentParser(
-    description='Fit fuzzy decision tree'
-)
-
-aparser.add_argument('--csv', type=str, required=True)
-aparser.add_argument('--config', type=str, required=True)
-aparser.add_argument('--output', type=str, required=True)
-args = aparser.parse_args()
-
-config = ConfigParser()
-with open(args.config) as config_file:
-    config.read_file(config_file)
-
-target_col = config['data']['target']
-split_at = int(config['data']['train_test_split'])
-min_count = int(config['architecture']['min_count'])
-min_impurity_drop = int(config['architecture']['min_impurity_drop'])
-batch_size = int(config['tune']['batch_size'])
-epochs = int(config['tune']['epochs'])
-
-df = pandas.read_csv(args.csv)
-for shift_name, shift_value in config['shift'].items():
-    shift_value = int(shift_value)
-    df[shift_name] = df[target_col].shift(shift_value)
-
-df.dropna(inplace=True)
-
-train = df[:split_at].reset_index(drop=True)
-test  = df[split_at:].reset_index(drop=True)
-
-y_train = train[target_col]
-y_test  = test[target_col]
-x_train = train.drop(columns=[target_col])
-x_test  = test.drop(columns=[target_col])
-
-model = Fuzzy_Decision_Tree_Regressor(
-    min_impurity_drop=min_impurity_drop,
-    min_count=min_count)
-
-model.fit(x_train, y_train)
-yhat_crisp_train = model.predict(x_train)
-yhat_crisp_test = model.predict(x_test)
-
-loss = model.tune(
-    x_train, y_train, batch_size=batch_size, epochs=epochs,
-    ybar_optimizer=Adam(), gain_optimizer=Adam(),
-    threshold_optimizer=Adam()
-)
-yhat_tune_train = model.predict(x_train)
-yhat_tune_test = model.predict(x_test)
-
-df_loss = pandas.DataFrame({
-    'mean': loss.mean(axis=1),
-    '90%': numpy.quantile(loss, 0.9, axis=1),
-    '10%': numpy.quantile(loss, 0.1, axis=1)
-}).plot(title='Loss')
-plt.savefig(f'{args.output}/loss.png')
-
-
-df_train = pandas.DataFrame({
-    'y': y_train,
-    'yhat_crisp': yhat_crisp_train,
-    'yhat_tune': yhat_tune_train
-})
-df_train.to_csv(f'{args.output}/train.csv')
-df_train.plot(title='Train')
-plt.savefig(f'{args.output}/train.png')
-
-
-df_test = pandas.DataFrame({
-    'y': y_test,
-    'yhat_crisp': yhat_crisp_test,
-    'yhat_tune': yhat_tune_test
-})
-df_test.to_csv(f'{args.output}/test.csv')
-df_test.plot(title='Test')
-plt.savefig(f'{args.output}/test.png')
-
-metrics = (
-    mape,
-    mapefs,
-    wmape,
-)
-
-pairs = {
-    'train': ({
-        'crisp': yhat_crisp_train,
-        'tune' : yhat_tune_train,
-    }, y_train),
-
-    'test': ({
-        'crisp' : yhat_crisp_test,
-        'tune'  : yhat_tune_test,
-    }, y_test)
-}
-
-with open(f'{args.output}/result', 'w') as result:
-    for train_or_test, (series, actual) in pairs.items():
-            for metric in metrics:
-                crisp_metric = metric(series['crisp'], actual)
-                tune_metric = metric(series['tune'], actual)
-                improved = (crisp_metric - tune_metric) / crisp_metric * 100
-
-                header = f'{train_or_test}-{metric.__name__}'
-                result.write(f'{header}-crisp={crisp_metric}\n')
-                result.write(f'{header}-tune={tune_metric}\n')
-                result.write(f'{header}-improved={improved}\n')
 
+# sections the prepared arrays and the crisp tree depend on
+cached_sections = ('data', 'shift', 'architecture')
+cache_version = '1'
+
+
+def load_dataset(csv_path, config):
+    '''
+    Reads the dataset and adds the shifted target columns
+    :returns: dict of train and test arrays
+    '''
+    target_col = config['data']['target']
+    split_at = int(config['data']['train_test_split'])
+
+    df = pandas.read_csv(csv_path)
+    for shift_name, shift_value in config['shift'].items():
+        shift_value = int(shift_value)
+        df[shift_name] = df[target_col].shift(shift_value)
+
+    df.dropna(inplace=True)
+
+    train = df[:split_at].reset_index(drop=True)
+    test  = df[split_at:].reset_index(drop=True)
+
+    arrays = {
+        'y_train': train[target_col].to_numpy(dtype=float),
+        'y_test': test[target_col].to_numpy(dtype=float),
+        'x_train': train.drop(columns=[target_col]).to_numpy(dtype=float),
+        'x_test': test.drop(columns=[target_col]).to_numpy(dtype=float),
+    }
+
+    return arrays
+
+
+def prepare(csv_path, config, instruments=null_instruments):
+    '''
+    Reads the dataset and fits the crisp tree
+    :param instruments: collects timers and counters of the fit
+    :returns: tuple of the dict of train and test arrays and the model
+    '''
+    min_count = int(config['architecture']['min_count'])
+    min_impurity_drop = int(config['architecture']['min_impurity_drop'])
+    max_bins = config['architecture'].getint('max_bins', fallback=None)
+    dtype = config['architecture'].get('dtype', fallback='float64')
+    membership = config['architecture'].get('membership', fallback='sigmoid')
+
+    arrays = load_dataset(csv_path, config)
+
+    model = Fuzzy_Decision_Tree_Regressor(
+        min_impurity_drop=min_impurity_drop,
+        min_count=min_count,
+        max_bins=max_bins,
+        dtype=dtype,
+        membership=membership)
+    model.instruments = instruments
+
+    model.fit(arrays['x_train'], arrays['y_train'])
+
+    return arrays, model
+
+
+def prepare_cached(csv_path, config, cache, instruments=null_instruments):
+    '''
+    prepare, looked up in the cache by a hash of the csv bytes and of the
+    config sections it depends on
+    '''
+    with open(csv_path, 'rb') as csv_file:
+        parts = [cache_version, csv_file.read()]
+    for section in cached_sections:
+        parts.append(repr(sorted(config[section].items())))
+    key = Disk_Cache.make_key(*parts)
+
+    entry = cache.get(key)
+    if entry is not None:
+        # a private copy, tuning modifies the tree
+        model = Fuzzy_Decision_Tree_Regressor.load(
+            os.path.join(entry.path, 'crisp_tree'), mmap=False)
+        model.instruments = instruments
+        return entry.arrays, model
+
+    (arrays, model) = prepare(csv_path, config, instruments)
+    cache.put(key, arrays, lambda path: model.save(
+        os.path.join(path, 'crisp_tree')))
+
+    return arrays, model
+
+
+def run(csv_path, config_path, output, cache=None, profile=False):
+    '''
+    Fits, tunes and evaluates a model on one dataset, writing the result,
+    CSV and PNG files to the output folder
+    :param cache Disk_Cache: cache of the prepared arrays and the crisp
+        tree, not used if None
+    :param profile bool: if True, writes a summary of timers and counters of
+        fit, tune and predict to the file profile.json
+    '''
+    instruments = Instruments() if profile else null_instruments
+
+    config = ConfigParser()
+    with open(config_path) as config_file:
+        config.read_file(config_file)
+
+    batch_size = int(config['tune']['batch_size'])
+    epochs = int(config['tune']['epochs'])
+    validation_fraction = config['tune'].getfloat(
+        'validation_fraction', fallback=None)
+    patience = config['tune'].getint('patience', fallback=None)
+
+    if cache is None:
+        (arrays, model) = prepare(csv_path, config, instruments)
+    else:
+        (arrays, model) = prepare_cached(
+            csv_path, config, cache, instruments)
+
+    (x_train, y_train, x_test, y_test) = (
+        arrays['x_train'], arrays['y_train'],
+        arrays['x_test'], arrays['y_test'])
+
+    yhat_crisp_train = model.predict(x_train)
+    yhat_crisp_test = model.predict(x_test)
+
+    loss = model.tune(
+        x_train, y_train, batch_size=batch_size, epochs=epochs,
+        ybar_optimizer=Adam(), gain_optimizer=Adam(),
+        threshold_optimizer=Adam(),
+        validation_fraction=validation_fraction, patience=patience
+    )
+    yhat_tune_train = model.predict(x_train)
+    yhat_tune_test = model.predict(x_test)
+
+    df_loss = pandas.DataFrame({
+        'mean': loss.mean(axis=1),
+        '90%': numpy.quantile(loss, 0.9, axis=1),
+        '10%': numpy.quantile(loss, 0.1, axis=1)
+    }).plot(title='Loss')
+    plt.savefig(f'{output}/loss.png')
+
+
+    df_train = pandas.DataFrame({
+        'y': y_train,
+        'yhat_crisp': yhat_crisp_train,
+        'yhat_tune': yhat_tune_train
+    })
+    df_train.to_csv(f'{output}/train.csv')
+    df_train.plot(title='Train')
+    plt.savefig(f'{output}/train.png')
+
+
+    df_test = pandas.DataFrame({
+        'y': y_test,
+        'yhat_crisp': yhat_crisp_test,
+        'yhat_tune': yhat_tune_test
+    })
+    df_test.to_csv(f'{output}/test.csv')
+    df_test.plot(title='Test')
+    plt.savefig(f'{output}/test.png')
+
+    metrics = (
+        mape,
+        mapefs,
+        wmape,
+    )
+
+    pairs = {
+        'train': ({
+            'crisp': yhat_crisp_train,
+            'tune' : yhat_tune_train,
+        }, y_train),
+
+        'test': ({
+            'crisp' : yhat_crisp_test,
+            'tune'  : yhat_tune_test,
+        }, y_test)
+    }
+
+    with open(f'{output}/result', 'w') as result:
+        for train_or_test, (series, actual) in pairs.items():
+                for metric in metrics:
+                    crisp_metric = metric(series['crisp'], actual)
+                    tune_metric = metric(series['tune'], actual)
+                    improved = (crisp_metric - tune_metric) / crisp_metric * 100
+
+                    header = f'{train_or_test}-{metric.__name__}'
+                    result.write(f'{header}-crisp={crisp_metric}\n')
+                    result.write(f'{header}-tune={tune_metric}\n')
+                    result.write(f'{header}-improved={improved}\n')
+
+    plt.close('all')
+
+    if profile:
+        instruments.write(f'{output}/profile.json')
+
+
+if __name__ == '__main__':
+    aparser = ArgumentParser(
+        description='Fit fuzzy decision tree'
+    )
+
+    aparser.add_argument('--csv', type=str, required=True)
+    aparser.add_argument('--config', type=str, required=True)
+    aparser.add_argument('--output', type=str, required=True)
+    aparser.add_argument('--cache-dir', type=str, default='.cache')
+    aparser.add_argument('--cache-size', type=int, default=1024,
+                         help='size limit of the cache in MiB')
+    aparser.add_argument('--no-cache', action='store_true',
+                         help='always read the csv and fit the crisp tree')
+    aparser.add_argument('--profile', action='store_true',
+                         help='write timers and counters to profile.json')
+    args = aparser.parse_args()
+
+    cache = None
+    if not args.no_cache:
+        cache = Disk_Cache(args.cache_dir, args.cache_size << 20)
+
+    run(args.csv, args.config, args.output, cache, args.profile)
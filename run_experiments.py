@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+import os
+import sys
+import traceback
+from glob import glob
+from contextlib import redirect_stderr
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from argparse import ArgumentParser
+
+# workers only write image files, the backend must be set before pyplot
+# is imported by fingers_crossed
+import matplotlib
+matplotlib.use('Agg')
+
+from fingers_crossed import run
+from datools.containers.disk_cache import Disk_Cache
+
+
+class Job:
+    __slots__ = ('name', 'csv_path', 'config_path', 'output', 'n_rows')
+
+    def __init__(self, csv_path, data_dir, output_dir):
+        name = os.path.splitext(os.path.relpath(csv_path, data_dir))[0]
+        self.name = name
+        self.csv_path = csv_path
+        self.config_path = os.path.splitext(csv_path)[0] + '.ini'
+        self.output = os.path.join(output_dir, name)
+        self.n_rows = count_rows(csv_path)
+
+
+def count_rows(csv_path):
+    with open(csv_path, 'rb') as csv_file:
+        return sum(1 for _ in csv_file)
+
+
+def is_up_to_date(job):
+    result_path = os.path.join(job.output, 'result')
+    if not os.path.exists(result_path):
+        return False
+
+    result_time = os.path.getmtime(result_path)
+    return all(
+        os.path.getmtime(path) < result_time
+        for path in (job.csv_path, job.config_path)
+    )
+
+
+def run_job(job, cache, profile):
+    '''
+    Runs one dataset in a worker, its stderr goes to a log file in the
+    output folder like with the Makefile
+    '''
+    os.makedirs(job.output, exist_ok=True)
+    with open(os.path.join(job.output, 'log'), 'w') as log, \
+            redirect_stderr(log):
+        try:
+            run(job.csv_path, job.config_path, job.output, cache, profile)
+        except Exception:
+            traceback.print_exc()
+            raise
+
+
+if __name__ == '__main__':
+    aparser = ArgumentParser(
+        description='Fit fuzzy decision trees on many datasets in a pool of '
+                    'worker processes'
+    )
+
+    aparser.add_argument('csv', type=str, nargs='*',
+                         help='datasets, all of data/*/*.csv if none, the '
+                              'config is the .ini file next to every csv')
+    aparser.add_argument('--data', type=str, default='data')
+    aparser.add_argument('--output', type=str, default='output')
+    aparser.add_argument('--jobs', type=int, default=os.cpu_count())
+    aparser.add_argument('--force', action='store_true',
+                         help='also run datasets with an up-to-date result')
+    aparser.add_argument('--cache-dir', type=str, default='.cache')
+    aparser.add_argument('--cache-size', type=int, default=1024,
+                         help='size limit of the cache in MiB')
+    aparser.add_argument('--no-cache', action='store_true',
+                         help='always read the csv and fit the crisp tree')
+    aparser.add_argument('--profile', action='store_true',
+                         help='write timers and counters to profile.json')
+    args = aparser.parse_args()
+
+    cache = None
+    if not args.no_cache:
+        cache = Disk_Cache(args.cache_dir, args.cache_size << 20)
+
+    csv_paths = args.csv or sorted(glob(os.path.join(args.data, '*', '*.csv')))
+    jobs = [Job(csv_path, args.data, args.output) for csv_path in csv_paths]
+    if not args.force:
+        jobs = [job for job in jobs if not is_up_to_date(job)]
+
+    # longest first, so large datasets do not start last and straggle
+    jobs.sort(key=lambda job: job.n_rows, reverse=True)
+
+    failed = list()
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = {
+            executor.submit(run_job, job, cache, args.profile): job
+            for job in jobs
+        }
+        for future in as_completed(futures):
+            job = futures[future]
+            if future.exception() is None:
+                print(f'finished {job.output}/result')
+            else:
+                print(f'failed {job.name}: {future.exception()!r}')
+                failed.append(job.name)
+
+    sys.exit(1 if failed else 0)